@@ -1,13 +1,14 @@
 # This Python file uses the following encoding: utf-8
-import json
+import threading
 from typing import Union, Any
 
 import PySide6.QtCore
 
-from endpoints.docker_cli_endpoint import DockerCLIEndpoint
+import hosts
+from endpoints import compression
 from ui_host_manager_dialog import Ui_Dialog
 from PySide6.QtWidgets import QDialog
-from PySide6.QtCore import QAbstractListModel, QAbstractTableModel, QModelIndex, QModelRoleData
+from PySide6.QtCore import QAbstractListModel, QAbstractTableModel, QModelIndex, QModelRoleData, QObject, Signal
 from PySide6.QtCore import Qt
 
 
@@ -62,58 +63,60 @@ class HostImageModel(QAbstractTableModel):
     def get_selected(self):
         return [x for x in self.image_list if self._check_stats.get(x.name(), Qt.CheckState.Unchecked) == Qt.CheckState.Checked]
 
+    def set_images(self, images):
+        self.beginResetModel()
+        self.image_list[:] = images
+        self.endResetModel()
 
-class HostItem:
-    def __init__(self, d=None):
-        if d is None:
-            d = dict()
-        self._data = d
-        self._endpoint = None
-        self._image_list = []
-        self._model = None
-
-    def get_name(self):
-        return self._data.get("name", self._data.get("addr", "unnamed"))
-
-    def get(self, key):
-        return self._data.get(key, "")
-
-    def set(self, key, value):
-        self._data[key] = value
-
-    def get_type(self):
-        return self.get("type")
 
-    def get_user(self):
-        return self.get("user")
+class InventorySignal(QObject):
+    # 后台刷新线程通过信号通知界面线程更新镜像列表
+    refreshed = Signal()
+    failed = Signal(str)
 
-    def get_pass(self):
-        return self.get("pass")
 
-    def get_addr(self):
-        return self.get("addr")
-
-    def data(self):
-        return self._data
-
-    def get_endpoint(self):
-        if self._endpoint and self._endpoint.type == self.get_type():
-            return self._endpoint
-        if self.get_type() == "Docker CLI":
-            self._endpoint = DockerCLIEndpoint(self.get_type(), self.get_addr(), self.get_user(), self.get_pass())
-        else:
-            raise RuntimeError("Unknown host type " + self.get_type())
-        return self._endpoint
+class HostItem(hosts.HostItem):
+    def __init__(self, d=None):
+        super().__init__(d)
+        self._image_list = []
+        self._model = None
+        self.signal = InventorySignal()
+        self.signal.refreshed.connect(self._update_model)
+        self._revalidating = False
 
-    def refresh_images(self):
-        model = self.get_endpoint()
-        self._image_list = model.get_images()
-        self._image_list = sorted(self._image_list, key=lambda x: x.name())
+    def _update_model(self):
         if self._model:
-            self._model.dataChanged.emit(QModelIndex(), 0, self._model.rowCount())
+            self._model.set_images(self.inventory.images())
+        else:
+            self._image_list[:] = self.inventory.images()
+
+    def refresh_images(self, full=False) -> bool:
+        changed = super().refresh_images(full)
+        if changed:
+            self.signal.refreshed.emit()
+        return changed
+
+    def revalidate(self, force=False):
+        """
+        缓存过期或force为True时在后台刷新镜像列表，完成后通过signal.refreshed通知。
+        已有刷新在进行时不再重复启动。
+        """
+        if self._revalidating or (self.inventory.is_fresh() and not force):
+            return
+        self._revalidating = True
+
+        def thread():
+            try:
+                self.refresh_images()
+            except Exception as e:
+                self.signal.failed.emit(f"{self.get_name()}：{e}")
+            finally:
+                self._revalidating = False
+        threading.Thread(target=thread, daemon=True).start()
 
     def get_images_model(self):
         if not self._model:
+            self._image_list[:] = self.inventory.images()
             self._model = HostImageModel(self._image_list)
         return self._model
 
@@ -140,17 +143,10 @@ class HostManager:
         self.model = HostListModel(self.host_list)
 
     def save_to_file(self):
-        json.dump([x.data() for x in self.host_list], open("image_transfer.json", "w", encoding='utf8'))
+        hosts.save_hosts(self.host_list)
 
     def load_from_file(self):
-        try:
-            self.host_list = json.load(open("image_transfer.json", encoding='utf8'))
-            self.host_list = [HostItem(x) for x in self.host_list]
-        except FileNotFoundError:
-            pass
-        except json.decoder.JSONDecodeError as e:
-            print("load from json error ", e)
-            pass
+        self.host_list = hosts.load_hosts(factory=HostItem)
 
     def get_model(self):
         return self.model
@@ -166,6 +162,9 @@ class HostManager:
         current_select = 0
 
         ui.host_type.textActivated.connect(lambda x: self.host_list[current_select].set("type", x))
+        ui.host_codec.addItems(compression.CODEC_NAMES)
+        ui.host_codec.textActivated.connect(lambda x: self.host_list[current_select].set("codec", x))
+        ui.host_insecure.clicked.connect(lambda x: self.host_list[current_select].set("insecure", x))
 
         def change_current_edit(i):
             nonlocal current_select
@@ -174,12 +173,21 @@ class HostManager:
             ui.host_addr.setDisabled(current_select >= len(self.host_list))
             ui.host_user.setDisabled(current_select >= len(self.host_list))
             ui.host_pass.setDisabled(current_select >= len(self.host_list))
+            ui.host_codec.setDisabled(current_select >= len(self.host_list))
+            ui.host_rate_limit.setDisabled(current_select >= len(self.host_list))
+            ui.host_link_limits.setDisabled(current_select >= len(self.host_list))
+            ui.host_insecure.setDisabled(current_select >= len(self.host_list))
             if current_select >= len(self.host_list):
                 return
+            ui.host_type.setCurrentText(self.host_list[i].get_type())
             ui.host_name.setText(self.host_list[i].get("name"))
             ui.host_addr.setText(self.host_list[i].get("addr"))
             ui.host_user.setText(self.host_list[i].get("user"))
             ui.host_pass.setText(self.host_list[i].get("pass"))
+            ui.host_codec.setCurrentText(self.host_list[i].get_codec())
+            ui.host_rate_limit.setText(self.host_list[i].get("rate_limit"))
+            ui.host_link_limits.setText(self.host_list[i].get("link_limits"))
+            ui.host_insecure.setChecked(self.host_list[i].get_insecure())
 
         ui.host_list.clicked.connect(lambda x: change_current_edit(x.row()))
 
@@ -191,6 +199,8 @@ class HostManager:
         ui.host_addr.textEdited.connect(text_setter("addr"))
         ui.host_user.textEdited.connect(text_setter("user"))
         ui.host_pass.textEdited.connect(text_setter("pass"))
+        ui.host_rate_limit.textEdited.connect(text_setter("rate_limit"))
+        ui.host_link_limits.textEdited.connect(text_setter("link_limits"))
 
         def add_blank_item():
             model.beginInsertRows(QModelIndex(), model.rowCount(), model.rowCount() + 1)
@@ -0,0 +1,138 @@
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+MB = 1 << 20
+# 允许短时间超出限速的量，按限速下这么多秒的数据计算
+BURST_SECONDS = 0.5
+# 限速时每次最多读取这么多数据再申请令牌，并发的任务按申请的先后轮流得到带宽
+THROTTLE_BLOCK = 256 << 10
+LOCAL = "localhost"
+
+
+class TokenBucket:
+    """
+    令牌桶。按申请的先后排队：每次申请在虚拟时间轴上占用n/rate秒，超前不超过BURST_SECONDS，
+    多个任务共用一个桶时轮流申请，各自得到大致相等的带宽。rate为0表示不限速，可以随时修改。
+    """
+
+    def __init__(self, name: str, rate: float = 0):
+        self.name = name
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self.rate = max(rate or 0, 0)
+            self._next = 0.0
+
+    def reserve(self, n: int) -> float:
+        # 返回需要等待到的时间点
+        with self._lock:
+            if self.rate <= 0:
+                return 0
+            self._next = max(self._next, time.monotonic()) + n / self.rate
+            return self._next - BURST_SECONDS
+
+
+class BandwidthManager:
+    """
+    全局、每台主机、每条链路（两台主机之间）的限速。任务按数据经过的主机顺序给出路径，
+    例如[源主机, LOCAL, 目标主机]，数据同时受全局、路径上每台主机和每段链路的限速。
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket("全局")
+        self._hosts: Dict[str, TokenBucket] = {}
+        self._links: Dict[FrozenSet[str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def set_global(self, rate: float):
+        self.global_bucket.set_rate(rate)
+
+    def set_host(self, addr: str, rate: float):
+        with self._lock:
+            bucket = self._hosts.setdefault(addr, TokenBucket(addr))
+        bucket.set_rate(rate)
+
+    def set_link(self, a: str, b: str, rate: float):
+        with self._lock:
+            bucket = self._links.setdefault(frozenset((a, b)), TokenBucket(f"{a} ↔ {b}"))
+        bucket.set_rate(rate)
+
+    def buckets(self, path: List[str]) -> List[TokenBucket]:
+        with self._lock:
+            ans = [self.global_bucket]
+            ans += [self._hosts[x] for x in path if x in self._hosts]
+            ans += [self._links[k] for k in (frozenset(x) for x in zip(path, path[1:])) if k in self._links]
+        return [x for x in ans if x.rate > 0]
+
+    def limit(self, path: List[str]) -> Optional[float]:
+        # 路径上最低的限速，不限速时返回None
+        rates = [x.rate for x in self.buckets(path)]
+        return min(rates) if rates else None
+
+    def throttle(self, f, path: List[str], is_running: Callable[[], bool] = lambda: True) -> 'ThrottledReader':
+        return ThrottledReader(f, self, path, is_running)
+
+
+class ThrottledReader:
+    # 读取后向路径上的每个令牌桶申请令牌，限速修改后下一次读取立即生效
+    def __init__(self, f, manager: BandwidthManager, path: List[str], is_running: Callable[[], bool]):
+        self.f = f
+        self.manager = manager
+        self.path = path
+        self.is_running = is_running
+
+    def _wait(self, n: int):
+        deadline = max((x.reserve(n) for x in self.manager.buckets(self.path)), default=0)
+        while self.is_running():
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            time.sleep(min(delay, 0.2))
+
+    def read(self, n=-1):
+        if self.manager.buckets(self.path) and (n < 0 or n > THROTTLE_BLOCK):
+            n = THROTTLE_BLOCK
+        d = self.f.read(n)
+        self._wait(len(d))
+        return d
+
+    def readinto(self, b) -> int:
+        view = memoryview(b)
+        if self.manager.buckets(self.path):
+            view = view[:THROTTLE_BLOCK]
+        if hasattr(self.f, "readinto"):
+            n = self.f.readinto(view) or 0
+        else:
+            d = self.f.read(len(view))
+            n = len(d)
+            view[:n] = d
+        self._wait(n)
+        return n
+
+    def __getattr__(self, item):
+        return getattr(self.f, item)
+
+
+def parse_rate(text) -> float:
+    # 配置中的限速以MB/s为单位，空或0表示不限速
+    try:
+        return max(float(text or 0), 0) * MB
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_links(text: str) -> Dict[str, float]:
+    # "10.0.0.2=5, 10.0.0.3=20"，对端地址=MB/s
+    ans = {}
+    for item in (text or "").replace("，", ",").split(","):
+        addr, _, rate = item.partition("=")
+        if addr.strip():
+            ans[addr.strip()] = parse_rate(rate.strip())
+    return ans
+
+
+manager = BandwidthManager()
@@ -0,0 +1,317 @@
+"""
+不启动图形界面的命令行入口，用于脚本、CI和定时任务批量保存、导入和转移镜像。
+主机配置与图形界面共用image_transfer.json，不导入任何Qt模块。
+
+    python cli.py hosts
+    python cli.py images 主机 [镜像...] [--json]
+    python cli.py save 主机 镜像... [--batch | --store 目录] [--codec 压缩方式]
+    python cli.py load 主机 文件或镜像库... [--image 镜像名...]
+    python cli.py sync 源主机 目标主机[,目标主机...] 镜像... [--skip-layers] [--codec 压缩方式] [--relay] [--resumable] [--p2p]
+
+镜像可以写镜像名、通配符（如 "nginx:*"）或镜像ID。--progress json 时进度和日志以每行一个JSON对象输出到标准输出，
+否则以文本输出到标准错误。全部任务成功时退出码为0，有任务失败或无法读取主机的镜像列表为1，参数错误为2；
+出错时--progress json输出 {"event": "error", "message": ...}。
+"""
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sys
+import threading
+from typing import List
+
+import bandwidth
+import hosts
+import integrity
+import layer_store
+import utils
+from progress import ProgressAggregator, ProgressSnapshot, format_eta
+from task_scheduler import TaskScheduler, MAX_WORKERS
+from tasks import BackgroundTask, SaveImageTask, BatchSaveImageTask, LoadImageTask, SyncImageTask, FanoutSyncTask, \
+    DistributeImageTask
+from endpoints import compression
+from endpoints.endpoint import Image
+
+# 命令行下进度输出的频率，每秒一次
+PROGRESS_RATE = 1
+_IMAGE_ID = re.compile(r"^(sha256:)?[0-9a-f]{12,64}$")
+
+
+class UsageError(Exception):
+    pass
+
+
+class HostError(Exception):
+    # 连接主机或读取镜像列表失败
+    pass
+
+
+class Output:
+    """
+    把ProgressAggregator的快照输出到终端或以JSON行输出，供脚本解析。
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        with self._lock:
+            sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+    def text(self, line: str):
+        with self._lock:
+            sys.stderr.write(line + "\n")
+            sys.stderr.flush()
+
+    def error(self, message: str):
+        if self.mode == "json":
+            self.emit({"event": "error", "message": message})
+        else:
+            self.text(f"错误：{message}")
+
+    def snapshot(self, snapshot: ProgressSnapshot):
+        if self.mode == "json":
+            for log in snapshot.logs:
+                self.emit({"event": "log", "message": log})
+            self.emit({
+                "event": "progress",
+                "fraction": round(snapshot.fraction, 4),
+                "rate": int(snapshot.rate),
+                "eta": None if snapshot.eta is None else round(snapshot.eta, 1),
+                "tasks": [{"name": t.name, "state": t.state, "value": t.value, "maximum": t.maximum,
+                           "rate": int(t.rate), "limit": t.limit and int(t.limit)} for t in snapshot.tasks],
+            })
+            return
+        for log in snapshot.logs:
+            self.text(log)
+        if self.mode == "text" and any(t.state == "running" for t in snapshot.tasks):
+            done = sum(1 for t in snapshot.tasks if t.state == "done")
+            self.text(f"[{snapshot.fraction * 100:3.0f}%] {utils.size_str(int(snapshot.rate))}/s  "
+                      f"剩余 {format_eta(snapshot.eta)}  完成 {done}/{len(snapshot.tasks)}")
+
+
+def find_host(host_list: List[hosts.HostItem], name: str) -> hosts.HostItem:
+    for x in host_list:
+        if name in (x.get_name(), x.get_addr()):
+            return x
+    raise UsageError(f"找不到主机：{name}，已配置的主机：{', '.join(x.get_name() for x in host_list)}")
+
+
+def match_images(images: List[Image], patterns: List[str]) -> List[Image]:
+    # 按镜像名（支持通配符）或镜像ID选择，保持镜像列表中的顺序，不重复
+    if not patterns:
+        return images
+    ans = []
+    for p in patterns:
+        image_id = p.split(":")[-1][:12] if _IMAGE_ID.match(p) else None
+        matched = [x for x in images if fnmatch.fnmatchcase(x.name(), p) or x.hash() == image_id]
+        if not matched:
+            raise UsageError(f"找不到镜像：{p}")
+        ans.extend(x for x in matched if x not in ans)
+    return ans
+
+
+def host_images(host: hosts.HostItem, patterns: List[str]) -> List[Image]:
+    try:
+        host.refresh_images(full=True)
+    except Exception as e:
+        raise HostError(f"读取{host.get_name()}的镜像列表失败：{e}") from e
+    return match_images(host.inventory.images(), patterns)
+
+
+def task_state(t: BackgroundTask) -> str:
+    if t.is_finished():
+        return "done"
+    if t.is_failed():
+        return "failed"
+    return "cancelled"
+
+
+def run_tasks(args, output: Output, reporter: ProgressAggregator, tasks: List[BackgroundTask]) -> int:
+    if not tasks:
+        return 0
+    scheduler = TaskScheduler(max_workers=args.jobs)
+    reporter.add_tasks(tasks)
+
+    def on_start(t):
+        reporter.log(f"========= start run {t.name()} ============")
+
+    def on_end(t):
+        reporter.log(f"========= end run {t.name()} ============")
+
+    thread = threading.Thread(target=scheduler.run, args=(tasks, on_start, on_end), daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(1 / PROGRESS_RATE)
+            reporter.flush()
+    except KeyboardInterrupt:
+        reporter.log("已取消")
+        scheduler.cancel()
+        for t in tasks:
+            t.kill()
+        thread.join()
+    reporter.flush(force=True)
+    failed = [t for t in tasks if not t.is_finished()]
+    if args.progress == "json":
+        output.emit({"event": "result", "failed": len(failed),
+                     "tasks": [{"name": t.name(), "state": task_state(t), "seconds": round(t.metrics.seconds, 3)}
+                               for t in tasks]})
+    else:
+        output.text(f"完成{len(tasks) - len(failed)}个任务，失败{len(failed)}个")
+    return 1 if failed else 0
+
+
+def cmd_hosts(args, host_list, output, reporter):
+    for x in host_list:
+        if args.progress == "json":
+            output.emit({"event": "host", "name": x.get_name(), "type": x.get_type(), "addr": x.get_addr(),
+                         "codec": x.get_codec()})
+        else:
+            print(f"{x.get_name()}\t{x.get_type()}\t{x.get_addr()}\t{x.get_codec()}")
+    return 0
+
+
+def cmd_images(args, host_list, output, reporter):
+    host = find_host(host_list, args.host)
+    for x in host_images(host, args.images):
+        if args.json or args.progress == "json":
+            output.emit({"event": "image", "host": host.get_name(), "name": x.name(), "id": x.hash(),
+                         "size": x.size()})
+        else:
+            print(f"{x.name()}\t{x.hash()}\t{x.size_str()}")
+    return 0
+
+
+def cmd_save(args, host_list, output, reporter):
+    host = find_host(host_list, args.host)
+    if args.codec:
+        host.set("codec", args.codec)
+    images = host_images(host, args.images)
+    if args.batch:
+        tasks = [BatchSaveImageTask(reporter, images)]
+    else:
+        tasks = [SaveImageTask(reporter, x, args.store) for x in images]
+    return run_tasks(args, output, reporter, tasks)
+
+
+def cmd_load(args, host_list, output, reporter):
+    host = find_host(host_list, args.host)
+    tasks = []
+    for path in args.paths:
+        if os.path.basename(path) in ("index.json", "oci-layout"):
+            path = os.path.dirname(path) or "."
+        if os.path.isdir(path):
+            if not layer_store.is_store(path):
+                raise UsageError(f"{path}不是镜像库")
+            names = sorted(x.name for x in layer_store.LayerStore(path).images())
+            if args.image:
+                names = [x for x in names if any(fnmatch.fnmatchcase(x, p) for p in args.image)]
+            if not names:
+                raise UsageError(f"镜像库{path}中没有要导入的镜像")
+            tasks.append(LoadImageTask(reporter, host, path, names))
+        elif os.path.isfile(path):
+            tasks.append(LoadImageTask(reporter, host, path))
+        else:
+            raise UsageError(f"找不到文件：{path}")
+    return run_tasks(args, output, reporter, tasks)
+
+
+def cmd_sync(args, host_list, output, reporter):
+    source = find_host(host_list, args.source)
+    targets = [find_host(host_list, x) for x in args.target]
+    if source in targets:
+        raise UsageError("目标主机不能与源主机相同")
+    images = host_images(source, args.images)
+    if len(targets) > 1 and args.p2p:
+        tasks = [DistributeImageTask(reporter, x, targets, args.codec) for x in images]
+    elif len(targets) > 1:
+        # 源主机只导出一次，同时发给所有目标主机
+        tasks = [FanoutSyncTask(reporter, x, targets, args.codec) for x in images]
+    else:
+        tasks = [SyncImageTask(reporter, x, targets[0], args.skip_layers, args.codec, args.relay, args.resumable)
+                 for x in images]
+    return run_tasks(args, output, reporter, tasks)
+
+
+def host_names(value: str) -> List[str]:
+    names = [x.strip() for x in value.split(",") if x.strip()]
+    if not names:
+        raise argparse.ArgumentTypeError("没有指定目标主机")
+    return names
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="image_portal", description="Docker镜像转移工具（命令行）")
+    parser.add_argument("--config", default=hosts.HOSTS_FILE, help="主机配置文件，默认与图形界面共用")
+    parser.add_argument("--jobs", "-j", type=int, default=MAX_WORKERS, help="同时运行的任务数")
+    parser.add_argument("--limit", type=float, default=0, help="总限速MB/s，主机和链路的限速在主机配置中设置")
+    parser.add_argument("--no-verify", action="store_true", help="不在传输时校验镜像的sha256和层的diff id")
+    parser.add_argument("--progress", choices=["text", "json", "none"], default="text",
+                        help="进度输出格式，json为每行一个JSON对象，输出到标准输出")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("hosts", help="列出已配置的主机")
+    p.set_defaults(func=cmd_hosts)
+
+    p = sub.add_parser("images", help="列出主机上的镜像")
+    p.add_argument("host")
+    p.add_argument("images", nargs="*", help="镜像名、通配符或镜像ID，默认全部")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_images)
+
+    p = sub.add_parser("save", help="把镜像保存到当前目录")
+    p.add_argument("host")
+    p.add_argument("images", nargs="+")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--batch", action="store_true", help="所有镜像保存到同一个文件")
+    group.add_argument("--store", help="保存到该目录下的镜像库，相同的层只保存一份")
+    p.add_argument("--codec", choices=compression.CODEC_NAMES)
+    p.set_defaults(func=cmd_save)
+
+    p = sub.add_parser("load", help="把镜像文件或镜像库中的镜像导入到主机")
+    p.add_argument("host")
+    p.add_argument("paths", nargs="+", help="镜像文件或镜像库目录")
+    p.add_argument("--image", action="append", help="只导入镜像库中的这些镜像，可以写通配符，可重复")
+    p.set_defaults(func=cmd_load)
+
+    p = sub.add_parser("sync", help="把镜像从一台主机转移到另一台主机")
+    p.add_argument("source")
+    p.add_argument("target", type=host_names, help="多台目标主机用逗号分隔，源主机只导出一次")
+    p.add_argument("images", nargs="+")
+    p.add_argument("--skip-layers", action="store_true", help="跳过目标主机已有的层")
+    p.add_argument("--codec", choices=compression.CODEC_NAMES)
+    p.add_argument("--relay", action="store_true", help="尝试在两台主机之间直接传输")
+    p.add_argument("--resumable", action="store_true", help="经本机缓存传输，中断后可以继续")
+    p.add_argument("--p2p", action="store_true", help="多台目标主机时由已收到镜像的主机接力发送，数据不经过本机")
+    p.set_defaults(func=cmd_sync)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    output = Output(args.progress)
+    reporter = ProgressAggregator(output.snapshot, frame_rate=PROGRESS_RATE, min_delta=1)
+    host_list = hosts.load_hosts(args.config)
+    bandwidth.manager.set_global(args.limit * bandwidth.MB)
+    integrity.enabled = not args.no_verify
+    try:
+        return args.func(args, host_list, output, reporter)
+    except UsageError as e:
+        output.error(str(e))
+        return 2
+    except HostError as e:
+        output.error(str(e))
+        return 1
+    finally:
+        # ssh_pool依赖paramiko，只有用到SSH的主机才会导入
+        ssh_pool = sys.modules.get("endpoints.ssh_pool")
+        if ssh_pool is not None:
+            ssh_pool.close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import hashlib
+import tarfile
+import tempfile
+from typing import IO, AnyStr, Callable, Iterable, Iterator, List, Optional, Set
+
+from endpoints import compression
+from endpoints.compression import Codec
+
+SPOOL_MEMORY_SIZE = 64 << 20
+
+
+def chain_ids(diff_ids: List[str]) -> List[str]:
+    # 与docker layer store一致：ChainID(n) = sha256(ChainID(n-1) + " " + DiffID(n))
+    ans = []
+    for d in diff_ids:
+        if not ans:
+            ans.append(d)
+        else:
+            ans.append("sha256:" + hashlib.sha256(f"{ans[-1]} {d}".encode()).hexdigest())
+    return ans
+
+
+def skippable_diff_ids(diff_ids: List[str], target_chains: Set[str]) -> Set[str]:
+    # docker load只在整条chain存在时才跳过层文件，同一层出现多次时每一处都必须满足
+    chains = chain_ids(diff_ids)
+    ans = set(diff_ids)
+    for d, c in zip(diff_ids, chains):
+        if c not in target_chains:
+            ans.discard(d)
+    return ans
+
+
+class TarStreamReader(IO[AnyStr]):
+    # 把生成器输出的数据块包装成可读的文件对象
+    def __init__(self, chunks: Iterator[bytes], on_close=None, prefix_sha256: str = None):
+        self.chunks = chunks
+        self.buf = b""
+        self.on_close = on_close
+        self.finished = False
+        self._prefix_sha256 = prefix_sha256
+
+    def readinto(self, b) -> int:
+        while not self.buf:
+            try:
+                self.buf = next(self.chunks)
+            except StopIteration:
+                self.finished = True
+                return 0
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        return n
+
+    def read(self, __n: int = -1) -> AnyStr:
+        if __n is None or __n < 0:
+            return b"".join([self.buf] + list(self.chunks))
+        b = bytearray(__n)
+        n = self.readinto(b)
+        return bytes(b[:n])
+
+    def close(self) -> None:
+        if self.on_close:
+            self.on_close()
+
+    def wait(self) -> int:
+        return 0 if self.finished else -1
+
+    def prefix_sha256(self) -> Optional[str]:
+        return self._prefix_sha256
+
+
+def tar_header(name: str, size: int) -> bytes:
+    # 固定的属性让同一个镜像总是生成同样的字节，断点续传依赖这一点
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = 0
+    return info.tobuf(format=tarfile.GNU_FORMAT)
+
+
+def tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+
+def tar_file(name: str, data: bytes) -> bytes:
+    return tar_header(name, len(data)) + data + tar_padding(len(data))
+
+
+def tar_end() -> bytes:
+    return b"\0" * (tarfile.BLOCKSIZE * 2)
+
+
+def is_layer_member(member: tarfile.TarInfo) -> bool:
+    return member.isfile() and (member.name.endswith("/layer.tar") or member.name.startswith("blobs/sha256/"))
+
+
+class _CountingReader:
+    def __init__(self, f, on_read: Callable[[int], None]):
+        self.f = f
+        self.on_read = on_read
+
+    def read(self, n=-1):
+        d = self.f.read(n)
+        self.on_read(len(d))
+        return d
+
+
+class _CountingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, d):
+        self.f.write(d)
+        self.count += len(d)
+        return len(d)
+
+    def flush(self):
+        pass
+
+
+class LayerFilterResult:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.bytes_skipped = 0
+        self.bytes_on_wire = 0
+        self.layers_skipped = 0
+
+
+def filter_layers(src: IO[AnyStr], dst: IO[AnyStr], skip: Iterable[str],
+                  on_progress: Optional[Callable[[int], None]] = None,
+                  is_running: Callable[[], bool] = lambda: True,
+                  codec: Codec = None, compresslevel: int = 1,
+                  wrap_reader: Callable = None) -> LayerFilterResult:
+    """
+    读取以codec压缩的docker save归档，去掉skip中列出的层后用同样的codec重新压缩写入dst。
+    OCI格式的层文件名就是diff id，可直接跳过；旧格式的layer.tar需要边读边计算sha256，
+    因此先写入临时文件再决定是否发送。wrap_reader包装解压后的数据流，用于校验。
+    """
+    skip = set(skip)
+    result = LayerFilterResult()
+    processed = 0
+
+    def progress(n):
+        nonlocal processed
+        processed += n
+        if on_progress:
+            on_progress(processed)
+
+    codec = codec or compression.get_codec(None)
+    wire = _CountingWriter(dst)
+    gz = codec.open_writer(wire, compresslevel)
+    out = tarfile.open(fileobj=gz, mode="w|", format=tarfile.PAX_FORMAT)
+    reader = codec.open_reader(src)
+    if wrap_reader:
+        reader = wrap_reader(reader)
+    try:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            for member in tar:
+                if not is_running():
+                    break
+                if not member.isfile():
+                    out.addfile(member)
+                    continue
+                data = tar.extractfile(member)
+                if not is_layer_member(member):
+                    out.addfile(member, _CountingReader(data, progress))
+                    result.bytes_sent += member.size
+                    continue
+                if member.name.startswith("blobs/sha256/"):
+                    diff_id = "sha256:" + member.name.rsplit("/", 1)[-1]
+                    if diff_id in skip:
+                        result.bytes_skipped += member.size
+                        result.layers_skipped += 1
+                        progress(member.size)
+                        continue
+                    out.addfile(member, _CountingReader(data, progress))
+                else:
+                    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE) as spool:
+                        h = hashlib.sha256()
+                        while is_running():
+                            d = data.read(1 << 20)
+                            if not d:
+                                break
+                            h.update(d)
+                            spool.write(d)
+                            progress(len(d))
+                        if not is_running():
+                            break
+                        if "sha256:" + h.hexdigest() in skip:
+                            result.bytes_skipped += member.size
+                            result.layers_skipped += 1
+                            continue
+                        spool.seek(0)
+                        out.addfile(member, spool)
+                result.bytes_sent += member.size
+    finally:
+        out.close()
+        gz.close()
+    result.bytes_on_wire = wire.count
+    return result
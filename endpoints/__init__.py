@@ -1,2 +0,0 @@
-import endpoints.endpoint
-import endpoints.docker_cli_endpoint
@@ -0,0 +1,196 @@
+import gzip
+import shlex
+import shutil
+import subprocess
+import threading
+from typing import IO, AnyStr, List, Optional
+
+import stream_pump
+
+AUTO = "auto"
+DEFAULT = "gzip"
+
+
+class Codec:
+    def __init__(self, name: str, ext: str, compress: Optional[List[str]], decompress: Optional[List[str]],
+                 native_load: bool):
+        self.name = name
+        self.ext = ext
+        self.compress = compress
+        self.decompress = decompress
+        # docker load能否直接识别该格式，不需要先解压
+        self.native_load = native_load
+
+    def tools(self) -> List[str]:
+        return [self.compress[0]] if self.compress else []
+
+    def compress_cmd(self) -> str:
+        return shlex.join(self.compress)
+
+    def decompress_cmd(self) -> str:
+        return shlex.join(self.decompress)
+
+    def open_reader(self, src: IO[AnyStr]) -> IO[AnyStr]:
+        # 在本机解压src
+        if self.compress is None:
+            return src
+        if self.name == "gzip":
+            return gzip.GzipFile(fileobj=src, mode="rb")
+        return _ProcessReader(self.decompress, src)
+
+    def open_compressor(self, src: IO[AnyStr]) -> IO[AnyStr]:
+        # 在本机压缩src，返回可以读取压缩后数据的对象
+        if self.compress is None:
+            return src
+        return _ProcessReader(self.compress, src)
+
+    def open_decompress_writer(self, dst: IO[AnyStr]) -> IO[AnyStr]:
+        # 写入的数据在本机解压后写入dst，关闭返回的对象时不会关闭dst
+        if self.compress is None:
+            return _NoClose(dst)
+        return _ProcessWriter(self.decompress, dst)
+
+    def open_writer(self, dst: IO[AnyStr], compresslevel=1) -> IO[AnyStr]:
+        # 在本机压缩后写入dst，关闭返回的对象时不会关闭dst
+        if self.compress is None:
+            return _NoClose(dst)
+        if self.name == "gzip":
+            return gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=compresslevel)
+        return _ProcessWriter(self.compress, dst)
+
+
+# gzip/pigz加-n不写入时间戳，同样的输入总是得到同样的输出，断点续传依赖这一点
+CODECS = {
+    "none": Codec("none", ".tar", None, None, True),
+    "gzip": Codec("gzip", ".tar.gz", ["gzip", "-n", "-c"], ["gzip", "-dc"], True),
+    "pigz": Codec("pigz", ".tar.gz", ["pigz", "-n", "-c"], ["pigz", "-dc"], True),
+    "zstd": Codec("zstd", ".tar.zst", ["zstd", "-T0", "-3", "-c"], ["zstd", "-dc"], False),
+    "lz4": Codec("lz4", ".tar.lz4", ["lz4", "-c"], ["lz4", "-dc"], False),
+}
+CODEC_NAMES = [AUTO] + list(CODECS.keys())
+
+
+def get_codec(name: Optional[str]) -> Codec:
+    return CODECS.get(name or DEFAULT, CODECS[DEFAULT])
+
+
+def codec_for_path(path: str) -> Codec:
+    for ext, name in ((".tar.zst", "zstd"), (".tar.lz4", "lz4"), (".tar.gz", "gzip"), (".tgz", "gzip")):
+        if path.endswith(ext):
+            return CODECS[name]
+    return CODECS["none"]
+
+
+def local_codecs() -> List[str]:
+    return [name for name, c in CODECS.items() if all(shutil.which(t) for t in c.tools())]
+
+
+def auto_select(source, target=None, local=False) -> Codec:
+    """
+    根据链路速度和源主机CPU数选择压缩方式：
+    本机之间不压缩；快速链路用lz4/zstd这类快速压缩；慢速链路用压缩率更高的zstd，其次是多线程的pigz。
+    local为True时数据还要在本机解压和重新压缩，只选本机也有工具的压缩方式。
+    """
+    endpoints = [e for e in (source, target) if e is not None]
+    speeds = [e.measure_link_speed() for e in endpoints]
+    speeds = [s for s in speeds if s is not None]
+    if not speeds:
+        return CODECS["none"]
+    speed = min(speeds)
+    available = set(source.get_codecs())
+    if target is not None:
+        available &= set(target.get_codecs())
+    if local:
+        available &= set(local_codecs()) | {"gzip"}
+    cpus = source.cpu_count()
+    if speed >= 500 << 20:
+        order = ["lz4", "none"]
+    elif speed >= 100 << 20:
+        order = ["lz4", "zstd", "pigz" if cpus > 1 else "none", "none"]
+    else:
+        order = ["zstd", "pigz" if cpus > 1 else "gzip", "gzip"]
+    for name in order:
+        if name == "none" or name in available:
+            return CODECS[name]
+    return CODECS["none"]
+
+
+def resolve(name: Optional[str], source, target=None, local=False) -> Codec:
+    # 选出源主机能压缩、目标主机能解压的压缩方式，不满足时退回gzip；
+    # local为True时本机也要能解压和压缩，gzip用Python的gzip模块，本机总是可用
+    if name == AUTO:
+        return auto_select(source, target, local)
+    codec = get_codec(name)
+    if codec.name not in source.get_codecs():
+        return CODECS[DEFAULT]
+    if local and codec.name not in local_codecs() and codec.name != "gzip":
+        return CODECS[DEFAULT]
+    if target is not None and not codec.native_load and codec.name not in target.get_codecs():
+        return CODECS[DEFAULT]
+    return codec
+
+
+def resolve_all(name: Optional[str], source, targets: list) -> Codec:
+    # 同一份数据发给多台主机时，所有目标主机选出的压缩方式一致才使用，否则退回gzip
+    codecs = {resolve(name, source, t).name for t in targets}
+    return CODECS[codecs.pop()] if len(codecs) == 1 else CODECS[DEFAULT]
+
+
+class _NoClose:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, d):
+        return self.f.write(d)
+
+    def close(self):
+        pass
+
+
+class _ProcessReader:
+    def __init__(self, cmd: List[str], src: IO[AnyStr]):
+        self.pro = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def feed():
+            try:
+                stream_pump.pump(src, self.pro.stdin)
+            finally:
+                self.pro.stdin.close()
+        threading.Thread(target=feed, daemon=True).start()
+
+    def read(self, n=-1):
+        return self.pro.stdout.read(n)
+
+    def readinto(self, b):
+        return self.pro.stdout.readinto(b)
+
+    def close(self):
+        self.pro.stdout.close()
+        self.pro.wait()
+
+
+class _ProcessWriter:
+    def __init__(self, cmd: List[str], dst: IO[AnyStr]):
+        self.pro = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.error = None
+
+        def drain():
+            try:
+                stream_pump.pump(self.pro.stdout, dst)
+            except Exception as e:
+                self.error = e
+        self.thread = threading.Thread(target=drain, daemon=True)
+        self.thread.start()
+
+    def write(self, d):
+        return self.pro.stdin.write(d)
+
+    def flush(self):
+        self.pro.stdin.flush()
+
+    def close(self):
+        self.pro.stdin.close()
+        self.thread.join()
+        self.pro.wait()
+        if self.error:
+            raise self.error
@@ -0,0 +1,317 @@
+import email.utils
+import http.client
+import json
+import os
+import socket
+import threading
+import urllib.parse
+from typing import IO, AnyStr, Callable, List, Optional, Set
+
+import docker_archive
+import inventory
+import resumable
+from endpoints import compression
+from endpoints.compression import Codec
+from endpoints.endpoint import Endpoint, Image
+from endpoints.ssh_pool import SSHConnectionPool
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+CHUNK_SIZE = 1 << 20
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    # 通过open_socket建立底层连接，可以是unix socket、TCP或SSH channel
+    def __init__(self, open_socket: Callable[[], socket.socket]):
+        super().__init__("docker")
+        self._open_socket = open_socket
+
+    def connect(self):
+        self.sock = self._open_socket()
+
+
+def _parse_json_stream(data: bytes) -> List[dict]:
+    # /images/load等接口返回连续的JSON对象，中间不一定有换行
+    decoder = json.JSONDecoder()
+    text = data.decode(errors="replace")
+    ans = []
+    i = 0
+    while i < len(text):
+        while i < len(text) and text[i].isspace():
+            i += 1
+        if i >= len(text):
+            break
+        obj, i = decoder.raw_decode(text, i)
+        ans.append(obj)
+    return ans
+
+
+class ImageReadStream(IO[AnyStr]):
+    def __init__(self, f, response: http.client.HTTPResponse, conn: _HTTPConnection, prefix_sha256: str = None):
+        self.f = f
+        self.response = response
+        self.conn = conn
+        self._prefix_sha256 = prefix_sha256
+
+    def read(self, __n: int = -1) -> AnyStr:
+        return self.f.read(__n)
+
+    def readinto(self, b) -> int:
+        return self.f.readinto(b)
+
+    def close(self) -> None:
+        if self.f is not self.response:
+            self.f.close()
+        self.conn.close()
+
+    def wait(self) -> int:
+        # 分块传输的响应读完后is_closed为True，否则说明连接提前断开
+        return 0 if self.response.isclosed() else -1
+
+    def prefix_sha256(self) -> Optional[str]:
+        return self._prefix_sha256
+
+
+class ImageLoadStream(IO[AnyStr]):
+    """
+    以分块编码把数据写入POST /images/load的请求体，关闭时读取docker的输出并检查错误。
+    """
+
+    def __init__(self, conn: _HTTPConnection):
+        self.conn = conn
+        self.status = None
+
+    def write(self, __s: AnyStr) -> int:
+        n = len(__s)
+        if n:
+            self.conn.send(b"%x\r\n" % n + bytes(__s) + b"\r\n")
+        return n
+
+    def close(self) -> None:
+        if self.status is not None:
+            return
+        self.status = -1
+        try:
+            self.conn.send(b"0\r\n\r\n")
+            response = self.conn.getresponse()
+            messages = _parse_json_stream(response.read())
+        finally:
+            self.conn.close()
+        errors = [x.get("error") or x.get("message") for x in messages if "error" in x]
+        if response.status != 200 or errors:
+            self.status = 1
+            raise RuntimeError("docker load 失败：" + "; ".join(
+                errors or [x.get("message", "") for x in messages] or [response.reason]))
+        self.status = 0
+
+    def abort(self) -> None:
+        # 不发送结束的分块直接断开，docker放弃这次导入
+        if self.status is not None:
+            return
+        self.status = 1
+        self.conn.close()
+
+    def wait(self) -> int:
+        return self.status if self.status is not None else -1
+
+
+class DockerAPIEndpoint(Endpoint):
+    """
+    直接调用Docker Engine HTTP API，不启动docker命令。addr的格式：
+    unix:///var/run/docker.sock、localhost（本机默认socket）、tcp://host:2375，
+    ssh://host:port或host:port（通过SSH在远程执行docker system dial-stdio连接到远程的docker）。
+    简短的请求共用一条持久连接，导入导出数据流各自使用一条连接。
+    """
+
+    def __init__(self, _type, _addr, _user, _pass):
+        super().__init__(_type, _addr, _user, _pass)
+        assert (_type == "Docker API")
+        self.addr = _addr
+        self.user = _user
+        self.password = _pass
+        self._ssh_pool = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._open_socket = self._socket_opener()
+
+    def _socket_opener(self) -> Callable[[], socket.socket]:
+        addr = self.addr or "localhost"
+        if addr == "localhost" or addr.startswith("unix://"):
+            path = addr[len("unix://"):] if addr.startswith("unix://") else DEFAULT_SOCKET
+
+            def open_unix():
+                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                s.connect(path)
+                return s
+            return open_unix
+        if addr.startswith("tcp://"):
+            host, port = self._separate_addr(addr[len("tcp://"):], 2375)
+            return lambda: socket.create_connection((host, port))
+        host, port = self._separate_addr(addr[len("ssh://"):] if addr.startswith("ssh://") else addr, 22)
+
+        def open_ssh():
+            if self._ssh_pool is None:
+                self._ssh_pool = SSHConnectionPool(host, port, self.user, self.password)
+            return self._ssh_pool.open_channel("docker system dial-stdio")
+        return open_ssh
+
+    def _separate_addr(self, addr: str, default_port: int) -> (str, int):
+        if ':' in addr:
+            x = addr.split(':', 2)
+            return x[0], int(x[1])
+        return addr, default_port
+
+    def error(self) -> str:
+        return ""
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        if self._ssh_pool is not None:
+            self._ssh_pool.close()
+
+    def _send(self, method: str, path: str, query=None) -> (http.client.HTTPResponse, bytes):
+        # 在持久连接上发送请求，连接已被服务器关闭时重连一次
+        if query:
+            path += "?" + urllib.parse.urlencode(query, doseq=True)
+        with self._lock:
+            for retry in range(2):
+                if self._conn is None:
+                    self._conn = _HTTPConnection(self._open_socket)
+                try:
+                    self._conn.request(method, path)
+                    response = self._conn.getresponse()
+                    return response, response.read()
+                except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                        BrokenPipeError, ConnectionResetError, EOFError):
+                    self._conn.close()
+                    self._conn = None
+                    if retry:
+                        raise
+
+    def _request(self, method: str, path: str, query=None) -> Optional[bytes]:
+        # 状态码为404时返回None
+        response, data = self._send(method, path, query)
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path}: {response.status} {data.decode(errors='replace')}")
+        return data
+
+    def _get_json(self, path: str, query=None):
+        data = self._request("GET", path, query)
+        return None if data is None else json.loads(data)
+
+    def _images_from_json(self, items: List[dict]) -> List[Image]:
+        ans = []
+        for j in items:
+            for tag in j.get("RepoTags") or []:
+                if "<none>" in tag:
+                    continue
+                ans.append(Image(self, tag, j.get("Size"), inventory.short_id(j.get("Id"))))
+        return ans
+
+    def get_images(self) -> List[Image]:
+        return self._images_from_json(self._get_json("/images/json"))
+
+    def inspect_images(self, refs: List[str]) -> List[Image]:
+        items = []
+        for ref in refs:
+            j = self._get_json(f"/images/{urllib.parse.quote(ref, safe='')}/json")
+            if j is not None:
+                items.append(j)
+        return self._images_from_json(items)
+
+    def server_time(self) -> Optional[int]:
+        try:
+            response, _ = self._send("GET", "/_ping")
+        except OSError:
+            return None
+        date = response.getheader("Date")
+        return int(email.utils.parsedate_to_datetime(date).timestamp()) if date else None
+
+    def get_image_events(self, since: int, until: int) -> Optional[List[dict]]:
+        try:
+            data = self._request("GET", "/events", {
+                "since": str(since),
+                "until": str(until),
+                "filters": json.dumps({"type": ["image"]}),
+            })
+        except (RuntimeError, OSError):
+            return None
+        return _parse_json_stream(data or b"")
+
+    def get_image_layers(self, image: Image) -> List[str]:
+        j = self._get_json(f"/images/{urllib.parse.quote(image.name(), safe='')}/json") or {}
+        return (j.get("RootFS") or {}).get("Layers") or []
+
+    def get_layer_chains(self) -> Set[str]:
+        ans = set()
+        for item in self._get_json("/images/json"):
+            j = self._get_json(f"/images/{item['Id']}/json") or {}
+            ans.update(docker_archive.chain_ids((j.get("RootFS") or {}).get("Layers") or []))
+        return ans
+
+    def get_codecs(self) -> List[str]:
+        # Engine API只传输未压缩的tar，压缩和解压都在本机进行
+        return compression.local_codecs()
+
+    def cpu_count(self) -> int:
+        return os.cpu_count() or 1
+
+    def get_image_stream(self, image: Image, codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        return self.get_images_stream([image], codec, offset)
+
+    def get_images_stream(self, images: List[Image], codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        codec = codec or compression.get_codec(self.codec)
+        conn = _HTTPConnection(self._open_socket)
+        conn.request("GET", "/images/get?" + urllib.parse.urlencode({"names": [x.name() for x in images]}, doseq=True))
+        response = conn.getresponse()
+        if response.status != 200:
+            data = response.read()
+            conn.close()
+            raise RuntimeError(f"docker save 失败：{response.status} {data.decode(errors='replace')}")
+        f = codec.open_compressor(response)
+        prefix = resumable.skip_prefix(f, offset)
+        return ImageReadStream(f, response, conn, prefix)
+
+    def create_image_stream(self, image: Image, codec: Codec = None, log=None) -> IO[AnyStr]:
+        conn = _HTTPConnection(self._open_socket)
+        conn.putrequest("POST", "/images/load?quiet=1")
+        conn.putheader("Content-Type", "application/x-tar")
+        conn.putheader("Transfer-Encoding", "chunked")
+        conn.endheaders()
+        stream = ImageLoadStream(conn)
+        if codec is not None and not codec.native_load:
+            # docker load不认识的格式在本机解压后再发送
+            return _DecompressingLoadStream(codec, stream)
+        return stream
+
+
+class _DecompressingLoadStream(IO[AnyStr]):
+    def __init__(self, codec: Codec, stream: ImageLoadStream):
+        self.stream = stream
+        self.writer = codec.open_decompress_writer(stream)
+
+    def write(self, __s: AnyStr) -> int:
+        return self.writer.write(__s)
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        finally:
+            self.stream.close()
+
+    def abort(self) -> None:
+        self.stream.abort()
+        pro = getattr(self.writer, "pro", None)
+        if pro is not None:
+            pro.kill()
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    def wait(self) -> int:
+        return self.stream.wait()
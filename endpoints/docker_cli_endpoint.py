@@ -1,30 +1,117 @@
 import json
+import random
+import re
+import secrets
+import shlex
+import socket
 import subprocess
-import sys
 import threading
-from typing import IO, AnyStr, List
+import time
+from typing import IO, AnyStr, Callable, List, Optional, Set
 
-import paramiko
 from paramiko.channel import ChannelFile
 
+import docker_archive
+import inventory
+import resumable
+from endpoints import compression
+from endpoints.compression import Codec
 from endpoints.endpoint import Endpoint,  Image
+from endpoints.ssh_pool import SSHConnectionPool
+
+LINK_PROBE_SIZE = 8 << 20
+RELAY_PORT_MIN = 20000
+RELAY_PORT_MAX = 40000
+RELAY_PROBE_TIMEOUT = 5
+RELAY_LISTEN_WAIT = 0.5
+
+
+def _pipeline(cmd: str) -> str:
+    # 管道中任何一个命令失败时整个命令的退出码都不为0，否则docker save中途失败也会返回0
+    return "bash -c " + shlex.quote("set -o pipefail; " + cmd)
 
 
 class SSHChannel(IO[AnyStr]):
     def __init__(self, chan: ChannelFile):
         self.chan = chan
+        self._prefix_sha256 = None
+        self._prefix_ready = threading.Event()
+        self._stderr = ""
+        self._stderr_thread = None
 
     def close(self) -> None:
         self.chan.close()
 
+    def abort(self) -> None:
+        # 不发送EOF直接关闭通道，远程的docker load收到的数据不完整，不会导入
+        self.chan.channel.close()
+
+    def wait(self) -> int:
+        # 远程命令的退出码，连接中断时为-1
+        return self.chan.channel.recv_exit_status()
+
+    def prefix_sha256(self) -> Optional[str]:
+        # 从offset处开始读取时，被跳过部分的sha256，由远程主机计算
+        self._prefix_ready.wait()
+        return self._prefix_sha256
+
+    def error_output(self) -> str:
+        # 远程命令标准错误输出的最后一部分，命令失败时放进错误信息
+        if self._stderr_thread is not None:
+            self._stderr_thread.join(1)
+        return self._stderr.strip()
+
     def read(self, __n: int = ...) -> AnyStr:
         return self.chan.read(__n)
 
+    def readinto(self, b) -> int:
+        return self.chan.readinto(b)
+
     def write(self, __s: AnyStr) -> int:
+        if isinstance(__s, memoryview):
+            __s = __s.tobytes()
         self.chan.write(__s)
         return len(__s)
 
 
+class ProcessStream(IO[AnyStr]):
+    def __init__(self, f, procs: List[subprocess.Popen], prefix_sha256: str = None):
+        self.f = f
+        self.procs = procs
+        self._prefix_sha256 = prefix_sha256
+
+    def close(self) -> None:
+        self.f.close()
+
+    def abort(self) -> None:
+        # 先结束进程再关闭管道，docker load不会读到EOF
+        for p in self.procs:
+            p.kill()
+        try:
+            self.f.close()
+        except OSError:
+            pass
+        for p in self.procs:
+            p.wait()
+
+    def read(self, __n: int = -1) -> AnyStr:
+        return self.f.read(__n)
+
+    def readinto(self, b) -> int:
+        return self.f.readinto(b)
+
+    def write(self, __s: AnyStr) -> int:
+        return self.f.write(__s)
+
+    def wait(self) -> int:
+        # 管道中每个进程都要成功，docker save失败时后面的压缩进程仍会正常退出
+        codes = [p.wait() for p in self.procs]
+        return next((c for c in codes if c != 0), 0)
+
+    def prefix_sha256(self) -> Optional[str]:
+        return self._prefix_sha256
+
+
 class DockerCLIEndpoint(Endpoint):
     def error(self) -> str:
         return ""
@@ -63,55 +150,282 @@ class DockerCLIEndpoint(Endpoint):
             return x[0], int(x[1])
         return addr, 22
 
-    def _connect_ssh(self):
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        addr, port = self._separate_addr(self.addr)
-        ssh.connect(
-            hostname=addr,
-            port=port,
-            username=self.user,
-            password=self.password,
-        )
-        return ssh
+    def _connect_ssh(self) -> SSHConnectionPool:
+        if self._ssh_pool is None:
+            addr, port = self._separate_addr(self.addr)
+            self._ssh_pool = SSHConnectionPool(addr, port, self.user, self.password)
+        return self._ssh_pool
+
+    def close(self):
+        if self._ssh_pool is not None:
+            self._ssh_pool.close()
+
+    def _run(self, cmd: List[str]) -> str:
+        if self.addr == "localhost":
+            return subprocess.check_output(cmd).decode()
+        ssh = self._connect_ssh()
+        _, stdout, stderr = ssh.exec_command(shlex.join(cmd))
+        stderr = stderr.read().decode()
+        if stderr:
+            raise RuntimeError(stderr)
+        return stdout.read().decode()
 
     def get_images(self) -> List[Image]:
+        return self._parse_docker_images(self._run(["docker", "images", "--format", "json"]))
+
+    def server_time(self) -> Optional[int]:
+        try:
+            return int(self._run(["date", "+%s"]).strip())
+        except (ValueError, RuntimeError, OSError, subprocess.CalledProcessError):
+            return None
+
+    def get_image_events(self, since: int, until: int) -> Optional[List[dict]]:
+        try:
+            data = self._run(["docker", "events", "--since", str(since), "--until", str(until),
+                              "--filter", "type=image", "--format", "{{json .}}"])
+        except (RuntimeError, OSError, subprocess.CalledProcessError):
+            return None
+        return [json.loads(x) for x in data.split('\n') if x.strip()]
+
+    def inspect_images(self, refs: List[str]) -> List[Image]:
+        if not refs:
+            return []
+        fmt = '{"Id":{{json .Id}},"Size":{{.Size}},"RepoTags":{{json .RepoTags}}}'
+        # 已被删除的镜像会让docker image inspect报错，忽略错误只取存在的部分
+        data = self._run(["sh", "-c", shlex.join(["docker", "image", "inspect", "--format", fmt] + refs)
+                          + " 2>/dev/null; true"])
+        ans = []
+        for line in data.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            j = json.loads(line)
+            for tag in j.get("RepoTags") or []:
+                ans.append(Image(self, tag, j.get("Size"), inventory.short_id(j.get("Id"))))
+        return ans
+
+    def get_image_layers(self, image: Image) -> List[str]:
+        data = self._run(["docker", "image", "inspect", "--format", "{{json .RootFS.Layers}}", image.name()])
+        return json.loads(data) or []
+
+    def get_layer_chains(self) -> Set[str]:
+        ids = sorted(set(self._run(["docker", "images", "-q", "--no-trunc"]).split()))
+        if not ids:
+            return set()
+        data = self._run(["docker", "image", "inspect", "--format", "{{json .RootFS.Layers}}"] + ids)
+        ans = set()
+        for line in data.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            ans.update(docker_archive.chain_ids(json.loads(line) or []))
+        return ans
+
+    def _which(self, tools: List[str]) -> Set[str]:
+        _, stdout, _ = self._connect_ssh().exec_command(
+            " ; ".join(f"command -v {t} >/dev/null && echo {t}" for t in tools))
+        return set(stdout.read().decode().split())
+
+    def get_codecs(self) -> List[str]:
+        if self._codecs is None:
+            if self.addr == "localhost":
+                self._codecs = compression.local_codecs()
+            else:
+                found = self._which(sorted({t for c in compression.CODECS.values() for t in c.tools()}))
+                self._codecs = [name for name, c in compression.CODECS.items() if all(t in found for t in c.tools())]
+        return self._codecs
+
+    def measure_link_speed(self) -> Optional[float]:
+        # 通过SSH读取一段数据估算链路带宽（字节/秒），本机返回None
         if self.addr == "localhost":
-            data = subprocess.check_output(["docker", "images", "--format", "json"]).decode()
-        else:
-            ssh = self._connect_ssh()
-            _, stdout, stderr = ssh.exec_command("docker images --format json")
-            stderr = stderr.read().decode()
-            if stderr:
-                raise RuntimeError(stderr)
-            data = stdout.read().decode()
-        return self._parse_docker_images(data)
-
-    def get_image_stream(self, image: Image) -> IO[AnyStr]:
+            return None
+        if self._link_speed is None:
+            start = time.monotonic()
+            _, stdout, _ = self._connect_ssh().exec_command(f"head -c {LINK_PROBE_SIZE} /dev/zero")
+            n = len(stdout.read())
+            self._link_speed = n / max(time.monotonic() - start, 1e-6)
+        return self._link_speed
+
+    def cpu_count(self) -> int:
+        if self._cpu_count is None:
+            try:
+                self._cpu_count = int(self._run(["nproc"]).strip())
+            except (ValueError, RuntimeError, OSError, subprocess.CalledProcessError):
+                self._cpu_count = 1
+        return self._cpu_count
+
+    def get_image_stream(self, image: Image, codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        return self.get_images_stream([image], codec, offset)
+
+    def get_images_stream(self, images: List[Image], codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        """
+        offset不为0时跳过前offset字节，跳过部分的sha256可以通过返回值的prefix_sha256()取得，
+        用于断点续传时确认源数据与上次一致。远程主机在本地完成跳过，跳过的数据不会经过网络。
+        """
+        codec = codec or compression.get_codec(self.codec)
+        names = [x.name() for x in images]
         if self.addr == "localhost":
-            pro = subprocess.Popen(["docker", "save", image.name()], stdout=subprocess.PIPE)
-            gz_pro = subprocess.Popen(["gzip"], stdin=pro.stdout, stdout=subprocess.PIPE)
-            return gz_pro.stdout
+            pro = subprocess.Popen(["docker", "save"] + names, stdout=subprocess.PIPE)
+            procs = [pro]
+            out = pro.stdout
+            if codec.compress is not None:
+                gz_pro = subprocess.Popen(codec.compress, stdin=pro.stdout, stdout=subprocess.PIPE)
+                pro.stdout.close()
+                procs.append(gz_pro)
+                out = gz_pro.stdout
+            prefix = resumable.skip_prefix(out, offset)
+            return ProcessStream(out, procs, prefix)
         else:
             ssh = self._connect_ssh()
-            _, stdout, stderr = ssh.exec_command(f"docker save {image.name()} | gzip")
+            cmd = shlex.join(["docker", "save"] + names)
+            if codec.compress is not None:
+                cmd += " | " + codec.compress_cmd()
+            if offset:
+                cmd += f" | {{ dd bs=4M count={offset} iflag=count_bytes,fullblock status=none | sha256sum >&2; cat; }}"
+            _, stdout, stderr = ssh.exec_command(_pipeline(cmd))
+            stream = SSHChannel(stdout)
+            if not offset:
+                stream._prefix_ready.set()
+
             def load_stderr():
-                print(stderr.read().decode(), file=sys.stderr)
-            threading.Thread(target=load_stderr).start()
-            return SSHChannel(stdout)
+                for line in stderr:
+                    m = re.match(r"^([0-9a-f]{64})\s+-$", line.strip())
+                    if m and not stream._prefix_ready.is_set():
+                        stream._prefix_sha256 = m.group(1)
+                        stream._prefix_ready.set()
+                        continue
+                    stream._stderr = (stream._stderr + line)[-4096:]
+                stream._prefix_ready.set()
+            stream._stderr_thread = threading.Thread(target=load_stderr, daemon=True)
+            stream._stderr_thread.start()
+            return stream
 
-    def create_image_stream(self, image: Image) -> IO[AnyStr]:
+    def create_image_stream(self, image: Image, codec: Codec = None, log=None) -> IO[AnyStr]:
+        decompress = codec is not None and not codec.native_load
         if self.addr == "localhost":
-            pro = subprocess.Popen(["docker", "load"], stdin=subprocess.PIPE)
-            return pro.stdin
+            if not decompress:
+                pro = subprocess.Popen(["docker", "load"], stdin=subprocess.PIPE)
+                return ProcessStream(pro.stdin, [pro])
+            de_pro = subprocess.Popen(codec.decompress, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            pro = subprocess.Popen(["docker", "load"], stdin=de_pro.stdout)
+            de_pro.stdout.close()
+            return ProcessStream(de_pro.stdin, [de_pro, pro])
         else:
             ssh = self._connect_ssh()
-            stdin, _, _ = ssh.exec_command(f"docker load")
+            cmd = "docker load"
+            if decompress:
+                cmd = codec.decompress_cmd() + " | " + cmd
+            stdin, _, _ = ssh.exec_command(_pipeline(cmd))
             return SSHChannel(stdin)
 
+    def _listen(self, port: int, codec: Codec, token: str):
+        # 在本主机上监听port，连接方先发送token，一致时才把后面的数据交给docker load，其他人连上来不能导入镜像；
+        # token经SSH的标准输入传入，不出现在命令行中。第一行输出是shell的pid，用于清理
+        load, rest = "docker load", ""
+        if codec.decompress is not None and not codec.native_load:
+            load, rest = codec.decompress_cmd(), " | docker load"
+        script = (f"echo $$; IFS= read -r expected; (nc -l -p {port} 2>/dev/null || nc -l {port}) | "
+                  f'{{ IFS= read -r -n {len(token)} tok; [ "$tok" = "$expected" ] || exit 1; exec {load}; }}{rest}')
+        stdin, stdout, stderr = self._connect_ssh().exec_command("bash -c " + shlex.quote(script))
+        stdin.write(token + "\n")
+        stdin.flush()
+        pid = stdout.readline().strip()
+        time.sleep(RELAY_LISTEN_WAIT)
+        if stdout.channel.exit_status_ready():
+            return None
+        return pid, stdout, stderr
+
+    def _image_id(self, name: str) -> str:
+        return self._run(["docker", "image", "inspect", "--format", "{{.Id}}", name]).strip()
+
+    def _kill(self, pid: str):
+        self._connect_ssh().exec_command(f"pkill -P {shlex.quote(pid)}")
+
+    def relay_image(self, image: Image, target: Endpoint, codec: Codec,
+                    on_progress: Callable[[int], None] = None,
+                    is_running: Callable[[], bool] = lambda: True) -> Optional[int]:
+        """
+        在两台远程主机之间直接传输镜像：目标主机用nc监听，源主机把docker save的输出写入/dev/tcp，
+        本机只负责启动命令和解析dd输出的进度。两台主机之间不通或缺少工具时返回None，由调用方退回普通传输。
+        数据前面带有本次传输的随机token，目标主机只接受token一致的连接；导入后核对两台主机上的镜像ID。
+        """
+        if not isinstance(target, DockerCLIEndpoint) or "localhost" in (self.addr, target.addr):
+            return None
+        if not {"bash", "timeout", "dd"} <= self._which(["bash", "timeout", "dd"]) \
+                or not {"bash", "nc", "pkill"} <= target._which(["bash", "nc", "pkill"]):
+            return None
+        host, ssh_port = target._separate_addr(target.addr)
+        _, stdout, _ = self._connect_ssh().exec_command(
+            f"timeout {RELAY_PROBE_TIMEOUT} bash -c {shlex.quote(f': > /dev/tcp/{host}/{ssh_port}')} && echo ok")
+        if stdout.read().decode().strip() != "ok":
+            return None
+        image_id = self._image_id(image.name())
+        token = secrets.token_hex(16)
+        listener = None
+        port = 0
+        for _ in range(3):
+            port = random.randint(RELAY_PORT_MIN, RELAY_PORT_MAX)
+            listener = target._listen(port, codec, token)
+            if listener:
+                break
+        if not listener:
+            return None
+        pid, load_stdout, load_stderr = listener
+
+        send = shlex.join(["docker", "save", image.name()])
+        if codec.compress is not None:
+            send += " | " + codec.compress_cmd()
+        send = (f'set -o pipefail; IFS= read -r tok; {{ printf %s "$tok"; {send}; }} '
+                f"| dd bs=1M status=progress > /dev/tcp/{host}/{port}")
+        stdin, stdout, stderr = self._connect_ssh().exec_command("bash -c " + shlex.quote(send))
+        stdin.write(token + "\n")
+        stdin.flush()
+        chan = stdout.channel
+        chan.settimeout(1)
+        cnt = 0
+        err = b""
+        try:
+            while True:
+                if not is_running():
+                    chan.close()
+                    target._kill(pid)
+                    return cnt
+                try:
+                    d = chan.recv_stderr(4096)
+                except socket.timeout:
+                    continue
+                if not d:
+                    break
+                err = (err + d)[-4096:]
+                for line in re.split(rb"[\r\n]", d):
+                    m = re.match(rb"\s*(\d+) bytes", line)
+                    if m:
+                        cnt = max(int(m.group(1)) - len(token), 0)
+                        if on_progress:
+                            on_progress(cnt)
+            status = chan.recv_exit_status()
+        except BaseException:
+            target._kill(pid)
+            raise
+        if status != 0:
+            target._kill(pid)
+            if cnt == 0:
+                return None
+            raise RuntimeError(err.decode(errors="replace"))
+        if load_stdout.channel.recv_exit_status() != 0:
+            raise RuntimeError(load_stderr.read().decode(errors="replace") or "目标主机拒绝了连接或docker load失败")
+        loaded = target._image_id(image.name())
+        if loaded != image_id:
+            raise RuntimeError(f"{target.addr}导入后{image.name()}的镜像ID为{loaded}，与源主机的{image_id}不一致")
+        return cnt
+
     def __init__(self, _type, _addr, _user, _pass):
         super().__init__(_type, _addr, _user, _pass)
         assert (_type == "Docker CLI")
         self.addr = _addr
         self.user = _user
         self.password = _pass
+        self._ssh_pool = None
+        self._codecs = None
+        self._link_speed = None
+        self._cpu_count = None
@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import List, IO, AnyStr
+from typing import List, IO, AnyStr, Set, Optional, Callable
 
 import utils
 
@@ -23,26 +23,68 @@ class Image:
     def size_str(self) -> str:
         return utils.size_str(self.size())
 
-    def get_stream(self) -> IO[AnyStr]:
-        return self.endpoint.get_image_stream(self)
+    def get_stream(self, codec=None, offset=0) -> IO[AnyStr]:
+        return self.endpoint.get_image_stream(self, codec, offset)
 
 
 class Endpoint:
     def __init__(self, _type, _addr, _user, _pass):
         self.type = _type
+        self.codec = "gzip"
 
     @abstractmethod
     def get_images(self) -> List[Image]:
         pass
 
+    def server_time(self) -> Optional[int]:
+        # 主机上的当前时间（秒），不支持增量刷新镜像列表时返回None
+        return None
+
+    def get_image_events(self, since: int, until: int) -> Optional[List[dict]]:
+        # since到until之间的镜像事件（docker events的JSON格式），不支持时返回None
+        return None
+
+    def inspect_images(self, refs: List[str]) -> List[Image]:
+        # 查询指定名称或ID的镜像，不存在的忽略
+        return []
+
+    @abstractmethod
+    def get_image_stream(self, image: Image, codec=None, offset=0) -> IO[AnyStr]:
+        pass
+
+    def get_images_stream(self, images: List[Image], codec=None, offset=0) -> IO[AnyStr]:
+        # 把多个镜像导出到同一个归档中，共享的层只保存一次
+        raise NotImplementedError(f"{self.type} 不支持批量导出")
+
+    @abstractmethod
+    def create_image_stream(self, image: Image, codec=None, log: Callable[[str], None] = None) -> IO[AnyStr]:
+        # log为任务的日志，导入过程中的提示写到这里
+        pass
+
     @abstractmethod
-    def get_image_stream(self, image: Image) -> IO[AnyStr]:
+    def get_image_layers(self, image: Image) -> List[str]:
         pass
 
     @abstractmethod
-    def create_image_stream(self, image: Image) -> IO[AnyStr]:
+    def get_layer_chains(self) -> Set[str]:
         pass
 
     @abstractmethod
     def error(self) -> str:
         pass
+
+    def get_codecs(self) -> List[str]:
+        return ["none", "gzip"]
+
+    def measure_link_speed(self) -> Optional[float]:
+        return None
+
+    def cpu_count(self) -> int:
+        return 1
+
+    def relay_image(self, image: Image, target: 'Endpoint', codec, on_progress=None,
+                    is_running=lambda: True) -> Optional[int]:
+        return None
+
+    def close(self):
+        pass
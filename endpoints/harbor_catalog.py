@@ -0,0 +1,134 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from endpoints.registry_client import POOL_SIZE, RegistryClient
+
+API_PREFIX = "/api/v2.0/"
+# Harbor允许的最大分页大小
+PAGE_SIZE = 100
+# 同时列出artifact的仓库数；分页请求使用另一个线程池，避免外层任务等待内层任务时占满线程
+REPO_WORKERS = POOL_SIZE // 2
+PAGE_WORKERS = POOL_SIZE // 2
+
+ARTIFACT_PARAMS = {
+    'with_tag': 'true',
+    'with_label': 'false',
+    'with_scan_overview': 'false',
+    'with_signature': 'false',
+    'with_immutable_status': 'false',
+    'with_accessory': 'false',
+}
+
+
+class HarborArtifact:
+    def __init__(self, repo: str, digest: str, size: int, tags: List[Tuple[str, str]]):
+        # repo为带项目名的完整仓库名，tags为(tag名, push_time)
+        self.repo = repo
+        self.digest = digest
+        self.size = size
+        self.tags = tags
+
+
+class HarborCatalog:
+    """
+    Harbor API（/api/v2.0）的项目、仓库、artifact列表。与registry共用RegistryClient的连接池，
+    每个列表先取第一页得到X-Total-Count，其余页并行获取，各仓库的artifact也并行获取。
+    响应按URL缓存，再次请求时带上If-None-Match/If-Modified-Since，返回304时使用缓存；
+    仓库的update_time和artifact_count没有变化时直接使用上次的artifact列表，不再请求。
+    """
+
+    def __init__(self, client: RegistryClient):
+        self.client = client
+        self.session = client.session
+        self._cache: Dict[str, Tuple[Optional[str], Optional[str], list, int]] = {}
+        self._artifacts: Dict[str, Tuple[tuple, List[HarborArtifact]]] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+
+    def _get(self, path: str, params: dict) -> Tuple[list, int]:
+        # 返回本页数据和总数
+        url = self.client.base + API_PREFIX + path
+        key = url + "?" + urlencode(sorted(params.items()))
+        with self._lock:
+            cached = self._cache.get(key)
+            self.requests += 1
+        headers = {}
+        if cached is not None:
+            if cached[0]:
+                headers["If-None-Match"] = cached[0]
+            if cached[1]:
+                headers["If-Modified-Since"] = cached[1]
+        resp = self.session.get(url, params=params, headers=headers, auth=self.client._basic_auth())
+        if resp.status_code == 304 and cached is not None:
+            with self._lock:
+                self.not_modified += 1
+            return cached[2], cached[3]
+        if not 200 <= resp.status_code < 300:
+            raise RuntimeError(f"获取{path}失败：{resp.status_code} {resp.text[:200]}")
+        data = resp.json() or []
+        total = int(resp.headers.get("X-Total-Count") or len(data))
+        etag, modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        if etag or modified:
+            with self._lock:
+                self._cache[key] = (etag, modified, data, total)
+        return data, total
+
+    def _list(self, path: str, params: dict = None, pool: ThreadPoolExecutor = None) -> list:
+        params = dict(params or {}, page=1, page_size=PAGE_SIZE)
+        ans, total = self._get(path, params)
+        pages = math.ceil(total / PAGE_SIZE)
+        if pages > 1 and pool is not None:
+            rest = pool.map(lambda p: self._get(path, dict(params, page=p))[0], range(2, pages + 1))
+            for data in rest:
+                ans = ans + data
+        else:
+            page = 1
+            while page < pages:
+                page += 1
+                ans = ans + self._get(path, dict(params, page=page))[0]
+        return ans
+
+    def projects(self, pool: ThreadPoolExecutor = None) -> List[str]:
+        return [x["name"] for x in self._list("projects", {"with_detail": "false"}, pool)]
+
+    def repositories(self, project: str, pool: ThreadPoolExecutor = None) -> List[dict]:
+        return self._list(f"projects/{quote(project, safe='')}/repositories", None, pool)
+
+    def artifacts(self, repo: dict, pool: ThreadPoolExecutor = None) -> List[HarborArtifact]:
+        # repo为repositories()返回的一项，name中带项目名
+        name = repo["name"]
+        version = (repo.get("update_time"), repo.get("artifact_count"))
+        with self._lock:
+            cached = self._artifacts.get(name)
+        if cached is not None and cached[0] == version and version[0]:
+            return cached[1]
+        project, _, rest = name.partition("/")
+        # 仓库名中的"/"需要编码两次
+        path = f"projects/{quote(project, safe='')}/repositories/{quote(quote(rest, safe=''), safe='')}/artifacts"
+        ans = []
+        for a in self._list(path, ARTIFACT_PARAMS, pool):
+            tags = [(t["name"], t.get("push_time") or "") for t in a.get("tags") or []]
+            ans.append(HarborArtifact(name, a["digest"], a.get("size") or 0, tags))
+        with self._lock:
+            self._artifacts[name] = (version, ans)
+        return ans
+
+    def list_artifacts(self, projects: List[str] = None) -> List[HarborArtifact]:
+        """
+        列出指定项目（默认为所有可见项目）中所有仓库的artifact。
+        """
+        with ThreadPoolExecutor(PAGE_WORKERS) as pages, ThreadPoolExecutor(REPO_WORKERS) as repos:
+            projects = projects or self.projects(pages)
+            repo_lists = repos.map(lambda p: self.repositories(p, pages), projects)
+            all_repos = [r for rs in repo_lists for r in rs]
+            with self._lock:
+                # 已经被删除的仓库不再保留缓存
+                names = {r["name"] for r in all_repos}
+                for name in list(self._artifacts):
+                    if name not in names:
+                        del self._artifacts[name]
+            return [a for arts in repos.map(lambda r: self.artifacts(r, pages), all_repos) for a in arts]
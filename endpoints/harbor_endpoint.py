@@ -0,0 +1,28 @@
+from typing import List
+
+from endpoints.endpoint import Image
+from endpoints.harbor_catalog import HarborCatalog
+from endpoints.registry_endpoint import RegistryEndpoint, RegistryImage
+
+
+class HarborEndpoint(RegistryEndpoint):
+    """
+    Harbor仓库。镜像列表通过Harbor API获取（见HarborCatalog），比逐个仓库读取registry的tag和manifest快得多；
+    导入导出与Registry相同。addr为harbor.example.com或harbor.example.com/项目1,项目2，只列出指定的项目。
+    """
+
+    def __init__(self, _type, _addr, _user, _pass, insecure=False):
+        assert (_type == "Harbor")
+        scheme, _, rest = _addr.rpartition("://")
+        host, _, projects = rest.partition("/")
+        super().__init__(_type, f"{scheme}://{host}" if scheme else host, _user, _pass, insecure)
+        self.projects = [x.strip() for x in projects.split(",") if x.strip()]
+        self.catalog = HarborCatalog(self.client)
+
+    def get_images(self) -> List[Image]:
+        ans = []
+        for artifact in self.catalog.list_artifacts(self.projects):
+            for tag, _ in artifact.tags:
+                ans.append(RegistryImage(self, f"{artifact.repo}:{tag}", artifact.size,
+                                         artifact.digest.split(":")[-1][:12], artifact.repo, tag))
+        return ans
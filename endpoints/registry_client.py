@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+import warnings
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InsecureRequestWarning
+
+POOL_SIZE = 16
+TOKEN_MARGIN = 10
+DOCKER_HUB = "registry-1.docker.io"
+
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+])
+
+
+def split_reference(ref: str) -> Tuple[str, str]:
+    # "repo/name:tag"或"repo/name@sha256:..."拆分为仓库名和tag/digest
+    if "@" in ref:
+        repo, tag = ref.split("@", 1)
+        return repo, tag
+    repo, _, tag = ref.rpartition(":")
+    if not repo or "/" in tag:
+        return ref, "latest"
+    return repo, tag
+
+
+class _InsecureAdapter(HTTPAdapter):
+    # 设置了REQUESTS_CA_BUNDLE等环境变量时requests会忽略session.verify=False，在这里强制不校验
+    def send(self, request, **kwargs):
+        kwargs["verify"] = False
+        return super().send(request, **kwargs)
+
+
+class RegistryClient:
+    """
+    Docker Registry v2 HTTP客户端。所有请求共用一个带连接池的Session；
+    遇到401时按WWW-Authenticate取得token，token按scope缓存到过期前再重新获取。
+    默认校验TLS证书；insecure为True时不校验（内网使用自签名证书的Harbor），只对这台主机不显示警告。
+    """
+
+    def __init__(self, addr: str, user: str = "", password: str = "", insecure: bool = False):
+        if addr.startswith("http://") or addr.startswith("https://"):
+            self.base = addr.rstrip("/")
+        else:
+            self.base = "https://" + addr.rstrip("/")
+        self.host = self.base.split("://", 1)[1]
+        self.user = user
+        self.password = password
+        self.session = requests.Session()
+        adapter = (_InsecureAdapter if insecure else HTTPAdapter)(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.verify = not insecure
+        if insecure:
+            hostname = urlsplit(self.base).hostname or self.host
+            warnings.filterwarnings("ignore", f"Unverified HTTPS request is being made to host '{re.escape(hostname)}'",
+                                    InsecureRequestWarning)
+        self._challenge: Optional[Dict[str, str]] = None
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def is_docker_hub(self) -> bool:
+        return self.host in (DOCKER_HUB, "docker.io", "index.docker.io")
+
+    def _basic_auth(self):
+        return (self.user, self.password) if self.user else None
+
+    def _token(self, scope: str, refresh=False) -> Optional[str]:
+        with self._lock:
+            cached = self._tokens.get(scope)
+            if cached and not refresh and cached[1] > time.monotonic():
+                return cached[0]
+            challenge = self._challenge
+        if challenge is None or "realm" not in challenge:
+            return None
+        # 跨仓库挂载需要同时申请多个仓库的权限，scope之间以空格分隔
+        params = {"scope": scope.split(" ")}
+        if challenge.get("service"):
+            params["service"] = challenge["service"]
+        resp = self.session.get(challenge["realm"], params=params, auth=self._basic_auth())
+        resp.raise_for_status()
+        j = resp.json()
+        token = j.get("token") or j.get("access_token")
+        expires = time.monotonic() + max(int(j.get("expires_in") or 60) - TOKEN_MARGIN, 1)
+        with self._lock:
+            self._tokens[scope] = (token, expires)
+        return token
+
+    def _headers(self, scope: str, headers: Optional[dict], refresh=False) -> dict:
+        headers = dict(headers or {})
+        if self._challenge is not None and self._challenge.get("scheme") == "bearer":
+            token = self._token(scope, refresh)
+            if token:
+                headers["Authorization"] = "Bearer " + token
+        return headers
+
+    def _auth(self):
+        if self._challenge is not None and self._challenge.get("scheme") == "basic":
+            return self._basic_auth()
+        return None
+
+    def request(self, method: str, path: str, scope: str, headers: dict = None, **kwargs) -> requests.Response:
+        # path为"/v2/..."形式或完整URL（上传时registry返回的Location）
+        url = path if path.startswith("http") else self.base + path
+        resp = self.session.request(method, url, headers=self._headers(scope, headers), auth=self._auth(), **kwargs)
+        if resp.status_code == 401:
+            self._parse_challenge(resp.headers.get("WWW-Authenticate", ""))
+            resp.close()
+            resp = self.session.request(method, url, headers=self._headers(scope, headers, True),
+                                        auth=self._auth(), **kwargs)
+        return resp
+
+    def _parse_challenge(self, header: str):
+        scheme = header.split(" ", 1)[0].lower()
+        challenge = dict(re.findall(r'(\w+)="([^"]*)"', header))
+        challenge["scheme"] = scheme
+        with self._lock:
+            self._challenge = challenge
+            self._tokens.clear()
+
+    def get_manifest(self, repo: str, reference: str) -> requests.Response:
+        resp = self.request("GET", f"/v2/{repo}/manifests/{reference}", f"repository:{repo}:pull",
+                            headers={"Accept": MANIFEST_TYPES})
+        if resp.status_code != 200:
+            raise RuntimeError(f"获取{repo}:{reference}的manifest失败：{resp.status_code} {resp.text[:200]}")
+        return resp
+
+    def get_blob(self, repo: str, digest: str, stream=True) -> requests.Response:
+        resp = self.request("GET", f"/v2/{repo}/blobs/{digest}", f"repository:{repo}:pull", stream=stream)
+        if resp.status_code != 200:
+            raise RuntimeError(f"下载{repo}的{digest[:19]}失败：{resp.status_code}")
+        return resp
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import platform
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, AnyStr, Dict, Iterator, List, Optional, Set
+
+import docker_archive
+import resumable
+from endpoints import compression
+from endpoints.compression import Codec
+from endpoints.endpoint import Endpoint, Image
+from endpoints.registry_client import RegistryClient, split_reference
+from endpoints.registry_push import RegistryPushStream
+
+# 同时下载的blob数，以及每个blob在内存中最多缓冲的数据块数
+DOWNLOAD_WORKERS = 4
+BUFFER_CHUNKS = 64
+CHUNK_SIZE = 1 << 20
+LIST_WORKERS = 16
+# 推送前读取目标仓库中这么多个tag的manifest，用来找出已经存在的层
+KNOWN_TAGS = 16
+DEFAULT_PLATFORM = "linux/amd64"
+
+_ARCH = {"x86_64": "amd64", "aarch64": "arm64", "arm64": "arm64"}
+
+
+class RegistryImage(Image):
+    def __init__(self, endpoint, name, size, _hash, repo, reference):
+        super().__init__(endpoint, name, size, _hash)
+        self.repo = repo
+        self.reference = reference
+
+
+class _BlobBuffer:
+    # 下载线程写入、tar生成器读取的有界缓冲区，后面的blob可以提前下载
+    def __init__(self):
+        self.chunks = queue.Queue(BUFFER_CHUNKS)
+        self.cancelled = threading.Event()
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            item = self.chunks.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+class RegistryEndpoint(Endpoint):
+    """
+    以Docker Registry v2为源或目标。导出时按manifest并行下载各层blob，直接拼接成docker load能识别的tar流，
+    层保持registry中的gzip压缩（docker load会自动解压），不写临时文件。导入见RegistryPushStream。
+    addr为registry地址，可带http://前缀；user/pass用于登录token服务；insecure为True时不校验TLS证书。
+    """
+
+    def __init__(self, _type, _addr, _user, _pass, insecure=False):
+        super().__init__(_type, _addr, _user, _pass)
+        assert (_type in ("Registry", "Harbor"))
+        self.addr = _addr
+        self.codec = "none"
+        self.client = RegistryClient(_addr, _user, _pass, insecure)
+        machine = _ARCH.get(platform.machine().lower())
+        self.platform = f"linux/{machine}" if machine else DEFAULT_PLATFORM
+        # 已知包含某个blob的仓库，推送时用于跨仓库挂载
+        self._blob_repos: Dict[str, Set[str]] = {}
+        self._blob_lock = threading.Lock()
+
+    def error(self) -> str:
+        return ""
+
+    def close(self):
+        self.client.close()
+
+    def _full_name(self, repo: str, tag: str) -> str:
+        # docker pull得到的镜像名：Docker Hub省略主机名和library/前缀
+        if self.client.is_docker_hub():
+            if repo.startswith("library/"):
+                repo = repo[len("library/"):]
+            return f"{repo}:{tag}"
+        return f"{self.client.host}/{repo}:{tag}"
+
+    def _resolve_manifest(self, repo: str, reference: str) -> dict:
+        manifest = self.client.get_manifest(repo, reference).json()
+        if "manifests" in manifest:
+            # 多平台镜像选择与本机相同的平台，没有时取第一个
+            entries = manifest["manifests"]
+            chosen = next((m for m in entries
+                           if "{}/{}".format(m.get("platform", {}).get("os"),
+                                             m.get("platform", {}).get("architecture")) == self.platform),
+                          entries[0])
+            manifest = self.client.get_manifest(repo, chosen["digest"]).json()
+        if "layers" not in manifest:
+            raise RuntimeError(f"{repo}:{reference}的manifest格式不支持")
+        for layer in manifest["layers"]:
+            self.remember_blob(layer["digest"], repo)
+        return manifest
+
+    def remember_blob(self, digest: str, repo: str):
+        with self._blob_lock:
+            self._blob_repos.setdefault(digest, set()).add(repo)
+
+    def blob_sources(self, digest: str, exclude: str = None) -> List[str]:
+        with self._blob_lock:
+            return sorted(x for x in self._blob_repos.get(digest, ()) if x != exclude)
+
+    def split_tag(self, ref: str) -> (str, str):
+        # 去掉镜像名中的registry主机名，得到本registry中的仓库名和tag
+        parts = ref.split("/")
+        if len(parts) > 1 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+            ref = "/".join(parts[1:])
+        return split_reference(ref)
+
+    def known_layers(self, repo: str, tag: str = None) -> Dict[str, dict]:
+        """
+        返回目标仓库中已有镜像的diff id到层描述（digest、size）的映射。
+        重新构建的镜像中没有变化的层可以直接引用，不需要在本机压缩后比较digest。
+        """
+        tags = self._tags(repo)
+        if tag in tags:
+            tags.remove(tag)
+            tags.append(tag)
+        tags = tags[-KNOWN_TAGS:]
+
+        def load(t):
+            try:
+                manifest = self._resolve_manifest(repo, t)
+                config = self.client.get_blob(repo, manifest["config"]["digest"], stream=False).json()
+            except (RuntimeError, ValueError):
+                return {}
+            diff_ids = (config.get("rootfs") or {}).get("diff_ids") or []
+            return dict(zip(diff_ids, manifest["layers"]))
+
+        ans = {}
+        with ThreadPoolExecutor(LIST_WORKERS) as pool:
+            for m in pool.map(load, tags):
+                ans.update(m)
+        return ans
+
+    def _catalog(self) -> List[str]:
+        repos = []
+        path = "/v2/_catalog?n=1000"
+        while path:
+            resp = self.client.request("GET", path, "registry:catalog:*")
+            if resp.status_code != 200:
+                raise RuntimeError(f"获取仓库列表失败：{resp.status_code} {resp.text[:200]}")
+            repos += resp.json().get("repositories") or []
+            path = resp.links.get("next", {}).get("url")
+        return repos
+
+    def _tags(self, repo: str) -> List[str]:
+        resp = self.client.request("GET", f"/v2/{repo}/tags/list", f"repository:{repo}:pull")
+        if resp.status_code != 200:
+            return []
+        return resp.json().get("tags") or []
+
+    def _image(self, repo: str, tag: str) -> Optional[RegistryImage]:
+        try:
+            manifest = self._resolve_manifest(repo, tag)
+        except RuntimeError:
+            return None
+        size = sum(x.get("size", 0) for x in manifest["layers"])
+        config = manifest["config"]["digest"]
+        return RegistryImage(self, f"{repo}:{tag}", size, config.split(":")[-1][:12], repo, tag)
+
+    def get_images(self) -> List[Image]:
+        with ThreadPoolExecutor(LIST_WORKERS) as pool:
+            repos = self._catalog()
+            tags = pool.map(self._tags, repos)
+            pairs = [(r, t) for r, ts in zip(repos, tags) for t in ts]
+            return [x for x in pool.map(lambda p: self._image(*p), pairs) if x is not None]
+
+    def _repo_ref(self, image: Image):
+        if isinstance(image, RegistryImage):
+            return image.repo, image.reference
+        return split_reference(image.name())
+
+    def get_image_layers(self, image: Image) -> List[str]:
+        repo, ref = self._repo_ref(image)
+        manifest = self._resolve_manifest(repo, ref)
+        config = self.client.get_blob(repo, manifest["config"]["digest"], stream=False).json()
+        return (config.get("rootfs") or {}).get("diff_ids") or []
+
+    def get_layer_chains(self) -> Set[str]:
+        return set()
+
+    def get_codecs(self) -> List[str]:
+        # 层本身已经压缩，另外选择的压缩方式在本机进行
+        return compression.local_codecs()
+
+    def create_image_stream(self, image: Image, codec: Codec = None, log=None) -> IO[AnyStr]:
+        # image为源镜像时推送到同名仓库，为None时按数据中manifest.json的RepoTags推送
+        repo, tag = self.split_tag(image.name()) if image is not None else (None, None)
+        return RegistryPushStream(self, codec, repo, tag, log)
+
+    def _download(self, repo: str, blob: dict, buf: _BlobBuffer):
+        digest = blob["digest"]
+        try:
+            h = hashlib.sha256()
+            size = 0
+            resp = self.client.get_blob(repo, digest)
+            with resp:
+                for d in resp.iter_content(CHUNK_SIZE):
+                    if buf.cancelled.is_set():
+                        return
+                    h.update(d)
+                    size += len(d)
+                    buf.put(d)
+            if "sha256:" + h.hexdigest() != digest or size != blob["size"]:
+                raise IOError(f"{digest[:19]}校验失败")
+            buf.put(None)
+        except BaseException as e:
+            buf.put(e)
+
+    def _plan(self, images: List[Image]):
+        # 先取得所有manifest和config，出错时在开始传输前就报告
+        entries = []
+        blobs = {}
+        configs = {}
+        for image in images:
+            repo, ref = self._repo_ref(image)
+            manifest = self._resolve_manifest(repo, ref)
+            config_digest = manifest["config"]["digest"]
+            configs[config_digest] = self.client.get_blob(repo, config_digest, stream=False).content
+            for layer in manifest["layers"]:
+                blobs.setdefault(layer["digest"], (repo, layer))
+            tag = ref if not ref.startswith("sha256:") else None
+            entries.append({
+                "Config": "blobs/sha256/" + config_digest.split(":")[-1],
+                "RepoTags": [self._full_name(repo, tag)] if tag else [],
+                "Layers": ["blobs/sha256/" + x["digest"].split(":")[-1] for x in manifest["layers"]],
+            })
+        return entries, configs, blobs
+
+    def _archive(self, entries, configs, blobs, buffers) -> Iterator[bytes]:
+        for digest, data in configs.items():
+            yield docker_archive.tar_file("blobs/sha256/" + digest.split(":")[-1], data)
+
+        pool = ThreadPoolExecutor(DOWNLOAD_WORKERS)
+        try:
+            # 按顺序提交，正在输出的blob总是已经开始下载，后面的blob在缓冲区满之前提前下载
+            for digest, (repo, layer) in blobs.items():
+                pool.submit(self._download, repo, layer, buffers[digest])
+            for digest, (_, layer) in blobs.items():
+                yield docker_archive.tar_header("blobs/sha256/" + digest.split(":")[-1], layer["size"])
+                yield from buffers[digest]
+                yield docker_archive.tar_padding(layer["size"])
+        finally:
+            for b in buffers.values():
+                b.cancelled.set()
+            pool.shutdown(wait=False)
+
+        data = json.dumps(entries).encode()
+        yield docker_archive.tar_file("manifest.json", data)
+        yield docker_archive.tar_end()
+
+    def get_image_stream(self, image: Image, codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        return self.get_images_stream([image], codec, offset)
+
+    def get_images_stream(self, images: List[Image], codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        codec = codec or compression.get_codec(self.codec)
+        entries, configs, blobs = self._plan(images)
+        buffers = {digest: _BlobBuffer() for digest in blobs}
+
+        def cancel():
+            for b in buffers.values():
+                b.cancelled.set()
+        reader = docker_archive.TarStreamReader(self._archive(entries, configs, blobs, buffers), cancel)
+        f = codec.open_compressor(reader)
+        prefix = resumable.skip_prefix(f, offset)
+        if f is reader:
+            reader._prefix_sha256 = prefix
+            return reader
+        return _CompressedReader(f, reader, prefix)
+
+
+class _CompressedReader(IO[AnyStr]):
+    def __init__(self, f, reader: docker_archive.TarStreamReader, prefix_sha256: str = None):
+        self.f = f
+        self.reader = reader
+        self._prefix_sha256 = prefix_sha256
+
+    def read(self, __n: int = -1) -> AnyStr:
+        return self.f.read(__n)
+
+    def readinto(self, b) -> int:
+        return self.f.readinto(b)
+
+    def close(self) -> None:
+        self.reader.close()
+        self.f.close()
+
+    def wait(self) -> int:
+        return self.reader.wait()
+
+    def prefix_sha256(self) -> Optional[str]:
+        return self._prefix_sha256
@@ -0,0 +1,330 @@
+import gzip
+import hashlib
+import json
+import queue
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, AnyStr, Callable, Dict, Optional, Tuple
+
+from endpoints.compression import Codec
+
+UPLOAD_WORKERS = 4
+UPLOAD_CHUNK = 16 << 20
+SPOOL_MEMORY_SIZE = 64 << 20
+PIPE_DEPTH = 16
+# 与docker push一样用gzip压缩层，固定压缩级别和时间戳，同一层每次得到同样的digest
+GZIP_LEVEL = 6
+MOUNT_CANDIDATES = 3
+
+MANIFEST_V2 = "application/vnd.docker.distribution.manifest.v2+json"
+CONFIG_TYPE = "application/vnd.docker.container.image.v1+json"
+LAYER_TYPE = "application/vnd.docker.image.rootfs.diff.tar.gzip"
+
+
+class _PipeReader:
+    # write()放入队列，另一个线程中的tarfile从这里读取
+    def __init__(self):
+        self.chunks = queue.Queue(PIPE_DEPTH)
+        self.buf = b""
+        self.closed = False
+
+    def feed(self, data: Optional[bytes]):
+        # 解析线程结束后（tar结尾的填充数据或出错）丢弃剩余的数据
+        while not self.closed:
+            try:
+                self.chunks.put(data, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, n=-1) -> bytes:
+        while not self.buf:
+            item = self.chunks.get()
+            if item is None:
+                self.chunks.put(None)
+                return b""
+            self.buf = item
+        if n is None or n < 0:
+            n = len(self.buf)
+        d, self.buf = self.buf[:n], self.buf[n:]
+        return d
+
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.h = hashlib.sha256()
+        self.size = 0
+
+    def write(self, d):
+        self.f.write(d)
+        self.h.update(d)
+        self.size += len(d)
+        return len(d)
+
+    def flush(self):
+        pass
+
+
+class _Blob:
+    def __init__(self, path: str):
+        self.path = path
+        self.spool = None
+        self.digest = None
+        self.size = 0
+        self.lock = threading.Lock()
+
+
+class RegistryPushStream(IO[AnyStr]):
+    """
+    把docker save的数据流推送到registry：边读边拆出每一层，层在这里用gzip压缩后计算digest，
+    已经是gzip的层（源为registry时）原样使用。每一层先HEAD检查是否已存在，
+    再尝试从同一registry中已有该层的仓库跨仓库挂载，都不行时分块上传；各层并行上传，最后写入manifest。
+    源镜像名已知时边解析边上传，否则等读到manifest.json确定仓库名后再上传。
+    """
+
+    def __init__(self, endpoint, codec: Optional[Codec], repo: Optional[str], tag: Optional[str],
+                 log: Callable[[str], None] = None):
+        self.endpoint = endpoint
+        self.client = endpoint.client
+        self.repo = repo
+        self.log = log or (lambda _: None)
+        self.pipe = _PipeReader()
+        self.blobs: Dict[str, _Blob] = {}
+        self.uploads: Dict[Tuple[str, str], Future] = {}
+        self.files: Dict[str, bytes] = {}
+        self.pool = ThreadPoolExecutor(UPLOAD_WORKERS)
+        self.error = None
+        self.status = None
+        self.known = {}
+        self.bytes_uploaded = 0
+        self.layers_skipped = 0
+        self._lock = threading.Lock()
+        if repo:
+            self.known = endpoint.known_layers(repo, tag)
+        src = codec.open_reader(self.pipe) if codec is not None else self.pipe
+        self.thread = threading.Thread(target=self._parse, args=(src,), daemon=True)
+        self.thread.start()
+
+    def write(self, __s: AnyStr) -> int:
+        if self.error is not None:
+            raise IOError(f"推送失败：{self.error}")
+        self.pipe.feed(bytes(__s))
+        return len(__s)
+
+    def _parse(self, src):
+        try:
+            with tarfile.open(fileobj=src, mode="r|") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    f = tar.extractfile(member)
+                    if member.name.endswith("/layer.tar") or member.name.startswith("blobs/sha256/"):
+                        self._read_blob(member.name, f)
+                    elif member.name.endswith(".json") or member.name == "repositories":
+                        self.files[member.name] = f.read()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.pipe.closed = True
+
+    def _read_blob(self, path: str, f):
+        blob = _Blob(path)
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+        raw = _HashingWriter(spool)
+        head = f.read(1 << 20)
+        while head:
+            raw.write(head)
+            head = f.read(1 << 20)
+        spool.seek(0)
+        magic = spool.read(2)
+        spool.seek(0)
+        if magic[:1] == b"{" and raw.size < SPOOL_MEMORY_SIZE:
+            # OCI格式中的config等JSON文件
+            self.files[path] = spool.read()
+            spool.close()
+            return
+        if magic == b"\x1f\x8b":
+            blob.spool, blob.digest, blob.size = spool, "sha256:" + raw.h.hexdigest(), raw.size
+        else:
+            diff_id = "sha256:" + raw.h.hexdigest()
+            descriptor = self.known.get(diff_id)
+            if descriptor is not None:
+                # 目标仓库中已有该层（例如同一镜像的上一个版本），不用压缩
+                spool.close()
+                blob.digest, blob.size = descriptor["digest"], descriptor["size"]
+            else:
+                blob.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+                out = _HashingWriter(blob.spool)
+                with gzip.GzipFile(filename="", fileobj=out, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as gz:
+                    while True:
+                        d = spool.read(1 << 20)
+                        if not d:
+                            break
+                        gz.write(d)
+                spool.close()
+                blob.digest, blob.size = "sha256:" + out.h.hexdigest(), out.size
+        self.blobs[path] = blob
+        if self.repo:
+            self._submit(self.repo, path)
+
+    def _submit(self, repo: str, path: str) -> Future:
+        key = (repo, path)
+        if key not in self.uploads:
+            self.uploads[key] = self.pool.submit(self._upload_blob, repo, self.blobs[path])
+        return self.uploads[key]
+
+    def _upload_blob(self, repo: str, blob: _Blob):
+        if self._exists(repo, blob.digest):
+            with self._lock:
+                self.layers_skipped += 1
+        elif self._mount(repo, blob.digest):
+            with self._lock:
+                self.layers_skipped += 1
+            self.log(f"从其他仓库挂载{blob.digest[:19]}")
+        elif blob.spool is None:
+            raise RuntimeError(f"{blob.digest[:19]}在目标仓库中不存在")
+        else:
+            with blob.lock:
+                blob.spool.seek(0)
+                self._upload(repo, blob.digest, blob.spool, blob.size)
+        self.endpoint.remember_blob(blob.digest, repo)
+
+    def _exists(self, repo: str, digest: str) -> bool:
+        resp = self.client.request("HEAD", f"/v2/{repo}/blobs/{digest}", f"repository:{repo}:pull,push")
+        return resp.status_code == 200
+
+    def _mount(self, repo: str, digest: str) -> bool:
+        for source in self.endpoint.blob_sources(digest, exclude=repo)[:MOUNT_CANDIDATES]:
+            resp = self.client.request("POST", f"/v2/{repo}/blobs/uploads/",
+                                       f"repository:{repo}:pull,push repository:{source}:pull",
+                                       params={"mount": digest, "from": source})
+            if resp.status_code == 201:
+                return True
+            if resp.status_code == 202:
+                # 不支持挂载时registry开始了一次普通上传，直接放弃这次上传
+                location = resp.headers.get("Location")
+                if location:
+                    self.client.request("DELETE", location, f"repository:{repo}:pull,push")
+        return False
+
+    def _upload(self, repo: str, digest: str, f, size: int):
+        scope = f"repository:{repo}:pull,push"
+        resp = self.client.request("POST", f"/v2/{repo}/blobs/uploads/", scope)
+        if resp.status_code != 202:
+            raise RuntimeError(f"开始上传{digest[:19]}失败：{resp.status_code} {resp.text[:200]}")
+        location = resp.headers["Location"]
+        offset = 0
+        while offset < size:
+            chunk = f.read(UPLOAD_CHUNK)
+            resp = self.client.request("PATCH", location, scope, data=chunk, headers={
+                "Content-Type": "application/octet-stream",
+                "Content-Range": f"{offset}-{offset + len(chunk) - 1}",
+            })
+            if resp.status_code != 202:
+                raise RuntimeError(f"上传{digest[:19]}失败：{resp.status_code} {resp.text[:200]}")
+            location = resp.headers.get("Location", location)
+            offset += len(chunk)
+            with self._lock:
+                self.bytes_uploaded += len(chunk)
+        resp = self.client.request("PUT", location, scope, params={"digest": digest})
+        if resp.status_code not in (201, 204):
+            raise RuntimeError(f"完成上传{digest[:19]}失败：{resp.status_code} {resp.text[:200]}")
+
+    def _upload_config(self, repo: str, data: bytes) -> str:
+        digest = "sha256:" + hashlib.sha256(data).hexdigest()
+        if not self._exists(repo, digest):
+            resp = self.client.request("POST", f"/v2/{repo}/blobs/uploads/", f"repository:{repo}:pull,push",
+                                       params={"digest": digest}, data=data,
+                                       headers={"Content-Type": "application/octet-stream"})
+            if resp.status_code == 202:
+                self._upload(repo, digest, _BytesReader(data), len(data))
+            elif resp.status_code != 201:
+                raise RuntimeError(f"上传config失败：{resp.status_code} {resp.text[:200]}")
+        return digest
+
+    def _push_manifests(self):
+        entries = json.loads(self.files["manifest.json"])
+        for entry in entries:
+            tags = entry.get("RepoTags") or []
+            if self.repo:
+                targets = [(self.repo, self.endpoint.split_tag(t)[1]) for t in tags] or [(self.repo, "latest")]
+            else:
+                targets = [self.endpoint.split_tag(t) for t in tags]
+            if not targets:
+                raise RuntimeError("镜像没有标签，无法推送")
+            config = self.files[entry["Config"]]
+            # 先提交所有仓库的上传任务，让它们并行进行
+            for repo, _ in targets:
+                for path in entry["Layers"]:
+                    self._submit(repo, path)
+            for repo, tag in targets:
+                layers = []
+                for path in entry["Layers"]:
+                    blob = self.blobs[path]
+                    self._submit(repo, path).result()
+                    layers.append({"mediaType": LAYER_TYPE, "size": blob.size, "digest": blob.digest})
+                manifest = {
+                    "schemaVersion": 2,
+                    "mediaType": MANIFEST_V2,
+                    "config": {"mediaType": CONFIG_TYPE, "size": len(config),
+                               "digest": self._upload_config(repo, config)},
+                    "layers": layers,
+                }
+                resp = self.client.request("PUT", f"/v2/{repo}/manifests/{tag}", f"repository:{repo}:pull,push",
+                                           data=json.dumps(manifest).encode(),
+                                           headers={"Content-Type": MANIFEST_V2})
+                if resp.status_code not in (200, 201):
+                    raise RuntimeError(f"推送{repo}:{tag}的manifest失败：{resp.status_code} {resp.text[:200]}")
+                self.log(f"已推送{self.client.host}/{repo}:{tag}，上传{self.bytes_uploaded}字节，"
+                         f"跳过{self.layers_skipped}层")
+
+    def close(self) -> None:
+        if self.status is not None:
+            return
+        self.status = -1
+        try:
+            if self.error is None:
+                self.pipe.feed(None)
+            self.thread.join()
+            if self.error is not None:
+                raise RuntimeError(f"解析镜像数据失败：{self.error}")
+            self._push_manifests()
+            self.status = 0
+        except BaseException:
+            self.status = 1
+            raise
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            for blob in self.blobs.values():
+                if blob.spool is not None:
+                    blob.spool.close()
+
+    def abort(self) -> None:
+        # 不写入manifest，已上传的层不会出现在任何镜像中
+        if self.status is not None:
+            return
+        self.status = 1
+        # 解析线程读到不完整的数据后结束
+        self.pipe.feed(None)
+        self.thread.join()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for blob in self.blobs.values():
+            if blob.spool is not None:
+                blob.spool.close()
+
+    def wait(self) -> int:
+        return self.status if self.status is not None else -1
+
+
+class _BytesReader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def read(self, n: int) -> bytes:
+        d = self.data[self.pos:self.pos + n]
+        self.pos += len(d)
+        return d
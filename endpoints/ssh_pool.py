@@ -0,0 +1,171 @@
+import atexit
+import socket
+import threading
+import time
+import weakref
+from typing import List
+
+import paramiko
+
+KEEPALIVE_INTERVAL = 30
+IDLE_TIMEOUT = 300
+CONNECT_TIMEOUT = 10
+# OpenSSH默认MaxSessions为10，留一些余量
+MAX_SESSIONS = 8
+
+_pools = weakref.WeakSet()
+_pools_lock = threading.Lock()
+_janitor = None
+
+
+class _Connection:
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+        self.channels: List[paramiko.Channel] = []
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def active_channels(self) -> int:
+        self.channels = [c for c in self.channels if not c.closed]
+        return len(self.channels)
+
+    def close(self):
+        self.client.close()
+
+
+class SSHConnectionPool:
+    """
+    同一主机的SSH连接池。每条连接是一个Transport，命令在其上以exec channel的形式执行，
+    单条连接的channel数量达到MAX_SESSIONS时再建立新连接。
+    """
+
+    def __init__(self, addr: str, port: int, user: str, password: str,
+                 keepalive=KEEPALIVE_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.addr = addr
+        self.port = port
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._conns: List[_Connection] = []
+        self._lock = threading.Lock()
+        _register(self)
+
+    def _connect(self) -> _Connection:
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(
+            hostname=self.addr,
+            port=self.port,
+            username=self.user,
+            password=self.password,
+            timeout=CONNECT_TIMEOUT,
+            banner_timeout=CONNECT_TIMEOUT,
+            auth_timeout=CONNECT_TIMEOUT,
+        )
+        ssh.get_transport().set_keepalive(self.keepalive)
+        return _Connection(ssh)
+
+    def _acquire(self) -> _Connection:
+        with self._lock:
+            for c in list(self._conns):
+                if not c.is_alive():
+                    c.close()
+                    self._conns.remove(c)
+            for c in self._conns:
+                if c.active_channels() < MAX_SESSIONS:
+                    return c
+        c = self._connect()
+        with self._lock:
+            self._conns.append(c)
+        return c
+
+    def _discard(self, c: _Connection):
+        with self._lock:
+            if c in self._conns:
+                self._conns.remove(c)
+        c.close()
+
+    def exec_command(self, command: str):
+        # 连接可能已被服务器断开，失败时丢弃该连接并重连一次
+        for retry in range(2):
+            c = self._acquire()
+            try:
+                stdin, stdout, stderr = c.client.exec_command(command)
+            except (paramiko.SSHException, EOFError, socket.error):
+                self._discard(c)
+                if retry:
+                    raise
+                continue
+            with self._lock:
+                c.channels.append(stdout.channel)
+                c.last_used = time.monotonic()
+            return stdin, stdout, stderr
+
+    def open_channel(self, command: str) -> paramiko.Channel:
+        # 返回执行command的channel本身，用作双向的数据流
+        for retry in range(2):
+            c = self._acquire()
+            try:
+                chan = c.client.get_transport().open_session()
+                chan.exec_command(command)
+            except (paramiko.SSHException, EOFError, socket.error):
+                self._discard(c)
+                if retry:
+                    raise
+                continue
+            with self._lock:
+                c.channels.append(chan)
+                c.last_used = time.monotonic()
+            return chan
+
+    def get_transport(self) -> paramiko.Transport:
+        return self._acquire().client.get_transport()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [c for c in self._conns
+                    if c.active_channels() == 0 and now - c.last_used > self.idle_timeout]
+            for c in idle:
+                self._conns.remove(c)
+        for c in idle:
+            c.close()
+
+    def close(self):
+        with self._lock:
+            conns = self._conns
+            self._conns = []
+        for c in conns:
+            c.close()
+
+
+def _janitor_loop():
+    while True:
+        time.sleep(KEEPALIVE_INTERVAL)
+        with _pools_lock:
+            pools = list(_pools)
+        for p in pools:
+            p.evict_idle()
+
+
+def _register(pool: SSHConnectionPool):
+    global _janitor
+    with _pools_lock:
+        _pools.add(pool)
+        if _janitor is None:
+            _janitor = threading.Thread(target=_janitor_loop, daemon=True)
+            _janitor.start()
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools)
+    for p in pools:
+        p.close()
+
+
+atexit.register(close_all)
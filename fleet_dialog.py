@@ -0,0 +1,158 @@
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+import PySide6.QtCore
+from PySide6.QtCore import QAbstractTableModel, QSortFilterProxyModel, Qt, Signal
+from PySide6.QtGui import QColor
+from PySide6.QtWidgets import QDialog
+
+import inventory
+from HostManager import HostItem
+from ui_fleet_dialog import Ui_FleetDialog
+
+STATE_TEXT = {
+    "waiting": "等待",
+    "running": "刷新中",
+    "ok": "",
+    "failed": "失败",
+    "timeout": "超时",
+}
+
+
+class FleetImageModel(QAbstractTableModel):
+    """
+    行是所有主机上出现过的镜像名，列是主机，单元格显示该主机上镜像的ID，缺少时为空。
+    """
+
+    def __init__(self, hosts: List[HostItem]):
+        super().__init__()
+        self.hosts = hosts
+        self.states = ["waiting"] * len(hosts)
+        self.counts: List[Optional[int]] = [None] * len(hosts)
+        self.names: List[str] = []
+        self.ids: List[Dict[str, str]] = [{} for _ in hosts]
+
+    def update_host(self, i: int, state: str):
+        self.beginResetModel()
+        self.states[i] = state
+        if self.hosts[i].inventory.is_loaded():
+            images = self.hosts[i].inventory.images()
+            self.ids[i] = {x.name(): x.hash() for x in images}
+            self.counts[i] = len(images)
+        self.names = sorted(set().union(*self.ids))
+        self.endResetModel()
+
+    def is_missing(self, row: int) -> bool:
+        name = self.names[row]
+        return any(self.states[i] == "ok" and name not in self.ids[i] for i in range(len(self.hosts)))
+
+    def headerData(self, section: int, orientation: PySide6.QtCore.Qt.Orientation, role: int = ...) -> Any:
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            if section == 0:
+                return "镜像名"
+            i = section - 1
+            text = self.hosts[i].get_name()
+            if self.counts[i] is not None:
+                text += f" ({self.counts[i]})"
+            state = STATE_TEXT.get(self.states[i], self.states[i])
+            return f"{text}\n{state}" if state else text
+        return super().headerData(section, orientation, role)
+
+    def data(self, index: Union[PySide6.QtCore.QModelIndex, PySide6.QtCore.QPersistentModelIndex],
+             role: int = ...) -> Any:
+        name = self.names[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if index.column() == 0:
+                return name
+            return self.ids[index.column() - 1].get(name, "")
+        if role == Qt.ItemDataRole.BackgroundRole and index.column() > 0:
+            i = index.column() - 1
+            if self.states[i] == "ok" and name not in self.ids[i]:
+                return QColor(255, 220, 220)
+        return None
+
+    def rowCount(self, parent=...) -> int:
+        return len(self.names)
+
+    def columnCount(self, parent=...) -> int:
+        return len(self.hosts) + 1
+
+
+class FleetFilterModel(QSortFilterProxyModel):
+    def __init__(self, source: FleetImageModel):
+        super().__init__()
+        self.setSourceModel(source)
+        self.setFilterKeyColumn(0)
+        self.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.missing_only = False
+
+    def set_missing_only(self, value: bool):
+        self.missing_only = value
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row: int, source_parent) -> bool:
+        if self.missing_only and not self.sourceModel().is_missing(source_row):
+            return False
+        return super().filterAcceptsRow(source_row, source_parent)
+
+
+class FleetDialog(QDialog):
+    host_result_signal = Signal(int, str, str)
+    refresh_done_signal = Signal()
+
+    def __init__(self, hosts: List[HostItem], parent=None):
+        super().__init__(parent)
+        self.ui = Ui_FleetDialog()
+        self.ui.setupUi(self)
+        self.hosts = hosts
+        self.model = FleetImageModel(hosts)
+        self.proxy = FleetFilterModel(self.model)
+        self.ui.image_table.setModel(self.proxy)
+        self.ui.filter.textChanged.connect(self.proxy.setFilterFixedString)
+        self.ui.missing_only.toggled.connect(self.proxy.set_missing_only)
+        self.ui.refresh_btn.clicked.connect(lambda: self.refresh_all(force=True))
+        self.host_result_signal.connect(self.host_result_slot)
+        self.refresh_done_signal.connect(lambda: self.ui.refresh_btn.setDisabled(False))
+        self._errors: Dict[int, str] = {}
+        self._running = False
+        for i, host in enumerate(hosts):
+            if host.inventory.is_loaded():
+                self.model.update_host(i, "ok")
+
+    def host_result_slot(self, i: int, state: str, error: str):
+        self.model.update_host(i, state)
+        if state == "ok":
+            self._errors.pop(i, None)
+            self.hosts[i].signal.refreshed.emit()
+        elif error:
+            self._errors[i] = f"{self.hosts[i].get_name()}：{error}"
+        self.ui.status.setText("\n".join(self._errors.values()))
+
+    def refresh_all(self, force=False):
+        """
+        同时刷新所有主机，每个主机返回结果后立即更新表格。force为False时跳过缓存未过期的主机。
+        """
+        if self._running:
+            return
+        self._running = True
+        inventories = {}
+        for i, host in enumerate(self.hosts):
+            if force or not host.inventory.is_fresh():
+                inventories[i] = host.inventory
+                self.model.update_host(i, "running")
+        self.ui.refresh_btn.setDisabled(True)
+
+        def on_result(i, state, error):
+            self.host_result_signal.emit(i, state, error or "")
+
+        def thread():
+            try:
+                inventory.refresh_all(inventories, on_result)
+            finally:
+                self._running = False
+                self.refresh_done_signal.emit()
+        threading.Thread(target=thread, daemon=True).start()
+
+    def show_dialog(self):
+        self.show()
+        self.refresh_all()
@@ -0,0 +1,122 @@
+import json
+from typing import List
+
+import bandwidth
+from endpoints import compression
+from inventory import ImageInventory
+
+HOSTS_FILE = "image_transfer.json"
+
+
+class HostItem:
+    """
+    一台主机的配置和连接，不依赖Qt，图形界面和命令行共用。
+    """
+
+    def __init__(self, d=None):
+        if d is None:
+            d = dict()
+        self._data = d
+        self._endpoint = None
+        self.inventory = ImageInventory(self.get_endpoint)
+        self.apply_limits()
+
+    def get_name(self):
+        return self._data.get("name", self._data.get("addr", "unnamed"))
+
+    def get(self, key):
+        return self._data.get(key, "")
+
+    def set(self, key, value):
+        if key in ("addr", "link_limits"):
+            # 清除旧地址、旧链路的限速
+            self.apply_limits(clear=True)
+        self._data[key] = value
+        if key in ("addr", "rate_limit", "link_limits"):
+            self.apply_limits()
+        if key in ("type", "addr", "user", "pass", "insecure") and self._endpoint:
+            self._endpoint.close()
+            self._endpoint = None
+            self.inventory.invalidate(drop_cursor=True)
+
+    def get_type(self):
+        return self.get("type")
+
+    def get_user(self):
+        return self.get("user")
+
+    def get_pass(self):
+        return self.get("pass")
+
+    def get_addr(self):
+        return self.get("addr")
+
+    def get_codec(self):
+        # registry中的层已经压缩，默认不再压缩
+        return self.get("codec") or ("none" if self.get_type() in ("Registry", "Harbor") else compression.DEFAULT)
+
+    def get_insecure(self) -> bool:
+        # 只对Registry、Harbor有效：不校验TLS证书
+        return bool(self._data.get("insecure"))
+
+    def data(self):
+        return self._data
+
+    def apply_limits(self, clear=False):
+        """
+        把主机记录中的限速设置到bandwidth.manager，修改后对正在进行的任务立即生效。
+        rate_limit为这台主机所有传输合计的MB/s；link_limits为"对端地址=MB/s, ..."，
+        对端地址为localhost时表示这台主机与本机之间的链路。
+        """
+        addr = self.get_addr()
+        if not addr:
+            return
+        bandwidth.manager.set_host(addr, 0 if clear else bandwidth.parse_rate(self.get("rate_limit")))
+        for peer, rate in bandwidth.parse_links(self.get("link_limits")).items():
+            bandwidth.manager.set_link(addr, peer, 0 if clear else rate)
+
+    def get_endpoint(self):
+        if self._endpoint and self._endpoint.type == self.get_type():
+            self._endpoint.codec = self.get_codec()
+            return self._endpoint
+        if self._endpoint:
+            self._endpoint.close()
+            self.inventory.invalidate(drop_cursor=True)
+        # 端点模块依赖paramiko、requests，用到时才导入，命令行只加载实际用到的端点
+        if self.get_type() == "Docker CLI":
+            from endpoints.docker_cli_endpoint import DockerCLIEndpoint
+            self._endpoint = DockerCLIEndpoint(self.get_type(), self.get_addr(), self.get_user(), self.get_pass())
+        elif self.get_type() == "Docker API":
+            from endpoints.docker_api_endpoint import DockerAPIEndpoint
+            self._endpoint = DockerAPIEndpoint(self.get_type(), self.get_addr(), self.get_user(), self.get_pass())
+        elif self.get_type() == "Registry":
+            from endpoints.registry_endpoint import RegistryEndpoint
+            self._endpoint = RegistryEndpoint(self.get_type(), self.get_addr(), self.get_user(), self.get_pass(),
+                                              self.get_insecure())
+        elif self.get_type() == "Harbor":
+            from endpoints.harbor_endpoint import HarborEndpoint
+            self._endpoint = HarborEndpoint(self.get_type(), self.get_addr(), self.get_user(), self.get_pass(),
+                                            self.get_insecure())
+        else:
+            raise RuntimeError("Unknown host type " + self.get_type())
+        self._endpoint.codec = self.get_codec()
+        return self._endpoint
+
+    def refresh_images(self, full=False) -> bool:
+        return self.inventory.refresh(full)
+
+
+def load_hosts(path=HOSTS_FILE, factory=HostItem) -> List[HostItem]:
+    try:
+        with open(path, encoding='utf8') as f:
+            return [factory(x) for x in json.load(f)]
+    except FileNotFoundError:
+        return []
+    except json.decoder.JSONDecodeError as e:
+        print("load from json error ", e)
+        return []
+
+
+def save_hosts(hosts: List[HostItem], path=HOSTS_FILE):
+    with open(path, "w", encoding='utf8') as f:
+        json.dump([x.data() for x in hosts], f)
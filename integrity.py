@@ -0,0 +1,448 @@
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import tarfile
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+import docker_archive
+from endpoints import compression
+from endpoints.compression import Codec
+
+# 保存的镜像文件旁边写入的校验文件
+SIDECAR_EXT = ".sha256.json"
+# 小于这个大小的json文件（manifest.json、镜像config）保留在内存中用于校验
+JSON_MAX_SIZE = 4 << 20
+# 为False时不校验，只传输（命令行的--no-verify）
+enabled = True
+
+
+class IntegrityError(RuntimeError):
+    # 不属于resumable.transient_errors()，数据损坏时不重试
+    pass
+
+
+class _LayerDigest:
+    # 层文件的sha256，gzip压缩的层（镜像库、registry）同时计算解压后的sha256，即diff id
+    def __init__(self, size: int):
+        self.size = size
+        self.h = hashlib.sha256()
+        self.diff = None
+        self.decompressor = None
+        self.data = None
+        self.started = False
+
+    def update(self, d):
+        if not self.started:
+            self.started = True
+            head = bytes(d[:2])
+            if head == b"\x1f\x8b":
+                self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                self.diff = hashlib.sha256()
+            elif head[:1] == b"{" and self.size <= JSON_MAX_SIZE:
+                # OCI格式中config和manifest也在blobs/sha256/下
+                self.data = bytearray()
+        self.h.update(d)
+        if self.decompressor is not None:
+            self.diff.update(self.decompressor.decompress(d))
+        if self.data is not None:
+            self.data += d
+
+    def digest(self) -> str:
+        return "sha256:" + self.h.hexdigest()
+
+    def diff_id(self) -> str:
+        if self.decompressor is None:
+            return self.digest()
+        self.diff.update(self.decompressor.flush())
+        return "sha256:" + self.diff.hexdigest()
+
+
+class _TarParser:
+    """
+    边写入边解析tar数据，不缓存整个文件：层文件计算sha256，json文件保留内容，其他文件跳过。
+    支持GNU长文件名和PAX扩展头。发现问题时记录到verifier.error，不抛出异常，
+    因为写入方可能是解压进程的输出线程，抛出异常会让解压进程阻塞。
+    """
+
+    def __init__(self, verifier: 'StreamVerifier'):
+        self.verifier = verifier
+        self.header = bytearray()
+        self.remaining = 0
+        self.padding = 0
+        self.name = None
+        self.handler = None
+        self.meta = None
+        self.pending = {}
+        self.ended = False
+
+    def write(self, data) -> int:
+        data = memoryview(data)
+        total = len(data)
+        while len(data) and self.verifier.error is None:
+            if self.remaining:
+                n = min(len(data), self.remaining)
+                if self.handler is not None:
+                    self.handler.update(data[:n])
+                elif self.meta is not None:
+                    self.meta += data[:n]
+                self.remaining -= n
+                data = data[n:]
+                if not self.remaining:
+                    self._end_member()
+            elif self.padding:
+                n = min(len(data), self.padding)
+                self.padding -= n
+                data = data[n:]
+            else:
+                n = min(len(data), tarfile.BLOCKSIZE - len(self.header))
+                self.header += data[:n]
+                data = data[n:]
+                if len(self.header) == tarfile.BLOCKSIZE:
+                    self._start_member(bytes(self.header))
+                    self.header = bytearray()
+        return total
+
+    def _start_member(self, buf: bytes):
+        if buf == b"\0" * tarfile.BLOCKSIZE:
+            self.ended = True
+            return
+        try:
+            info = tarfile.TarInfo.frombuf(buf, "utf-8", "surrogateescape")
+        except tarfile.HeaderError as e:
+            self.verifier.fail(f"tar数据损坏：{e}")
+            return
+        self.ended = False
+        size = info.size
+        self.name = None
+        self.handler = None
+        self.meta = None
+        if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK, tarfile.XHDTYPE, tarfile.XGLTYPE):
+            self.meta = bytearray()
+            self.name = info.type
+        else:
+            if "size" in self.pending:
+                size = int(self.pending["size"])
+            info.name = self.pending.get("path", info.name)
+            info.linkname = self.pending.get("linkpath", info.linkname)
+            info.size = size
+            self.pending = {}
+            self.name = info.name
+            if info.issym() or info.islnk():
+                self.verifier.add_link(info)
+            elif info.isfile():
+                if docker_archive.is_layer_member(info):
+                    self.handler = _LayerDigest(size)
+                elif info.name.endswith(".json") and size <= JSON_MAX_SIZE:
+                    self.meta = bytearray()
+        self.remaining = size
+        self.padding = -size % tarfile.BLOCKSIZE
+        if not size:
+            self._end_member()
+
+    def _end_member(self):
+        if self.name == tarfile.GNUTYPE_LONGNAME:
+            self.pending["path"] = self.meta.rstrip(b"\0").decode("utf-8", "surrogateescape")
+        elif self.name == tarfile.GNUTYPE_LONGLINK:
+            self.pending["linkpath"] = self.meta.rstrip(b"\0").decode("utf-8", "surrogateescape")
+        elif self.name == tarfile.XHDTYPE:
+            self.pending.update(_pax_records(bytes(self.meta)))
+        elif self.name == tarfile.XGLTYPE:
+            pass
+        elif self.handler is not None:
+            self.verifier.add_layer(self.name, self.handler)
+        elif self.meta is not None:
+            self.verifier.add_file(self.name, bytes(self.meta))
+        self.name = None
+        self.handler = None
+        self.meta = None
+
+    def complete(self) -> bool:
+        return self.ended and not self.remaining and not self.header
+
+    def flush(self):
+        pass
+
+
+def _pax_records(data: bytes) -> Dict[str, str]:
+    # "长度 键=值\n"
+    ans = {}
+    pos = 0
+    while pos < len(data):
+        length, _, rest = data[pos:pos + 32].partition(b" ")
+        if not length.isdigit() or not rest:
+            break
+        record = data[pos + len(length) + 1:pos + int(length) - 1]
+        key, _, value = record.partition(b"=")
+        ans[key.decode("utf-8", "surrogateescape")] = value.decode("utf-8", "surrogateescape")
+        pos += int(length)
+    return ans
+
+
+class StreamVerifier:
+    """
+    在传输过程中校验docker save归档：计算整个数据流的sha256，同时（需要时先解压）解析tar，
+    计算每个层文件的sha256，与镜像config中的rootfs.diff_ids比较。OCI格式的blob还要与文件名一致。
+    expected为事先从源主机得到的diff id，给出时每读完一层立即校验，否则读到manifest.json和config后校验。
+    数据流中缺少的层（跳过目标主机已有的层时）不算错误，由docker load检查。
+    size和sha256为记录的整个数据流的大小和sha256（导入有校验文件的归档时），在最后一块数据发送之前比较。
+    """
+
+    def __init__(self, codec: Codec = None, expected: Iterable[str] = None,
+                 size: Optional[int] = None, sha256: Optional[str] = None):
+        self.codec = codec or compression.CODECS["none"]
+        self.expected = set(expected or [])
+        self.expected_size = size
+        self.expected_sha256 = sha256
+        self.enabled = enabled
+        self.error: Optional[str] = None
+        # 用于解压的codec，pigz的输出gzip也能解压；本机没有解压工具时只计算整个数据流的sha256
+        self.decompress = self.codec
+        if self.codec.name == "pigz" and not shutil.which("pigz"):
+            self.decompress = compression.CODECS["gzip"]
+        self.check_layers = self.codec.compress is None or shutil.which(self.decompress.decompress[0]) is not None
+        self.sink = None
+        self.reset()
+
+    def reset(self):
+        # 数据流从头重新开始（断点续传的源数据不一致）
+        self.close()
+        self.error = None
+        self.archive = hashlib.sha256()
+        self.size = 0
+        self.layers: Dict[str, str] = {}
+        self.files: Dict[str, bytes] = {}
+        self.links: Dict[str, str] = {}
+        self.verified: Dict[str, str] = {}
+        self.images: List[str] = []
+        self._checked = set()
+        self.parser = _TarParser(self)
+        # 解压进程在收到数据时才启动，reset后不会留下没有输入的进程
+        self._start_sink = self.enabled and self.check_layers
+
+    def fail(self, message: str):
+        if self.error is None:
+            self.error = message
+
+    def check(self):
+        if self.error is not None:
+            raise IntegrityError(self.error)
+
+    def update(self, data):
+        if not self.enabled:
+            return
+        self.archive.update(data)
+        self.size += len(data)
+        if self.expected_size is not None and self.size >= self.expected_size:
+            if self.size != self.expected_size:
+                self.fail(f"数据比记录的{self.expected_size}字节多")
+            elif self.expected_sha256 is not None and self.sha256() != self.expected_sha256:
+                self.fail(f"sha256为{self.sha256()}，与记录的{self.expected_sha256}不一致")
+        if self._start_sink:
+            self._start_sink = False
+            self.sink = self.decompress.open_decompress_writer(self.parser)
+        if self.sink is not None and self.error is None:
+            try:
+                self.sink.write(data)
+            except OSError as e:
+                self.fail(f"解压失败，数据已损坏：{e}")
+
+    def writer(self, f):
+        return _VerifyingWriter(f, self) if self.enabled else f
+
+    def reader(self, f):
+        return _VerifyingReader(f, self) if self.enabled else f
+
+    def add_link(self, info: tarfile.TarInfo):
+        target = info.linkname if info.islnk() else posixpath.join(posixpath.dirname(info.name), info.linkname)
+        self.links[info.name] = posixpath.normpath(target)
+
+    def add_file(self, name: str, data: bytes):
+        self.files[name] = data
+        if name == "manifest.json":
+            self._check_manifest(False)
+
+    def add_layer(self, name: str, layer: _LayerDigest):
+        digest = layer.digest()
+        if name.startswith("blobs/sha256/") and digest != "sha256:" + name.rsplit("/", 1)[-1]:
+            self.fail(f"{name}校验失败，实际的sha256为{digest}")
+            return
+        if layer.data is not None:
+            self.files[name] = bytes(layer.data)
+            return
+        diff_id = layer.diff_id()
+        self.layers[name] = diff_id
+        if self.expected and diff_id not in self.expected:
+            self.fail(f"{name}校验失败：{diff_id}不在镜像的rootfs.diff_ids中")
+        elif "manifest.json" in self.files:
+            self._check_manifest(False)
+
+    def _resolve(self, path: str) -> str:
+        for _ in range(8):
+            if path not in self.links:
+                break
+            path = self.links[path]
+        return path
+
+    def _check_manifest(self, final: bool):
+        try:
+            entries = json.loads(self.files["manifest.json"])
+        except ValueError as e:
+            self.fail(f"manifest.json损坏：{e}")
+            return
+        for entry in entries:
+            config_path = entry.get("Config")
+            if config_path in self._checked:
+                continue
+            config = self.files.get(self._resolve(config_path))
+            if config is None:
+                if final:
+                    self.fail(f"数据中缺少{config_path}")
+                continue
+            try:
+                diff_ids = (json.loads(config).get("rootfs") or {}).get("diff_ids") or []
+            except ValueError as e:
+                self.fail(f"{config_path}损坏：{e}")
+                return
+            layers = entry.get("Layers") or []
+            if len(diff_ids) != len(layers):
+                self.fail(f"{config_path}中的层数与manifest.json不一致")
+                return
+            pending = False
+            for diff_id, path in zip(diff_ids, layers):
+                actual = self.layers.get(self._resolve(path))
+                if actual is None:
+                    pending = True
+                elif actual != diff_id:
+                    self.fail(f"{path}校验失败：sha256为{actual}，config中为{diff_id}")
+                    return
+                else:
+                    self.verified[path] = diff_id
+            if final or not pending:
+                self._checked.add(config_path)
+                self.images += entry.get("RepoTags") or []
+
+    def finish(self) -> 'StreamVerifier':
+        # 数据流结束后调用，等待解压和解析完成后做最后的检查，有问题时抛出IntegrityError
+        if not self.enabled:
+            return self
+        self.close()
+        if self.expected_size is not None and self.size != self.expected_size:
+            self.fail(f"数据不完整，只有{self.size}字节，记录的大小为{self.expected_size}字节")
+        if self.check_layers and self.error is None:
+            if not self.parser.complete():
+                self.fail("数据不完整，tar没有正常结束")
+            elif "manifest.json" not in self.files:
+                self.fail("数据中没有manifest.json")
+            else:
+                self._check_manifest(True)
+        self.check()
+        return self
+
+    def close(self):
+        sink, self.sink = self.sink, None
+        if sink is None:
+            return
+        try:
+            sink.close()
+        except Exception as e:
+            self.fail(f"解压失败，数据已损坏：{e}")
+        pro = getattr(sink, "pro", None)
+        if pro is not None and pro.returncode:
+            self.fail(f"解压失败，数据已损坏（{self.decompress.decompress_cmd()}退出码{pro.returncode}）")
+
+    def verified_layers(self) -> int:
+        return len(set(self.verified.values()))
+
+    def sha256(self) -> Optional[str]:
+        return "sha256:" + self.archive.hexdigest() if self.enabled else None
+
+    def summary(self) -> str:
+        if not self.enabled:
+            return "未校验"
+        if not self.check_layers:
+            return f"本机没有{self.decompress.decompress[0]}，只计算了sha256：{self.sha256()}"
+        return f"校验通过，{self.verified_layers()}层与config一致，sha256：{self.sha256()}"
+
+
+class _VerifyingWriter:
+    # 先校验再写入，发现问题的那块数据不会发送出去（不压缩时层在这块数据中结束就能发现）
+    def __init__(self, f, verifier: StreamVerifier):
+        self.f = f
+        self.verifier = verifier
+
+    def write(self, d) -> int:
+        self.verifier.update(d)
+        self.verifier.check()
+        return self.f.write(d)
+
+    def __getattr__(self, item):
+        return getattr(self.f, item)
+
+
+class _VerifyingReader:
+    def __init__(self, f, verifier: StreamVerifier):
+        self.f = f
+        self.verifier = verifier
+
+    def read(self, n=-1):
+        d = self.f.read(n)
+        self.verifier.update(d)
+        self.verifier.check()
+        return d
+
+    def readinto(self, b) -> int:
+        if hasattr(self.f, "readinto"):
+            n = self.f.readinto(b) or 0
+        else:
+            d = self.f.read(len(b))
+            n = len(d)
+            b[:n] = d
+        self.verifier.update(memoryview(b)[:n])
+        self.verifier.check()
+        return n
+
+    def __getattr__(self, item):
+        return getattr(self.f, item)
+
+
+def sidecar_path(path: str) -> str:
+    return path + SIDECAR_EXT
+
+
+def write_sidecar(path: str, verifier: StreamVerifier, **fields):
+    data = {
+        "file": os.path.basename(path),
+        "size": verifier.size,
+        "sha256": verifier.sha256(),
+        "codec": verifier.codec.name,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    if verifier.check_layers:
+        data["images"] = verifier.images
+        data["diff_ids"] = sorted(set(verifier.verified.values()))
+    data.update(fields)
+    tmp = sidecar_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, sidecar_path(path))
+
+
+def remove_sidecar(path: str):
+    try:
+        os.remove(sidecar_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def read_sidecar(path: str) -> Optional[dict]:
+    try:
+        with open(sidecar_path(path), encoding="utf8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise IntegrityError(f"{sidecar_path(path)}损坏：{e}")
@@ -0,0 +1,171 @@
+import re
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from endpoints.endpoint import Endpoint, Image
+
+INVENTORY_TTL = 60
+REFRESH_TIMEOUT = 30
+REFRESH_WORKERS = 16
+
+_IMAGE_ID = re.compile(r"^(sha256:)?[0-9a-f]{64}$")
+
+
+def short_id(image_id: str) -> str:
+    return image_id.split(":")[-1][:12]
+
+
+class ImageInventory:
+    """
+    单个主机的镜像列表缓存。超过ttl秒后视为过期，由调用方在后台重新验证；
+    端点支持docker events时只查询上次刷新以后变化的镜像并修改缓存，否则完整重新获取。
+    """
+
+    def __init__(self, get_endpoint: Callable[[], Endpoint], ttl=INVENTORY_TTL):
+        self.get_endpoint = get_endpoint
+        self.ttl = ttl
+        self._images: Dict[str, Image] = {}
+        self._fetched_at: Optional[float] = None
+        # 主机上的时间，下次从这个时间点开始查询镜像事件
+        self._since: Optional[int] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def images(self) -> List[Image]:
+        with self._lock:
+            return sorted(self._images.values(), key=lambda x: x.name())
+
+    def is_loaded(self) -> bool:
+        return self._fetched_at is not None
+
+    def is_fresh(self) -> bool:
+        return self._fetched_at is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    def invalidate(self, drop_cursor=False):
+        # drop_cursor为True时下次刷新完整获取镜像列表，用于主机配置变化等情况
+        with self._lock:
+            self._fetched_at = None
+            if drop_cursor:
+                self._since = None
+
+    def refresh(self, full=False) -> bool:
+        """
+        重新验证缓存，返回镜像列表是否发生了变化。同一时间只有一个刷新在进行，
+        其他调用等待它完成后直接返回。
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            with self._refresh_lock:
+                return False
+        try:
+            endpoint = self.get_endpoint()
+            if not full and self._since is not None:
+                changed = self._refresh_events(endpoint)
+                if changed is not None:
+                    return changed
+            return self._refresh_full(endpoint)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_full(self, endpoint: Endpoint) -> bool:
+        since = endpoint.server_time()
+        images = {x.name(): x for x in endpoint.get_images()}
+        with self._lock:
+            old = self._images
+            changed = old.keys() != images.keys() or any(old[k].hash() != v.hash() for k, v in images.items())
+            if changed:
+                self._images = images
+            self._since = since
+            self._fetched_at = time.monotonic()
+        return changed
+
+    def _refresh_events(self, endpoint: Endpoint) -> Optional[bool]:
+        # 返回None表示无法增量刷新，需要完整刷新
+        until = endpoint.server_time()
+        events = endpoint.get_image_events(self._since, until) if until is not None else None
+        if events is None:
+            return None
+        refs = set()
+        ids = set()
+        for e in events:
+            action = e.get("Action") or e.get("status") or ""
+            if action == "prune":
+                return None
+            actor = e.get("Actor") or {}
+            for ref in (actor.get("ID") or e.get("id"), (actor.get("Attributes") or {}).get("name")):
+                if not ref:
+                    continue
+                if _IMAGE_ID.match(ref):
+                    ids.add(ref)
+                else:
+                    refs.add(ref)
+        patched = False
+        if refs or ids:
+            found = endpoint.inspect_images(sorted(refs | ids))
+            patched = self._patch(found, {short_id(x) for x in ids} | {x.hash() for x in found}, refs)
+        with self._lock:
+            self._since = until
+            self._fetched_at = time.monotonic()
+        return patched
+
+    def _patch(self, found: List[Image], affected_ids, affected_names) -> bool:
+        # 受影响的镜像以inspect的结果为准：删除不再存在的标签，更新或添加新的标签
+        found = {x.name(): x for x in found}
+        changed = False
+        with self._lock:
+            images = dict(self._images)
+            for name, img in list(images.items()):
+                if (img.hash() in affected_ids or name in affected_names) and name not in found:
+                    del images[name]
+                    changed = True
+            for name, img in found.items():
+                old = images.get(name)
+                if old is None or old.hash() != img.hash() or old.size() != img.size():
+                    images[name] = img
+                    changed = True
+            if changed:
+                self._images = images
+        return changed
+
+
+def refresh_all(inventories: Dict[Hashable, ImageInventory],
+                on_result: Callable[[Hashable, str, Optional[str]], None],
+                timeout=REFRESH_TIMEOUT, max_workers=REFRESH_WORKERS, full=False):
+    """
+    同时刷新多个主机的镜像列表，每个主机完成时立即调用on_result(key, state, error)，
+    state为"ok"、"failed"或"timeout"。超时从该主机开始刷新时计算，超时的主机不会拖住其他主机，
+    它的刷新线程在后台继续运行，之后完成时仍会再报告一次结果。
+    """
+    slots = threading.Semaphore(max_workers)
+    lock = threading.Lock()
+    started: Dict[Hashable, float] = {}
+
+    def work(key, inv: ImageInventory):
+        with slots:
+            with lock:
+                started[key] = time.monotonic()
+            try:
+                inv.refresh(full)
+            except Exception as e:
+                on_result(key, "failed", str(e) or type(e).__name__)
+                return
+            on_result(key, "ok", None)
+
+    threads = {}
+    for key, inv in inventories.items():
+        # 用daemon线程而不是线程池，卡住的主机不会阻止程序退出
+        t = threading.Thread(target=work, args=(key, inv), daemon=True)
+        t.start()
+        threads[key] = t
+    while threads:
+        time.sleep(0.1)
+        now = time.monotonic()
+        for key, t in list(threads.items()):
+            if not t.is_alive():
+                del threads[key]
+                continue
+            with lock:
+                start = started.get(key)
+            if start is not None and now - start > timeout:
+                del threads[key]
+                on_result(key, "timeout", f"{timeout}秒内没有响应")
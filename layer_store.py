@@ -0,0 +1,352 @@
+import gzip
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import zlib
+from typing import IO, AnyStr, Callable, Dict, Iterator, List, Optional
+
+import docker_archive
+
+CHUNK_SIZE = 1 << 20
+# 层在库中以gzip保存，压缩只为节省磁盘，选最快的级别
+GZIP_LEVEL = 1
+JSON_MAX_SIZE = 64 << 20
+
+OCI_LAYOUT = {"imageLayoutVersion": "1.0.0"}
+MANIFEST_TYPE = "application/vnd.oci.image.manifest.v1+json"
+CONFIG_TYPE = "application/vnd.oci.image.config.v1+json"
+LAYER_TYPE = "application/vnd.oci.image.layer.v1.tar"
+LAYER_GZIP_TYPE = "application/vnd.oci.image.layer.v1.tar+gzip"
+# 与docker save的OCI格式相同的注解，另外记录保存时源主机上的镜像ID
+NAME_ANNOTATION = "io.containerd.image.name"
+REF_ANNOTATION = "org.opencontainers.image.ref.name"
+ID_ANNOTATION = "io.github.image_portal.image.id"
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def is_store(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, "oci-layout")) and os.path.isfile(os.path.join(path, "index.json"))
+
+
+def _digest_hex(digest_or_path: str) -> str:
+    return digest_or_path.rsplit("/", 1)[-1].split(":")[-1]
+
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.h = hashlib.sha256()
+        self.size = 0
+
+    def write(self, d):
+        self.f.write(d)
+        self.h.update(d)
+        self.size += len(d)
+        return len(d)
+
+    def flush(self):
+        pass
+
+
+class _CountingReader:
+    def __init__(self, f, on_read: Callable[[int], None]):
+        self.f = f
+        self.on_read = on_read
+
+    def read(self, n=-1):
+        d = self.f.read(n)
+        self.on_read(len(d))
+        return d
+
+
+class StoredImage:
+    def __init__(self, name: str, image_id: str, manifest: dict):
+        self.name = name
+        self.image_id = image_id
+        self.manifest = manifest
+
+    def size(self) -> int:
+        return self.manifest["config"]["size"] + sum(x["size"] for x in self.manifest["layers"])
+
+
+class StoreResult:
+    def __init__(self):
+        self.images: List[str] = []
+        self.blobs_written = 0
+        self.bytes_written = 0
+        self.layers_skipped = 0
+
+
+class LayerStore:
+    """
+    按内容寻址的本地镜像库，目录结构与OCI image layout相同：blobs/sha256/<digest>保存层、config和manifest，
+    index.json记录每个镜像名对应的manifest。同一层只保存一份，保存镜像时只写入库中还没有的层，
+    导入时从库中的文件即时拼出docker load能识别的归档，不生成中间文件。
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.blobs_dir = os.path.join(self.path, "blobs", "sha256")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        layout = os.path.join(self.path, "oci-layout")
+        if not os.path.exists(layout):
+            with open(layout, "w", encoding="utf8") as f:
+                json.dump(OCI_LAYOUT, f)
+        with _locks_lock:
+            self._lock = _locks.setdefault(self.path, threading.Lock())
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, _digest_hex(digest))
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def read_blob(self, digest: str) -> bytes:
+        with open(self.blob_path(digest), "rb") as f:
+            return f.read()
+
+    def write_blob(self, data: bytes) -> str:
+        digest = "sha256:" + hashlib.sha256(data).hexdigest()
+        if not self.has_blob(digest):
+            with tempfile.NamedTemporaryFile(dir=self.blobs_dir, prefix=".tmp-", delete=False) as f:
+                f.write(data)
+            os.replace(f.name, self.blob_path(digest))
+        return digest
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self.path, "index.json"), encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"schemaVersion": 2, "manifests": []}
+
+    def _write_index(self, index: dict):
+        path = os.path.join(self.path, "index.json")
+        with tempfile.NamedTemporaryFile("w", dir=self.path, prefix=".tmp-", delete=False, encoding="utf8") as f:
+            json.dump(index, f, indent=2)
+        os.replace(f.name, path)
+
+    def images(self) -> List[StoredImage]:
+        ans = []
+        for entry in self._read_index().get("manifests") or []:
+            annotations = entry.get("annotations") or {}
+            if not self.has_blob(entry["digest"]):
+                continue
+            manifest = json.loads(self.read_blob(entry["digest"]))
+            ans.append(StoredImage(annotations.get(NAME_ANNOTATION, entry["digest"]),
+                                   annotations.get(ID_ANNOTATION, ""), manifest))
+        return ans
+
+    def get_image(self, name: str) -> Optional[StoredImage]:
+        return next((x for x in self.images() if x.name == name), None)
+
+    def has_image(self, name: str, image_id: str) -> bool:
+        # 同名镜像已保存，且ID与源主机上的一致，所有文件都还在
+        image = self.get_image(name)
+        if image is None or not image_id or image.image_id != image_id:
+            return False
+        blobs = [image.manifest["config"]] + image.manifest["layers"]
+        return all(self.has_blob(x["digest"]) for x in blobs)
+
+    def layers(self) -> Dict[str, dict]:
+        """
+        库中已有的层：diff id到层描述（mediaType、digest、size）的映射，由每个镜像的manifest和config得到。
+        """
+        ans = {}
+        for image in self.images():
+            try:
+                config = json.loads(self.read_blob(image.manifest["config"]["digest"]))
+            except (OSError, ValueError):
+                continue
+            diff_ids = (config.get("rootfs") or {}).get("diff_ids") or []
+            for diff_id, layer in zip(diff_ids, image.manifest["layers"]):
+                if self.has_blob(layer["digest"]):
+                    ans[diff_id] = layer
+        return ans
+
+    def _write_layer(self, f, head: bytes) -> (str, dict, bool):
+        # 返回diff id、层描述以及是否新写入了文件
+        # 未压缩的层在这里gzip压缩，已经是gzip的层（源为registry时）原样保存
+        tmp = tempfile.NamedTemporaryFile(dir=self.blobs_dir, prefix=".tmp-", delete=False)
+        try:
+            out = _HashingWriter(tmp)
+            diff = hashlib.sha256()
+            if head[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                d = head
+                while d:
+                    out.write(d)
+                    diff.update(decompressor.decompress(d))
+                    d = f.read(CHUNK_SIZE)
+                diff.update(decompressor.flush())
+            else:
+                with gzip.GzipFile(filename="", fileobj=out, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as gz:
+                    d = head
+                    while d:
+                        gz.write(d)
+                        diff.update(d)
+                        d = f.read(CHUNK_SIZE)
+            tmp.close()
+            digest = "sha256:" + out.h.hexdigest()
+            created = not self.has_blob(digest)
+            if created:
+                os.replace(tmp.name, self.blob_path(digest))
+            else:
+                os.remove(tmp.name)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        layer = {"mediaType": LAYER_GZIP_TYPE, "digest": digest, "size": out.size}
+        return "sha256:" + diff.hexdigest(), layer, created
+
+    def _blob_descriptor(self, digest: str) -> dict:
+        with open(self.blob_path(digest), "rb") as f:
+            magic = f.read(2)
+        return {"mediaType": LAYER_GZIP_TYPE if magic == b"\x1f\x8b" else LAYER_TYPE,
+                "digest": "sha256:" + _digest_hex(digest), "size": os.path.getsize(self.blob_path(digest))}
+
+    def add(self, src: IO[AnyStr], name: str = None, image_id: str = None,
+            on_progress: Optional[Callable[[int], None]] = None,
+            is_running: Callable[[], bool] = lambda: True) -> Optional[StoreResult]:
+        """
+        从未压缩的docker save数据流中保存镜像。库中已有的层只读过不写入。
+        name和image_id为源主机上的镜像名和ID，数据流中只有一个镜像时使用，否则按RepoTags保存。
+        被取消时返回None，已写入的blob保留，下次保存时可以直接使用。
+        """
+        result = StoreResult()
+        known = self.layers()
+        written: Dict[str, dict] = {}
+        files: Dict[str, bytes] = {}
+        processed = 0
+
+        def progress(n):
+            nonlocal processed
+            processed += n
+            if on_progress:
+                on_progress(processed)
+
+        with tarfile.open(fileobj=_CountingReader(src, progress), mode="r|") as tar:
+            for member in tar:
+                if not is_running():
+                    return None
+                if not member.isfile():
+                    continue
+                if docker_archive.is_layer_member(member):
+                    if member.name.startswith("blobs/sha256/"):
+                        digest = "sha256:" + _digest_hex(member.name)
+                        if digest in known or self.has_blob(digest):
+                            # OCI格式的层文件名就是diff id（或registry中的digest），库中已有时不用读取
+                            result.layers_skipped += 1
+                            continue
+                    f = tar.extractfile(member)
+                    head = f.read(CHUNK_SIZE)
+                    if head[:1] == b"{" and member.size < JSON_MAX_SIZE:
+                        files[member.name] = head + f.read()
+                        continue
+                    diff_id, layer, created = self._write_layer(f, head)
+                    existing = known.get(diff_id) or written.get(diff_id)
+                    if existing is not None:
+                        # 旧格式的layer.tar读完才知道diff id，库中已有时删掉刚写入的副本
+                        if created and existing["digest"] != layer["digest"]:
+                            os.remove(self.blob_path(layer["digest"]))
+                        result.layers_skipped += 1
+                        continue
+                    if created:
+                        result.blobs_written += 1
+                        result.bytes_written += layer["size"]
+                    written[diff_id] = layer
+                elif member.name.endswith(".json"):
+                    files[member.name] = tar.extractfile(member).read()
+        if "manifest.json" not in files:
+            raise RuntimeError("数据中没有manifest.json，镜像数据不完整")
+        entries = json.loads(files["manifest.json"])
+        for entry in entries:
+            path = entry["Config"]
+            config = files[path] if path in files else self.read_blob(_digest_hex(path))
+            diff_ids = (json.loads(config).get("rootfs") or {}).get("diff_ids") or []
+            if len(diff_ids) != len(entry["Layers"]):
+                raise RuntimeError(f"{path}中的层数与manifest.json不一致")
+            layers = []
+            for diff_id, layer_path in zip(diff_ids, entry["Layers"]):
+                layer = written.get(diff_id) or known.get(diff_id)
+                if layer is None:
+                    if not self.has_blob(_digest_hex(layer_path)):
+                        raise RuntimeError(f"数据中缺少层{layer_path}")
+                    layer = self._blob_descriptor(_digest_hex(layer_path))
+                layers.append(layer)
+            manifest = json.dumps({
+                "schemaVersion": 2,
+                "mediaType": MANIFEST_TYPE,
+                "config": {"mediaType": CONFIG_TYPE, "digest": self.write_blob(config), "size": len(config)},
+                "layers": layers,
+            }).encode()
+            names = [name] if name and len(entries) == 1 else entry.get("RepoTags") or []
+            self._tag(self.write_blob(manifest), len(manifest), names, image_id if len(entries) == 1 else None)
+            result.images += names
+        return result
+
+    def _tag(self, digest: str, size: int, names: List[str], image_id: Optional[str]):
+        with self._lock:
+            index = self._read_index()
+            manifests = [x for x in index.get("manifests") or []
+                         if (x.get("annotations") or {}).get(NAME_ANNOTATION) not in names]
+            for name in names:
+                annotations = {NAME_ANNOTATION: name, REF_ANNOTATION: name.rpartition(":")[2]}
+                if image_id:
+                    annotations[ID_ANNOTATION] = image_id
+                manifests.append({"mediaType": MANIFEST_TYPE, "digest": digest, "size": size,
+                                  "annotations": annotations})
+            index["manifests"] = manifests
+            self._write_index(index)
+
+    def _archive(self, images: List[StoredImage]) -> Iterator[bytes]:
+        entries = []
+        blobs = {}
+        for image in images:
+            config = image.manifest["config"]["digest"]
+            blobs.setdefault(config, image.manifest["config"]["size"])
+            for layer in image.manifest["layers"]:
+                blobs.setdefault(layer["digest"], layer["size"])
+            entries.append({
+                "Config": "blobs/sha256/" + _digest_hex(config),
+                "RepoTags": [image.name],
+                "Layers": ["blobs/sha256/" + _digest_hex(x["digest"]) for x in image.manifest["layers"]],
+            })
+        for digest, size in blobs.items():
+            # 层保持库中的gzip压缩，docker load会自动解压
+            yield docker_archive.tar_header("blobs/sha256/" + _digest_hex(digest), size)
+            with open(self.blob_path(digest), "rb") as f:
+                while True:
+                    d = f.read(CHUNK_SIZE)
+                    if not d:
+                        break
+                    yield d
+            yield docker_archive.tar_padding(size)
+        yield docker_archive.tar_file("manifest.json", json.dumps(entries).encode())
+        yield docker_archive.tar_end()
+
+    def open_stream(self, names: List[str]) -> IO[AnyStr]:
+        """
+        即时生成包含指定镜像的docker load归档（未压缩的tar）。
+        """
+        images = []
+        for name in names:
+            image = self.get_image(name)
+            if image is None:
+                raise RuntimeError(f"镜像库中没有{name}")
+            images.append(image)
+        return docker_archive.TarStreamReader(self._archive(images))
+
+    def stream_size(self, names: List[str]) -> int:
+        blobs = {}
+        for image in self.images():
+            if image.name in names:
+                for x in [image.manifest["config"]] + image.manifest["layers"]:
+                    blobs[x["digest"]] = x["size"]
+        return sum(blobs.values())
@@ -1,46 +1,73 @@
+# 最先导入，从这里开始计算启动耗时
+import startup
+import os
 import sys
 
-from PySide6.QtWidgets import QApplication, QMainWindow, QMessageBox, QFileDialog, QDialog
+from PySide6.QtCore import QTimer
+from PySide6.QtWidgets import QApplication, QMainWindow, QMessageBox, QFileDialog, QDialog, QInputDialog
 
 from HostManager import HostManager
-from task_dialog import TaskDialog, SaveImageTask, LoadImageTask, SyncImageTask
 from ui_mainwindow import Ui_MainWindow
-from ui_select_host import Ui_SelectHost
 
-host_manager = HostManager()
+# 任务、端点（paramiko、requests）等模块在第一次用到时才导入，先显示窗口
+startup.mark("import")
 
 
+def close_connections():
+    # 没有用到SSH时不必为了关闭连接导入paramiko
+    ssh_pool = sys.modules.get("endpoints.ssh_pool")
+    if ssh_pool:
+        ssh_pool.close_all()
+
 
 class MainWindow(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
-        self.ui.host_manager_btn.clicked.connect(lambda: host_manager.show(self))
-        self.ui.host_select.setModel(host_manager.get_model())
+        self.host_manager = HostManager()
+        self.ui.host_manager_btn.clicked.connect(lambda: self.host_manager.show(self))
+        self.ui.host_select.setModel(self.host_manager.get_model())
         self.ui.host_select.activated.connect(self.update_image_list)
         self.ui.save_to_file_btn.clicked.connect(self.on_save_image_click)
+        self.ui.batch_save_btn.clicked.connect(self.on_batch_save_image_click)
+        self.ui.store_save_btn.clicked.connect(self.on_store_save_image_click)
         self.ui.load_from_file_btn.clicked.connect(self.on_load_image_click)
         self.ui.sync_to_host_htn.clicked.connect(self.on_sync_image_click)
-        self.ui.refresh_btn.clicked.connect(self.update_ui)
+        self.ui.refresh_btn.clicked.connect(lambda: self.update_ui(force=True))
+        self.ui.fleet_btn.clicked.connect(self.on_fleet_click)
         self.model = None
         self.host_index = 0
-        if len(host_manager.host_list) > 0:
-            self.update_ui()
+        self._watched_hosts = set()
+        if len(self.host_manager.host_list) > 0:
+            # 窗口显示以后再读取镜像列表，主机慢或连不上时不影响启动
+            QTimer.singleShot(0, self.update_ui)
 
-    def update_ui(self):
+    def update_ui(self, force=False):
+        # 先显示缓存的镜像列表，缓存过期或手动刷新时在后台重新获取
         index = self.host_index
         ui = self.ui
-        host = host_manager.host_list[index]
-        host.refresh_images()
+        host = self.host_manager.host_list[index]
+        if id(host) not in self._watched_hosts:
+            host.signal.failed.connect(self.on_refresh_failed)
+            self._watched_hosts.add(id(host))
         self.model = host.get_images_model()
         ui.image_list.setModel(self.model)
+        host.revalidate(force)
+
+    def on_fleet_click(self):
+        from fleet_dialog import FleetDialog
+        FleetDialog(self.host_manager.host_list, self).show_dialog()
+
+    def on_refresh_failed(self, message):
+        self.statusBar().showMessage(f"刷新镜像列表失败：{message}", 10000)
 
     def update_image_list(self, index):
         self.host_index = index
         self.update_ui()
 
     def on_save_image_click(self):
+        from task_dialog import TaskDialog, SaveImageTask
         selected = self.model.get_selected()
         if len(selected) == 0:
             box = QMessageBox(self)
@@ -51,32 +78,95 @@ class MainWindow(QMainWindow):
             return
         dialog = TaskDialog(self)
         dialog.setWindowTitle(f"保存{len(selected)}个镜像")
-        tasks = [SaveImageTask(dialog, x) for x in selected]
+        tasks = [SaveImageTask(dialog.reporter, x) for x in selected]
         dialog.show_dialog(tasks)
 
+    def on_batch_save_image_click(self):
+        from task_dialog import TaskDialog, BatchSaveImageTask
+        selected = self.model.get_selected()
+        if len(selected) == 0:
+            box = QMessageBox(self)
+            box.setWindowTitle("消息")
+            box.setText("没有勾选镜像")
+            box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            box.exec()
+            return
+        dialog = TaskDialog(self)
+        dialog.setWindowTitle(f"合并保存{len(selected)}个镜像")
+        dialog.show_dialog([BatchSaveImageTask(dialog.reporter, selected)])
+
+    def on_store_save_image_click(self):
+        from task_dialog import TaskDialog, SaveImageTask
+        selected = self.model.get_selected()
+        if len(selected) == 0:
+            box = QMessageBox(self)
+            box.setWindowTitle("消息")
+            box.setText("没有勾选镜像")
+            box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            box.exec()
+            return
+        store = QFileDialog.getExistingDirectory(self, "选择镜像库目录")
+        if not store:
+            return
+        dialog = TaskDialog(self)
+        dialog.setWindowTitle(f"保存{len(selected)}个镜像到镜像库")
+        tasks = [SaveImageTask(dialog.reporter, x, store) for x in selected]
+        dialog.show_dialog(tasks)
+
+    def select_stored_images(self, store):
+        import layer_store
+        # 选中镜像库中的index.json时选择要导入的镜像
+        names = sorted(x.name for x in layer_store.LayerStore(store).images())
+        if not names:
+            return None
+        item, ok = QInputDialog.getItem(self, "从镜像库导入", store, ["全部镜像"] + names, 0, False)
+        if not ok:
+            return None
+        return names if item == "全部镜像" else [item]
+
     def on_load_image_click(self):
+        import layer_store
+        from task_dialog import TaskDialog, LoadImageTask
         file_d = QFileDialog.getOpenFileNames(self)
         files = file_d[0]
         if len(files) == 0:
             return
+        sources = []
+        for x in files:
+            store = os.path.dirname(x)
+            if os.path.basename(x) in ("index.json", "oci-layout") and layer_store.is_store(store):
+                names = self.select_stored_images(store)
+                if names:
+                    sources.append((store, names))
+            else:
+                sources.append((x, None))
+        if len(sources) == 0:
+            return
         dialog = TaskDialog(self)
-        dialog.setWindowTitle(f"导入{len(files)}个镜像")
-        host = host_manager.host_list[self.host_index]
-        tasks = [LoadImageTask(dialog, host, x) for x in files]
+        dialog.setWindowTitle(f"导入{len(sources)}个镜像")
+        host = self.host_manager.host_list[self.host_index]
+        tasks = [LoadImageTask(dialog.reporter, host, path, names) for path, names in sources]
         dialog.show_dialog(tasks)
 
     def on_sync_image_click(self):
+        from endpoints import compression
+        from task_dialog import TaskDialog, SyncImageTask, FanoutSyncTask, DistributeImageTask
+        from ui_select_host import Ui_SelectHost
         select_host_dialog = QDialog(self)
         ui = Ui_SelectHost()
         ui.setupUi(select_host_dialog)
-        for x in host_manager.host_list:
+        for x in self.host_manager.host_list:
             ui.host_list.addItem(x.get_name())
+        ui.host_list.setCurrentRow(0)
+        ui.codec.addItem("主机设置")
+        ui.codec.addItems(compression.CODEC_NAMES)
         if select_host_dialog.exec() == 0:
             return
-        if ui.host_list.currentIndex() == self.host_index:
+        rows = sorted(x.row() for x in ui.host_list.selectedIndexes())
+        if len(rows) == 0 or self.host_index in rows:
             box = QMessageBox(self)
             box.setWindowTitle("消息")
-            box.setText("目标主机不能与当前主机相同")
+            box.setText("没有选择目标主机" if len(rows) == 0 else "目标主机不能与当前主机相同")
             box.setStandardButtons(QMessageBox.StandardButton.Ok)
             box.exec()
             return
@@ -90,14 +180,41 @@ class MainWindow(QMainWindow):
             return
 
         dialog = TaskDialog(self)
+        hosts = [self.host_manager.host_list[i] for i in rows]
+        codec = ui.codec.currentText() if ui.codec.currentIndex() > 0 else None
+        if len(hosts) > 1 and ui.p2p.isChecked():
+            # 已经收到镜像的主机继续发给其他主机，数据不经过本机
+            dialog.setWindowTitle(f"接力分发{len(selected)}个镜像到{len(hosts)}台主机")
+            tasks = [DistributeImageTask(dialog.reporter, x, hosts, codec) for x in selected]
+            dialog.show_dialog(tasks)
+            return
+        if len(hosts) > 1:
+            # 多台目标主机时源主机只导出一次，经本机缓存同时发给所有目标主机
+            dialog.setWindowTitle(f"转移{len(selected)}个镜像到{len(hosts)}台主机")
+            tasks = [FanoutSyncTask(dialog.reporter, x, hosts, codec) for x in selected]
+            dialog.show_dialog(tasks)
+            return
         dialog.setWindowTitle(f"转移{len(selected)}个镜像")
-        host = host_manager.host_list[ui.host_list.currentIndex()]
-        tasks = [SyncImageTask(dialog, x, host) for x in selected]
+        host = hosts[0]
+        skip_existing_layers = ui.skip_existing_layers.isChecked()
+        relay = ui.relay.isChecked()
+        resumable = ui.resumable.isChecked()
+        tasks = [SyncImageTask(dialog.reporter, x, host, skip_existing_layers, codec, relay, resumable)
+                 for x in selected]
         dialog.show_dialog(tasks)
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(close_connections)
+    startup.mark("QApplication")
     widget = MainWindow()
+    startup.mark("MainWindow")
     widget.show()
+    if startup.PROFILE:
+        def shown():
+            startup.mark("shown")
+            startup.report()
+            app.quit()
+        QTimer.singleShot(0, shown)
     sys.exit(app.exec())
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import utils
+
+LOG_DIR = "logs"
+METRICS_FILE = os.path.join(LOG_DIR, "metrics.jsonl")
+# 峰值速率按这个长度的时间窗口计算
+PEAK_WINDOW = 1.0
+
+_file_lock = threading.Lock()
+
+
+class StageMetrics:
+    """
+    一个阶段的耗时和数据量。read_wait/write_wait是阻塞在读取源和写入目标上的时间，
+    读取等待多说明源端（docker save、压缩、链路）慢，写入等待多说明目标端（链路、解压、docker load）慢。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.read_wait = 0.0
+        self.write_wait = 0.0
+        self.first_byte: Optional[float] = None
+        self.peak_rate = 0.0
+        self.source = False
+        self._started: Optional[float] = None
+        self._window_start: Optional[float] = None
+        self._window_bytes = 0
+
+    def _on_read(self, n: int, now: float):
+        if self.first_byte is None and n and self._started is not None:
+            self.first_byte = now - self._started
+        self.bytes_in += n
+        if self._window_start is None:
+            self._window_start = now
+        self._window_bytes += n
+        elapsed = now - self._window_start
+        if elapsed >= PEAK_WINDOW:
+            self.peak_rate = max(self.peak_rate, self._window_bytes / elapsed)
+            self._window_start = now
+            self._window_bytes = 0
+
+    def data(self) -> dict:
+        ans = {
+            "seconds": round(self.seconds, 3),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "read_wait": round(self.read_wait, 3),
+            "write_wait": round(self.write_wait, 3),
+        }
+        if self.first_byte is not None:
+            ans["first_byte"] = round(self.first_byte, 3)
+        if self.peak_rate:
+            ans["peak_rate"] = round(self.peak_rate)
+        return ans
+
+
+class TimedReader:
+    # 记录读取的字节数和阻塞时间，其他属性（wait、prefix_sha256等）转给被包装的对象
+    def __init__(self, f, stage: StageMetrics):
+        self.f = f
+        self.stage = stage
+
+    def read(self, n=-1):
+        start = time.monotonic()
+        d = self.f.read(n)
+        now = time.monotonic()
+        self.stage.read_wait += now - start
+        self.stage._on_read(len(d), now)
+        return d
+
+    def readinto(self, b) -> int:
+        start = time.monotonic()
+        if hasattr(self.f, "readinto"):
+            n = self.f.readinto(b) or 0
+        else:
+            d = self.f.read(len(b))
+            n = len(d)
+            b[:n] = d
+        now = time.monotonic()
+        self.stage.read_wait += now - start
+        self.stage._on_read(n, now)
+        return n
+
+    def __getattr__(self, item):
+        return getattr(self.f, item)
+
+
+class TimedWriter:
+    def __init__(self, f, stage: StageMetrics):
+        self.f = f
+        self.stage = stage
+
+    def write(self, d) -> int:
+        start = time.monotonic()
+        n = self.f.write(d)
+        self.stage.write_wait += time.monotonic() - start
+        self.stage.bytes_out += len(d)
+        return n
+
+    def __getattr__(self, item):
+        return getattr(self.f, item)
+
+
+class TaskMetrics:
+    """
+    一个任务的分阶段指标。任务用stage()标记各阶段，用reader()/writer()包装数据流，
+    结束时record()生成一条记录写入METRICS_FILE，summary()生成显示在任务窗口中的摘要。
+    """
+
+    def __init__(self, task: str, kind: str):
+        self.task = task
+        self.kind = kind
+        self.stages: Dict[str, StageMetrics] = {}
+        self.fields = {}
+        self.started: Optional[float] = None
+        self.start_time: Optional[float] = None
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self.started = time.monotonic()
+        self.start_time = time.time()
+
+    def get_stage(self, name: str) -> StageMetrics:
+        with self._lock:
+            s = self.stages.get(name)
+            if s is None:
+                s = self.stages[name] = StageMetrics(name)
+            return s
+
+    @contextmanager
+    def stage(self, name: str):
+        s = self.get_stage(name)
+        start = time.monotonic()
+        s._started = start
+        try:
+            yield s
+        finally:
+            s.seconds += time.monotonic() - start
+
+    def reader(self, f, stage: str = "transfer", source=False) -> TimedReader:
+        # source为True表示从源主机读取，用于计算压缩比
+        s = self.get_stage(stage)
+        s.source = s.source or source
+        if s._started is None:
+            s._started = time.monotonic()
+        return TimedReader(f, s)
+
+    def writer(self, f, stage: str = "transfer") -> TimedWriter:
+        return TimedWriter(f, self.get_stage(stage))
+
+    def set(self, **kwargs):
+        self.fields.update({k: v for k, v in kwargs.items() if v is not None})
+
+    def wire_bytes(self) -> int:
+        return sum(s.bytes_in for s in self.stages.values() if s.source)
+
+    def compression_ratio(self) -> Optional[float]:
+        image_bytes = self.fields.get("image_bytes")
+        wire = self.wire_bytes()
+        if not image_bytes or not wire:
+            return None
+        return image_bytes / wire
+
+    def finish(self, state: str, error: str = None) -> dict:
+        if self.started is not None:
+            self.seconds = time.monotonic() - self.started
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.start_time or time.time())),
+            "task": self.task,
+            "kind": self.kind,
+            "state": state,
+            "seconds": round(self.seconds, 3),
+            "wire_bytes": self.wire_bytes(),
+            "stages": {name: s.data() for name, s in self.stages.items()},
+        }
+        ratio = self.compression_ratio()
+        if ratio is not None:
+            record["compression_ratio"] = round(ratio, 3)
+        peak = max((s.peak_rate for s in self.stages.values()), default=0)
+        if peak:
+            record["peak_rate"] = round(peak)
+        if error:
+            record["error"] = error
+        record.update(self.fields)
+        return record
+
+    def summary(self) -> str:
+        parts: List[str] = []
+        for s in self.stages.values():
+            text = f"{s.name} {s.seconds:.1f}s"
+            if s.bytes_in or s.bytes_out:
+                detail = []
+                if s.first_byte is not None:
+                    detail.append(f"首字节{s.first_byte:.1f}s")
+                detail.append(f"等待读取{s.read_wait:.1f}s")
+                detail.append(f"等待写入{s.write_wait:.1f}s")
+                if s.peak_rate:
+                    detail.append(f"峰值{utils.size_str(int(s.peak_rate))}/s")
+                text += "（" + "，".join(detail) + "）"
+            parts.append(text)
+        text = f"耗时{self.seconds:.1f}s：" + "；".join(parts)
+        ratio = self.compression_ratio()
+        if self.wire_bytes():
+            text += f"；传输{utils.size_str(self.wire_bytes())}"
+        if ratio is not None:
+            text += f"，压缩比{ratio:.2f}"
+        return text
+
+
+def write_record(record: dict, path: str = METRICS_FILE):
+    # 每行一个JSON对象，便于监控系统逐行采集
+    with _file_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,159 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+FRAME_RATE = 10
+MIN_DELTA = 0.01
+RATE_SMOOTHING = 0.3
+
+
+class TaskProgress:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "waiting"
+        self.value = 0
+        self.maximum = 0
+        self.rate = 0.0
+        # 当前生效的限速（字节/秒），None表示不限速
+        self.limit: Optional[float] = None
+        self._sample_value = 0
+        self._sample_time = None
+
+    def fraction(self) -> float:
+        if self.state == "done":
+            return 1
+        if self.maximum <= 0:
+            return 0
+        return min(self.value / self.maximum, 1)
+
+    def eta(self) -> Optional[float]:
+        if self.state != "running" or self.rate <= 0 or self.maximum <= 0:
+            return None
+        return max(self.maximum - self.value, 0) / self.rate
+
+    def _sample(self, now):
+        if self._sample_time is None:
+            self._sample_time = now
+            self._sample_value = self.value
+            return
+        dt = now - self._sample_time
+        if dt <= 0:
+            return
+        instant = (self.value - self._sample_value) / dt
+        self.rate = instant if self.rate == 0 else self.rate + RATE_SMOOTHING * (instant - self.rate)
+        self._sample_time = now
+        self._sample_value = self.value
+
+
+class ProgressSnapshot:
+    def __init__(self, tasks: List[TaskProgress], logs: List[str]):
+        self.tasks = tasks
+        self.logs = logs
+        self.fraction = sum(t.fraction() for t in tasks) / len(tasks) if tasks else 0
+        self.rate = sum(t.rate for t in tasks if t.state == "running")
+        remaining = sum(max(t.maximum - t.value, 0) for t in tasks if t.state in ("waiting", "running"))
+        self.eta = remaining / self.rate if self.rate > 0 else None
+
+
+class ProgressAggregator:
+    """
+    收集后台任务的进度和日志，合并后通过sink一次性送出。
+    任务线程只调用update/log等普通方法，不接触Qt；
+    距离上次送出超过1/FRAME_RATE秒，或总进度变化超过MIN_DELTA时才调用sink。
+    """
+
+    def __init__(self, sink: Callable[[ProgressSnapshot], None],
+                 frame_rate=FRAME_RATE, min_delta=MIN_DELTA):
+        self.sink = sink
+        self.interval = 1 / frame_rate
+        self.min_delta = min_delta
+        self._lock = threading.Lock()
+        self._tasks: Dict[int, TaskProgress] = {}
+        self._limits: Dict[int, Callable[[], Optional[float]]] = {}
+        self._order: List[TaskProgress] = []
+        self._logs: List[str] = []
+        self._last_flush = 0.0
+        self._last_fraction = 0.0
+        self._dirty = False
+
+    def _get(self, task) -> TaskProgress:
+        p = self._tasks.get(id(task))
+        if p is None:
+            p = TaskProgress(task.name())
+            self._tasks[id(task)] = p
+            self._order.append(p)
+            if hasattr(task, "rate_limit"):
+                self._limits[id(p)] = task.rate_limit
+        return p
+
+    def add_tasks(self, tasks):
+        with self._lock:
+            for t in tasks:
+                self._get(t)
+            self._dirty = True
+        self.flush(force=True)
+
+    def set_state(self, task, state: str):
+        with self._lock:
+            p = self._get(task)
+            p.state = state
+            if state != "running":
+                p.rate = 0
+            self._dirty = True
+        self.flush(force=True)
+
+    def set_maximum(self, task, value):
+        with self._lock:
+            self._get(task).maximum = value
+            self._dirty = True
+
+    def update(self, task, value):
+        with self._lock:
+            self._get(task).value = value
+            self._dirty = True
+        self.flush()
+
+    def log(self, text: str):
+        with self._lock:
+            self._logs.append(text)
+            self._dirty = True
+        self.flush()
+
+    def flush(self, force=False):
+        with self._lock:
+            if not self._dirty and not any(t.state == "running" for t in self._order):
+                return
+            now = time.monotonic()
+            fraction = sum(t.fraction() for t in self._order) / len(self._order) if self._order else 0
+            if not force and now - self._last_flush < self.interval \
+                    and abs(fraction - self._last_fraction) < self.min_delta:
+                return
+            for t in self._order:
+                if t.state == "running":
+                    t._sample(now)
+                    if id(t) in self._limits:
+                        t.limit = self._limits[id(t)]()
+            self._last_flush = now
+            self._last_fraction = fraction
+            self._dirty = False
+            logs, self._logs = self._logs, []
+            self.sink(ProgressSnapshot([_copy(t) for t in self._order], logs))
+
+
+def _copy(t: TaskProgress) -> TaskProgress:
+    c = TaskProgress(t.name)
+    c.state = t.state
+    c.value = t.value
+    c.maximum = t.maximum
+    c.rate = t.rate
+    c.limit = t.limit
+    return c
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
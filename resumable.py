@@ -0,0 +1,334 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import IO, AnyStr, Callable, List, Optional
+
+import integrity
+import stream_pump
+import utils
+
+CHUNK_SIZE = 64 << 20
+MAX_RETRIES = 5
+RETRY_BACKOFF = 2
+
+
+class TransferInterrupted(IOError):
+    pass
+
+
+def transient_errors() -> tuple:
+    # 可以重试的错误。paramiko在出错时才导入，命令行的hosts、images等命令不加载它和cryptography
+    import paramiko
+    return OSError, EOFError, paramiko.SSHException
+
+
+def error_detail(stream) -> str:
+    # 导出命令失败时附在错误信息后面的标准错误输出
+    detail = stream.error_output() if hasattr(stream, "error_output") else ""
+    return f"：{detail}" if detail else ""
+
+
+def skip_prefix(stream, offset: int) -> Optional[str]:
+    # 从头读取并丢弃offset字节，返回这部分的sha256，供断点续传确认源数据与上次一致；offset为0时返回None
+    if not offset:
+        return None
+    h = hashlib.sha256()
+    remain = offset
+    while remain:
+        d = stream.read(min(remain, 1 << 20))
+        if not d:
+            break
+        h.update(d)
+        remain -= len(d)
+    return h.hexdigest()
+
+
+def backoff(attempt: int, is_running: Callable[[], bool]) -> int:
+    delay = RETRY_BACKOFF ** attempt
+    deadline = time.monotonic() + delay
+    while is_running() and time.monotonic() < deadline:
+        time.sleep(0.2)
+    return delay
+
+
+class CheckpointJournal:
+    """
+    断点续传的日志文件，每行一个JSON对象。第一行记录传输的内容（镜像ID、压缩方式等），
+    之后每完成一个数据块追加一行：偏移、大小、块的sha256以及从文件开头到块末尾的sha256。
+    """
+
+    def __init__(self, path: str, identity: dict):
+        self.path = path
+        self.identity = identity
+        self.entries: List[dict] = []
+
+    def load(self) -> List[dict]:
+        self.entries = []
+        try:
+            with open(self.path, encoding="utf8") as f:
+                lines = [json.loads(x) for x in f if x.strip()]
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return self.entries
+        if not lines or lines[0] != self.identity:
+            return self.entries
+        self.entries = lines[1:]
+        return self.entries
+
+    def reset(self, entries: List[dict] = ()):
+        self.entries = list(entries)
+        with open(self.path, "w", encoding="utf8") as f:
+            for x in [self.identity] + self.entries:
+                f.write(json.dumps(x) + "\n")
+
+    def append(self, entry: dict):
+        self.entries.append(entry)
+        with open(self.path, "a", encoding="utf8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _ChunkWriter:
+    # 把数据写入文件，每满CHUNK_SIZE字节落盘一次并记录到日志
+    def __init__(self, f, journal: CheckpointJournal, offset: int, prefix, chunk_size: int, on_chunk):
+        self.f = f
+        self.journal = journal
+        self.offset = offset
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.chunk = hashlib.sha256()
+        self.chunk_len = 0
+
+    def write(self, data):
+        data = memoryview(data)
+        total = len(data)
+        while len(data):
+            n = min(len(data), self.chunk_size - self.chunk_len)
+            part = data[:n]
+            self.f.write(part)
+            self.chunk.update(part)
+            self.prefix.update(part)
+            self.chunk_len += n
+            data = data[n:]
+            if self.chunk_len == self.chunk_size:
+                self.commit()
+        return total
+
+    def commit(self):
+        if self.chunk_len == 0:
+            return
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.journal.append({
+            "offset": self.offset,
+            "size": self.chunk_len,
+            "sha256": self.chunk.hexdigest(),
+            "prefix_sha256": self.prefix.hexdigest(),
+        })
+        self.offset += self.chunk_len
+        self.chunk = hashlib.sha256()
+        self.chunk_len = 0
+        if self.on_chunk:
+            self.on_chunk(self.offset)
+
+
+class ResumableDownload:
+    """
+    把open_stream(offset)返回的数据流保存到path + ".part"，完成后改名为path。
+    出现transient_errors()中的错误时按指数退避重试，从日志中最后一个校验通过的数据块之后继续；
+    源数据与日志不一致时从头开始，保证最终文件与一次传输完成的结果相同。
+    给出verifier时边写入边校验，续传时已写入的部分在校验数据块时一并送入，完成后校验不通过则不改名，
+    删除已下载的数据。
+    """
+
+    def __init__(self, path: str, open_stream: Callable[[int], IO[AnyStr]], identity: dict,
+                 log: Callable[[str], None], is_running: Callable[[], bool] = lambda: True,
+                 on_progress: Optional[Callable[[int], None]] = None, chunk_size=CHUNK_SIZE,
+                 wrap_writer: Callable = None, verifier: integrity.StreamVerifier = None):
+        self.path = path
+        self.part_path = path + ".part"
+        self.journal = CheckpointJournal(path + ".journal", identity)
+        self.open_stream = open_stream
+        self.log = log
+        self.is_running = is_running
+        self.on_progress = on_progress
+        self.chunk_size = chunk_size
+        # 包装写入本地文件的对象，用于统计写入耗时
+        self.wrap_writer = wrap_writer
+        self.verifier = verifier
+        self.committed = 0
+        self.generation = 0
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def _verify_part(self):
+        # 逐块校验已写入的数据，截断到最后一个校验通过的块
+        entries = self.journal.load()
+        prefix = hashlib.sha256()
+        good = []
+        if entries and os.path.exists(self.part_path):
+            with open(self.part_path, "rb") as f:
+                for e in entries:
+                    if e["offset"] != sum(x["size"] for x in good):
+                        break
+                    d = f.read(e["size"])
+                    if len(d) != e["size"] or hashlib.sha256(d).hexdigest() != e["sha256"]:
+                        break
+                    prefix.update(d)
+                    if self.verifier:
+                        self.verifier.update(d)
+                    good.append(e)
+        self.journal.reset(good)
+        return sum(x["size"] for x in good), prefix
+
+    def _restart(self):
+        self.journal.reset()
+        if self.verifier:
+            self.verifier.reset()
+        with self._cond:
+            self.generation += 1
+            self.committed = 0
+            self._cond.notify_all()
+        return 0, hashlib.sha256()
+
+    def _attempt(self):
+        if self.verifier:
+            self.verifier.reset()
+        offset, prefix = self._verify_part()
+        with self._cond:
+            self.committed = offset
+            self._cond.notify_all()
+        stream = self.open_stream(offset)
+        if offset:
+            remote = stream.prefix_sha256() if hasattr(stream, "prefix_sha256") else None
+            if remote != prefix.hexdigest():
+                self.log("源数据与上次传输的内容不一致，从头开始")
+                stream.close()
+                offset, prefix = self._restart()
+                stream = self.open_stream(0)
+            else:
+                self.log(f"从{utils.size_str(offset)}处继续传输")
+
+        def on_chunk(committed):
+            with self._cond:
+                self.committed = committed
+                self._cond.notify_all()
+
+        mode = "r+b" if os.path.exists(self.part_path) else "wb"
+        with open(self.part_path, mode) as f:
+            f.seek(offset)
+            f.truncate()
+            writer = _ChunkWriter(f, self.journal, offset, prefix, self.chunk_size, on_chunk)
+            if self.verifier:
+                writer = self.verifier.writer(writer)
+            if self.wrap_writer:
+                writer = self.wrap_writer(writer)
+            progress = None
+            if self.on_progress:
+                progress = lambda n: self.on_progress(offset + n)
+            stream_pump.pump(stream, writer, progress, self.is_running)
+            if not self.is_running():
+                return False
+            status = stream.wait() if hasattr(stream, "wait") else 0
+            if status == -1:
+                # 连接中断，可以从断点继续
+                raise TransferInterrupted("数据流意外结束")
+            if status != 0:
+                # 导出命令本身失败（镜像不存在、docker出错），重试也不会成功
+                raise RuntimeError(f"导出镜像失败，退出码{status}" + error_detail(stream))
+            writer.commit()
+        if self.verifier:
+            self.verifier.finish()
+        return True
+
+    def run(self) -> bool:
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    if not self._attempt():
+                        return False
+                    break
+                except transient_errors() as e:
+                    if attempt == MAX_RETRIES or not self.is_running():
+                        raise
+                    self.log(f"传输中断：{e}，{RETRY_BACKOFF ** attempt}秒后重试（第{attempt + 1}次）")
+                    backoff(attempt, self.is_running)
+            os.replace(self.part_path, self.path)
+            self.journal.remove()
+            return True
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, integrity.IntegrityError):
+                # 已写入的数据有问题，不能用于续传
+                self.journal.remove()
+                try:
+                    os.remove(self.part_path)
+                except FileNotFoundError:
+                    pass
+            raise
+        finally:
+            if self.verifier:
+                self.verifier.close()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def follow(self) -> 'SpoolReader':
+        return SpoolReader(self)
+
+    def incomplete_message(self) -> str:
+        return f"未完成的数据保留在{self.part_path}，再次执行同一任务时会从断点继续"
+
+
+class SpoolReader:
+    """
+    在下载进行的同时读取已经落盘的数据块，用于一边缓存源数据一边发送给目标主机。
+    下载从头重新开始时抛出TransferInterrupted，调用方需要重新发送。
+    """
+
+    def __init__(self, download: ResumableDownload):
+        self.download = download
+        self.generation = download.generation
+        self.pos = 0
+        self.f = None
+
+    def _path(self):
+        d = self.download
+        return d.path if d.finished and d.error is None and not os.path.exists(d.part_path) else d.part_path
+
+    def readinto(self, b) -> int:
+        d = self.download
+        with d._cond:
+            while True:
+                if d.generation != self.generation:
+                    raise TransferInterrupted("源数据已从头重新传输")
+                if d.committed > self.pos:
+                    available = d.committed - self.pos
+                    break
+                if d.finished:
+                    if d.error is not None:
+                        raise TransferInterrupted(f"源数据传输失败：{d.error}")
+                    available = None
+                    break
+                d._cond.wait(0.5)
+        if self.f is None:
+            self.f = open(self._path(), "rb")
+            self.f.seek(self.pos)
+        view = memoryview(b)
+        if available is not None:
+            view = view[:available]
+        n = self.f.readinto(view) or 0
+        self.pos += n
+        return n
+
+    def close(self):
+        if self.f:
+            self.f.close()
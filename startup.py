@@ -0,0 +1,39 @@
+"""
+启动耗时统计。python main.py --profile-startup 时记录各阶段距进程启动的时间和此时已经加载的重型模块，
+窗口显示后输出到标准错误、追加到指标文件并退出；需要每个模块的导入耗时可以同时加上 python -X importtime。
+"""
+import sys
+import time
+
+PROFILE = "--profile-startup" in sys.argv
+# 这些模块应该在第一次用到时才导入，不应出现在窗口显示之前
+HEAVY_MODULES = ["paramiko", "cryptography", "requests", "docker_archive", "layer_store", "tasks"]
+
+_started = time.perf_counter()
+_marks = []
+
+
+def mark(name: str):
+    _marks.append((name, time.perf_counter() - _started))
+
+
+def record() -> dict:
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "kind": "startup",
+        "seconds": round(_marks[-1][1], 3) if _marks else 0,
+        "stages": {name: round(t, 3) for name, t in _marks},
+        "loaded": [x for x in HEAVY_MODULES if x in sys.modules],
+    }
+
+
+def report():
+    import metrics
+    r = record()
+    for name, t in _marks:
+        print(f"{t * 1000:8.1f} ms  {name}", file=sys.stderr)
+    print(f"窗口显示前已加载：{', '.join(r['loaded']) or '无'}", file=sys.stderr)
+    try:
+        metrics.write_record(r)
+    except OSError as e:
+        print(f"写入指标文件失败：{e}", file=sys.stderr)
@@ -0,0 +1,77 @@
+import queue
+import threading
+from typing import IO, AnyStr, Callable, Optional
+
+BUFFER_SIZE = 4 << 20
+QUEUE_DEPTH = 4
+
+_EOF = object()
+
+
+def _read_into(src, buf: bytearray) -> int:
+    if hasattr(src, "readinto"):
+        return src.readinto(buf) or 0
+    d = src.read(len(buf))
+    if not d:
+        return 0
+    buf[:len(d)] = d
+    return len(d)
+
+
+def pump(src: IO[AnyStr], dst: IO[AnyStr],
+         on_progress: Optional[Callable[[int], None]] = None,
+         is_running: Callable[[], bool] = lambda: True,
+         buffer_size: int = BUFFER_SIZE,
+         queue_depth: int = QUEUE_DEPTH) -> int:
+    """
+    把src的数据复制到dst，返回复制的字节数。
+    读写分别在两个线程上进行，中间是一个长度为queue_depth的有界队列，
+    缓冲区在两个线程之间循环复用，不会为每个数据块重新分配内存。
+    """
+    free = queue.Queue()
+    for _ in range(queue_depth + 1):
+        free.put(bytearray(buffer_size))
+    filled = queue.Queue(queue_depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                filled.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def reader():
+        try:
+            while not stop.is_set():
+                try:
+                    buf = free.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                n = _read_into(src, buf)
+                if n == 0:
+                    break
+                put((buf, n))
+            put((_EOF, 0))
+        except BaseException as e:
+            put((e, 0))
+
+    t = threading.Thread(target=reader, daemon=True)
+    t.start()
+    cnt = 0
+    try:
+        while is_running():
+            buf, n = filled.get()
+            if buf is _EOF:
+                break
+            if isinstance(buf, BaseException):
+                raise buf
+            dst.write(memoryview(buf)[:n])
+            free.put(buf)
+            cnt += n
+            if on_progress:
+                on_progress(cnt)
+    finally:
+        stop.set()
+    return cnt
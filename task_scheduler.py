@@ -0,0 +1,72 @@
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+MAX_WORKERS = 4
+MAX_SAVES_PER_HOST = 2
+MAX_LOADS_PER_HOST = 2
+
+
+class TaskScheduler:
+    """
+    按全局并发数和每台主机的save/load并发数调度任务。
+    任务通过resources()声明自己占用的资源，例如[("save", "10.0.0.1"), ("load", "localhost")]。
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_saves_per_host=MAX_SAVES_PER_HOST,
+                 max_loads_per_host=MAX_LOADS_PER_HOST):
+        self.max_workers = max_workers
+        self.limits = {"save": max_saves_per_host, "load": max_loads_per_host}
+        self._cond = threading.Condition()
+        self._in_use: Dict[Tuple[str, str], int] = {}
+        self._running = 0
+        self._cancelled = False
+
+    def _acquirable(self, task) -> bool:
+        for r in task.resources():
+            if self._in_use.get(r, 0) >= self.limits.get(r[0], self.max_workers):
+                return False
+        return True
+
+    def _acquire(self, task):
+        self._running += 1
+        for r in task.resources():
+            self._in_use[r] = self._in_use.get(r, 0) + 1
+
+    def _release(self, task):
+        with self._cond:
+            self._running -= 1
+            for r in task.resources():
+                self._in_use[r] -= 1
+            self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def run(self, tasks: List, on_start: Optional[Callable] = None, on_end: Optional[Callable] = None):
+        pending = list(tasks)
+
+        def worker(t):
+            try:
+                if on_start:
+                    on_start(t)
+                t.start()
+                if on_end:
+                    on_end(t)
+            finally:
+                self._release(t)
+
+        with self._cond:
+            while pending or self._running:
+                if self._cancelled:
+                    pending.clear()
+                for t in list(pending):
+                    if self._running >= self.max_workers:
+                        break
+                    if not self._acquirable(t):
+                        continue
+                    pending.remove(t)
+                    self._acquire(t)
+                    threading.Thread(target=worker, args=(t,), daemon=True).start()
+                self._cond.wait()
@@ -0,0 +1,847 @@
+import hashlib
+import math
+import os.path
+import tempfile
+import threading
+from abc import abstractmethod
+from typing import List, Optional, Tuple
+
+import bandwidth
+import docker_archive
+import integrity
+import layer_store
+import metrics
+import resumable
+import stream_pump
+import utils
+from progress import ProgressAggregator
+from resumable import ResumableDownload
+from endpoints import compression
+from hosts import HostItem
+from endpoints.endpoint import Image
+
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "image_portal")
+# 多目标转移时缓存按较小的块提交，目标主机可以更早开始读取
+FANOUT_CHUNK_SIZE = 8 << 20
+
+
+class BackgroundTask:
+    def __init__(self, name: str, reporter: ProgressAggregator):
+        self._name = name
+        self.reporter = reporter
+        self.state = 0   # 0: waiting, 1: running, 2: finished, 3: failed
+        self.maximum = 0
+        self.value = 0
+        self.state_lock = threading.Lock()
+        self.metrics = metrics.TaskMetrics(name, type(self).__name__)
+        # 数据经过的主机，如[源主机, bandwidth.LOCAL, 目标主机]，用于限速
+        self.route: List[str] = []
+
+    def name(self) -> str:
+        return self._name
+
+    def throttle(self, f, route: List[str] = None):
+        return bandwidth.manager.throttle(f, route or self.route, self.is_running)
+
+    def rate_limit(self) -> Optional[float]:
+        return bandwidth.manager.limit(self.route) if self.route else None
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return []
+
+    def progress(self) -> float:
+        if self.is_finished():
+            return 1
+        if self.maximum == 0:
+            return 0
+        return min(self.value / self.maximum, 1)
+
+    def is_finished(self) -> bool:
+        with self.state_lock:
+            return self.state == 2
+
+    def is_running(self) -> bool:
+        with self.state_lock:
+            return self.state == 1
+
+    def is_failed(self) -> bool:
+        with self.state_lock:
+            return self.state == 3
+
+    def kill(self):
+        with self.state_lock:
+            if self.state in (2, 3):
+                return
+            self.state = 3
+        self.reporter.set_state(self, "failed")
+
+    @abstractmethod
+    def run(self):
+        pass
+
+    def add_log(self, text):
+        self.reporter.log(f"[{self._name}] {text}")
+
+    def start(self):
+        if self.state != 0:
+            self.add_log(f"任务已经运行过（state={self.state}），不再重复启动")
+            return
+        self.metrics.begin()
+        try:
+            with self.state_lock:
+                self.state = 1
+            self.reporter.set_state(self, "running")
+            self.run()
+        except Exception as e:
+            with self.state_lock:
+                self.state = 3
+            self.reporter.set_state(self, "failed")
+            self.add_log(str(e))
+            self.finish_metrics("failed", str(e))
+            return
+        with self.state_lock:
+            cancelled = self.state != 1
+            if not cancelled:
+                self.state = 2
+        if cancelled:
+            self.finish_metrics("cancelled")
+            return
+        self.set_progress_value(self.maximum)
+        self.reporter.set_state(self, "done")
+        self.finish_metrics("done")
+
+    def verify(self, verifier: integrity.StreamVerifier):
+        # 数据流结束后完成校验，不通过时抛出IntegrityError
+        verifier.finish()
+        if verifier.enabled:
+            self.metrics.set(sha256=verifier.sha256(), layers_verified=verifier.verified_layers())
+            self.add_log(verifier.summary())
+
+    def finish_metrics(self, state: str, error: str = None):
+        record = self.metrics.finish(state, error)
+        self.add_log(self.metrics.summary())
+        try:
+            metrics.write_record(record)
+        except OSError as e:
+            self.add_log(f"写入指标文件失败：{e}")
+
+    def set_progress_maximum(self, value):
+        self.maximum = value
+        self.reporter.set_maximum(self, value)
+
+    def set_progress_value(self, value):
+        self.value = value
+        self.reporter.update(self, value)
+
+
+def finish_stream(stream, ok: bool):
+    # 传输成功时正常关闭，等待目标主机导入完成并检查docker load的退出码；
+    # 出错、校验失败或取消时中止，不发送EOF，目标主机不会导入这些数据
+    if not ok and hasattr(stream, "abort"):
+        stream.abort()
+        return
+    stream.close()
+    if not ok:
+        return
+    status = stream.wait() if hasattr(stream, "wait") else 0
+    if status == -1:
+        raise resumable.TransferInterrupted("与目标主机的连接中断")
+    if status != 0:
+        raise RuntimeError(f"docker load 失败，退出码{status}")
+
+
+def send_spooled(task: BackgroundTask, download: ResumableDownload, host: HostItem, image: Image,
+                 codec: compression.Codec, on_progress, stage_prefix="") -> int:
+    """
+    从本机缓存读取数据发送给目标主机，下载可以仍在进行。与目标主机的连接中断时按指数退避从缓存重新发送。
+    返回发送的字节数。
+    """
+    for attempt in range(resumable.MAX_RETRIES + 1):
+        reader = download.follow()
+        target_stream = host.get_endpoint().create_image_stream(image, codec, task.add_log)
+        try:
+            with task.metrics.stage(stage_prefix + "transfer"):
+                cnt = stream_pump.pump(task.throttle(task.metrics.reader(reader, stage_prefix + "transfer"),
+                                                     [bandwidth.LOCAL, host.get_addr()]),
+                                       task.metrics.writer(target_stream, stage_prefix + "transfer"),
+                                       on_progress, task.is_running)
+            if not task.is_running():
+                finish_stream(target_stream, False)
+                return cnt
+            with task.metrics.stage(stage_prefix + "finish"):
+                finish_stream(target_stream, True)
+            return cnt
+        except resumable.transient_errors() as e:
+            # 缓存的数据下载失败或校验不通过时也是这里，不能让目标主机导入已发送的部分
+            finish_stream(target_stream, False)
+            if attempt == resumable.MAX_RETRIES or not task.is_running() or download.error is not None:
+                raise
+            task.add_log(f"发送到{host.get_name()}中断：{e}，{resumable.RETRY_BACKOFF ** attempt}秒后从缓存重新发送")
+            resumable.backoff(attempt, task.is_running)
+        except BaseException:
+            finish_stream(target_stream, False)
+            raise
+        finally:
+            reader.close()
+
+
+def run_download(task: BackgroundTask, download: ResumableDownload, reraise=True) -> bool:
+    try:
+        ok = download.run()
+    except Exception as e:
+        if not isinstance(e, integrity.IntegrityError):
+            task.add_log(download.incomplete_message())
+        if reraise:
+            raise
+        return False
+    if not ok:
+        task.add_log(download.incomplete_message())
+    return ok
+
+
+def check_source(stream):
+    # 源数据读完后检查导出命令是否成功，docker save中途失败时数据不完整
+    if not hasattr(stream, "wait"):
+        return
+    while stream.read(1 << 20):
+        # 只解析到tar结束标记的读取方（跳过层、镜像库）可能没有读完
+        pass
+    status = stream.wait()
+    if status == -1:
+        raise resumable.TransferInterrupted("与源主机的连接中断")
+    if status != 0:
+        raise RuntimeError(f"docker save 失败，退出码{status}" + resumable.error_detail(stream))
+
+
+def image_diff_ids(task: BackgroundTask, image: Image) -> Optional[List[str]]:
+    # 事先从源主机得到层的diff id，传输时每读完一层立即校验
+    try:
+        return image.endpoint.get_image_layers(image)
+    except Exception as e:
+        task.add_log(f"获取镜像的层失败：{e}，读到config后再校验")
+        return None
+
+
+class SaveImageTask(BackgroundTask):
+    def __init__(self, reporter, image: Image, store: str = None):
+        super().__init__(f"save {image.name()}", reporter)
+        self.image = image
+        self.codec = compression.get_codec(None)
+        # 不为None时保存到该目录下的镜像库，而不是当前目录下的单独文件
+        self.store = store
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return [("save", self.image.endpoint.addr)]
+
+    def get_name(self):
+        return (self.image.name().
+                replace(":", "_").
+                replace("/", "_") +
+                self.codec.ext)
+
+    def run(self):
+        with self.metrics.stage("prepare"):
+            self.codec = compression.resolve(self.image.endpoint.codec, self.image.endpoint)
+            diff_ids = image_diff_ids(self, self.image) if self.store is None and integrity.enabled else None
+        self.metrics.set(source=self.image.endpoint.addr, codec=self.codec.name, image_bytes=self.image.size())
+        self.route = [self.image.endpoint.addr, bandwidth.LOCAL]
+        self.set_progress_maximum(self.image.size())
+        if self.store is not None:
+            self.run_store()
+            return
+        path = os.path.join(os.getcwd(), self.get_name())
+        self.add_log(f"开始保存镜像：{self.image.name()}，压缩方式：{self.codec.name}")
+        self.add_log(f"镜像大小：{self.image.size_str()}")
+        self.add_log(f"镜像文件名：{path}")
+        integrity.remove_sidecar(path)
+        verifier = integrity.StreamVerifier(self.codec, diff_ids)
+        download = ResumableDownload(path, lambda offset: self.throttle(self.metrics.reader(
+                                         self.image.get_stream(self.codec, offset), source=True)),
+                                     {"image": self.image.hash(), "codec": self.codec.name},
+                                     self.add_log, self.is_running, self.set_progress_value,
+                                     wrap_writer=self.metrics.writer, verifier=verifier)
+        with self.metrics.stage("transfer"):
+            if not run_download(self, download):
+                return
+        self.verify(verifier)
+        if verifier.enabled:
+            integrity.write_sidecar(path, verifier, image_id=self.image.hash())
+        self.add_log(f"保存完成，文件大小：{utils.size_str(os.stat(path).st_size)}")
+
+    def run_store(self):
+        store = layer_store.LayerStore(self.store)
+        self.add_log(f"开始将{self.image.name()}保存到镜像库{store.path}，压缩方式：{self.codec.name}")
+        if store.has_image(self.image.name(), self.image.hash()):
+            self.add_log("镜像库中已有该镜像，跳过")
+            return
+        with self.metrics.stage("connect"):
+            stream = self.image.get_stream(self.codec)
+        try:
+            with self.metrics.stage("transfer"):
+                reader = self.codec.open_reader(self.throttle(self.metrics.reader(stream, source=True)))
+                result = store.add(reader, self.image.name(), self.image.hash(),
+                                   self.set_progress_value, self.is_running)
+            if result is not None:
+                check_source(stream)
+        finally:
+            stream.close()
+        if result is not None:
+            self.add_log(f"保存完成，写入{result.blobs_written}层（{utils.size_str(result.bytes_written)}），"
+                         f"镜像库中已有{result.layers_skipped}层")
+
+
+class BatchSaveImageTask(BackgroundTask):
+    def __init__(self, reporter, images: List[Image]):
+        super().__init__(f"save {len(images)} images", reporter)
+        self.images = images
+        self.endpoint = images[0].endpoint
+        self.codec = compression.get_codec(None)
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return [("save", self.endpoint.addr)]
+
+    def get_name(self):
+        # 同一组镜像得到同一个文件名，中断后再次保存可以从断点继续
+        digest = hashlib.sha256("\n".join(sorted(x.name() for x in self.images)).encode()).hexdigest()
+        return f"images_{len(self.images)}_{digest[:12]}" + self.codec.ext
+
+    def run(self):
+        with self.metrics.stage("prepare"):
+            self.codec = compression.resolve(self.endpoint.codec, self.endpoint)
+        self.metrics.set(source=self.endpoint.addr, codec=self.codec.name,
+                         image_bytes=sum(x.size() for x in self.images))
+        self.route = [self.endpoint.addr, bandwidth.LOCAL]
+        self.set_progress_maximum(sum(x.size() for x in self.images))
+        path = os.path.join(os.getcwd(), self.get_name())
+        self.add_log(f"开始将{len(self.images)}个镜像保存到同一个文件，压缩方式：{self.codec.name}")
+        for x in self.images:
+            self.add_log(f"  {x.name()}  {x.size_str()}")
+        self.add_log(f"镜像文件名：{path}")
+        integrity.remove_sidecar(path)
+        verifier = integrity.StreamVerifier(self.codec)
+        download = ResumableDownload(path, lambda offset: self.throttle(self.metrics.reader(
+                                         self.endpoint.get_images_stream(self.images, self.codec, offset),
+                                         source=True)),
+                                     {"images": [x.hash() for x in self.images], "codec": self.codec.name},
+                                     self.add_log, self.is_running, self.set_progress_value,
+                                     wrap_writer=self.metrics.writer, verifier=verifier)
+        with self.metrics.stage("transfer"):
+            if not run_download(self, download):
+                return
+        self.verify(verifier)
+        if verifier.enabled:
+            integrity.write_sidecar(path, verifier, image_ids=[x.hash() for x in self.images])
+        self.add_log(f"保存完成，文件大小：{utils.size_str(os.stat(path).st_size)}，"
+                     f"导入时会恢复全部{len(self.images)}个镜像的标签")
+
+
+class LoadImageTask(BackgroundTask):
+    def __init__(self, reporter, host: HostItem, path: str, names: List[str] = None):
+        # names不为None时path是镜像库目录，导入库中的这些镜像
+        super().__init__(f"load {', '.join(names)}" if names else f"load {path}", reporter)
+        self.host = host
+        self.path = path
+        self.names = names
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return [("load", self.host.get_addr())]
+
+    def start(self):
+        try:
+            super().start()
+        finally:
+            # 目标主机的镜像有变化，下次显示时重新验证缓存
+            self.host.inventory.invalidate()
+
+    def run(self):
+        if self.names is not None:
+            self.run_store()
+            return
+        self.set_progress_maximum(os.stat(self.path).st_size)
+        self.add_log(f"开始导入{self.path}")
+        self.add_log(f"文件大小：{utils.size_str(os.stat(self.path).st_size)}")
+        codec = compression.codec_for_path(self.path)
+        self.metrics.set(target=self.host.get_addr(), codec=codec.name)
+        self.route = [bandwidth.LOCAL, self.host.get_addr()]
+        sidecar = integrity.read_sidecar(self.path) if integrity.enabled else None
+        if sidecar is not None and sidecar.get("size") != os.stat(self.path).st_size:
+            raise integrity.IntegrityError(f"文件大小与{integrity.sidecar_path(self.path)}中记录的不一致，文件不完整或已损坏")
+        verifier = integrity.StreamVerifier(codec, sidecar and sidecar.get("diff_ids"),
+                                            sidecar and sidecar.get("size"), sidecar and sidecar.get("sha256"))
+        with self.metrics.stage("connect"):
+            target = self.host.get_endpoint()
+            local_decompress = not codec.native_load and codec.name not in target.get_codecs()
+            stream = target.create_image_stream(None, compression.CODECS["none"] if local_decompress else codec,
+                                                self.add_log)
+        ok = False
+        try:
+            with self.metrics.stage("transfer"), open(self.path, "rb") as f:
+                if not local_decompress:
+                    stream_pump.pump(self.throttle(self.metrics.reader(f)),
+                                     verifier.writer(self.metrics.writer(stream)),
+                                     self.set_progress_value, self.is_running)
+                else:
+                    # 目标主机没有对应的解压工具，在本机解压后发送
+                    self.add_log(f"目标主机不支持{codec.name}，在本机解压后发送")
+                    reader = codec.open_reader(verifier.reader(self.metrics.reader(f)))
+                    stream_pump.pump(self.throttle(reader), self.metrics.writer(stream),
+                                     lambda _: self.set_progress_value(f.tell()), self.is_running)
+                    reader.close()
+            if not self.is_running():
+                return
+            self.verify(verifier)
+            ok = True
+        finally:
+            verifier.close()
+            with self.metrics.stage("finish"):
+                finish_stream(stream, ok)
+        self.add_log("导入完成")
+
+    def run_store(self):
+        # 层在库中已经压缩，直接按未压缩的tar发送
+        store = layer_store.LayerStore(self.path)
+        self.set_progress_maximum(store.stream_size(self.names))
+        self.add_log(f"开始从镜像库{store.path}导入{len(self.names)}个镜像")
+        self.metrics.set(target=self.host.get_addr(), codec="none")
+        self.route = [bandwidth.LOCAL, self.host.get_addr()]
+        with self.metrics.stage("connect"):
+            reader = store.open_stream(self.names)
+            stream = self.host.get_endpoint().create_image_stream(None, compression.CODECS["none"], self.add_log)
+        verifier = integrity.StreamVerifier()
+        ok = False
+        try:
+            with self.metrics.stage("transfer"):
+                cnt = stream_pump.pump(self.throttle(self.metrics.reader(reader)),
+                                       verifier.writer(self.metrics.writer(stream)),
+                                       self.set_progress_value, self.is_running)
+            if self.is_running():
+                self.verify(verifier)
+                ok = True
+        finally:
+            verifier.close()
+            with self.metrics.stage("finish"):
+                finish_stream(stream, ok)
+        self.add_log(f"导入完成，传输数据大小：{utils.size_str(cnt)}")
+
+
+class SyncImageTask(BackgroundTask):
+    def __init__(self, reporter, image, host, skip_existing_layers=False, codec=None, relay=False,
+                 resumable=False):
+        super().__init__(f"sync {image.name()} to {host.get_name()}", reporter)
+        self.image = image
+        self.host = host
+        self.skip_existing_layers = skip_existing_layers
+        self.codec = codec
+        self.relay = relay
+        self.resumable = resumable
+        self.diff_ids: Optional[List[str]] = None
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return [("save", self.image.endpoint.addr), ("load", self.host.get_addr())]
+
+    def start(self):
+        try:
+            super().start()
+        finally:
+            # 目标主机的镜像有变化，下次显示时重新验证缓存
+            self.host.inventory.invalidate()
+
+    def resolve_codec(self, local=False) -> compression.Codec:
+        source = self.image.endpoint
+        with self.metrics.stage("prepare"):
+            codec = compression.resolve(self.codec or source.codec, source, self.host.get_endpoint(), local)
+            if self.diff_ids is None and integrity.enabled:
+                self.diff_ids = image_diff_ids(self, self.image)
+        self.metrics.set(codec=codec.name)
+        self.add_log(f"压缩方式：{codec.name}")
+        return codec
+
+    def run(self):
+        self.metrics.set(source=self.image.endpoint.addr, target=self.host.get_addr(), image_bytes=self.image.size())
+        self.route = [self.image.endpoint.addr, bandwidth.LOCAL, self.host.get_addr()]
+        if self.skip_existing_layers:
+            self.run_skip_existing_layers()
+            return
+        self.set_progress_maximum(self.image.size())
+        codec = self.resolve_codec()
+        if self.relay and self.rate_limit() is not None:
+            # 直接传输不经过本机，无法限速
+            self.add_log("已设置限速，不在两台主机之间直接传输")
+        elif self.relay and self.run_relay(codec):
+            return
+        if self.resumable:
+            self.run_resumable(codec)
+            return
+        with self.metrics.stage("connect"):
+            from_stream = self.image.get_stream(codec)
+            target_stream = self.host.get_endpoint().create_image_stream(self.image, codec, self.add_log)
+        self.add_log(f"开始将{self.image.name()}导入到{self.host.get_name()}")
+        self.add_log(f"镜像大小：{self.image.size_str()}")
+        verifier = integrity.StreamVerifier(codec, self.diff_ids)
+        ok = False
+        try:
+            with self.metrics.stage("transfer"):
+                cnt = stream_pump.pump(self.throttle(self.metrics.reader(from_stream, source=True)),
+                                       verifier.writer(self.metrics.writer(target_stream)),
+                                       self.set_progress_value, self.is_running)
+            if self.is_running():
+                check_source(from_stream)
+                self.verify(verifier)
+                ok = True
+        finally:
+            verifier.close()
+            with self.metrics.stage("finish"):
+                finish_stream(target_stream, ok)
+        self.add_log(f"导入完成，传输数据大小：{utils.size_str(cnt)}")
+
+    def run_relay(self, codec) -> bool:
+        self.add_log(f"尝试从{self.image.endpoint.addr}直接传输到{self.host.get_name()}")
+        if integrity.enabled:
+            self.add_log("直接传输的数据不经过本机，不在本机校验，层的diff id由docker load检查，完成后核对镜像ID")
+        with self.metrics.stage("relay") as stage:
+            cnt = self.image.endpoint.relay_image(self.image, self.host.get_endpoint(), codec,
+                                                  self.set_progress_value, self.is_running)
+            # 数据不经过本机，只能得到源主机发送的字节数
+            stage.bytes_in = stage.bytes_out = cnt or 0
+            stage.source = True
+        if cnt is None:
+            self.add_log("两台主机之间无法直接连接，改为经本机中转")
+            return False
+        self.add_log(f"导入完成，传输数据大小：{utils.size_str(cnt)}")
+        return True
+
+    def run_resumable(self, codec):
+        # 源数据先落盘到本机缓存，同时从缓存发送给目标主机；
+        # 源主机中断时从缓存的断点继续读取，目标主机中断时从缓存重新发送
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        path = os.path.join(SPOOL_DIR, self.image.hash().replace(":", "_") + "_" + codec.name + codec.ext)
+        verifier = integrity.StreamVerifier(codec, self.diff_ids)
+        download = ResumableDownload(path, lambda offset: self.throttle(self.metrics.reader(
+                                         self.image.get_stream(codec, offset), "download", source=True),
+                                         [self.image.endpoint.addr, bandwidth.LOCAL]),
+                                     {"image": self.image.hash(), "codec": codec.name},
+                                     self.add_log, self.is_running,
+                                     wrap_writer=lambda f: self.metrics.writer(f, "download"), verifier=verifier)
+
+        def download_thread_main():
+            with self.metrics.stage("download"):
+                run_download(self, download, False)
+        download_thread = threading.Thread(target=download_thread_main, daemon=True)
+        download_thread.start()
+        self.add_log(f"开始将{self.image.name()}导入到{self.host.get_name()}，本机缓存：{path}")
+        cnt = send_spooled(self, download, self.host, self.image, codec, self.set_progress_value)
+        download_thread.join()
+        if self.is_running():
+            self.verify(verifier)
+            os.remove(path)
+            self.add_log(f"导入完成，传输数据大小：{utils.size_str(cnt)}")
+
+    def run_skip_existing_layers(self):
+        self.set_progress_maximum(self.image.size())
+        with self.metrics.stage("prepare"):
+            target = self.host.get_endpoint()
+            diff_ids = self.image.endpoint.get_image_layers(self.image)
+            skip = docker_archive.skippable_diff_ids(diff_ids, target.get_layer_chains())
+        self.add_log(f"开始将{self.image.name()}导入到{self.host.get_name()}")
+        self.add_log(f"镜像大小：{self.image.size_str()}，共{len(set(diff_ids))}层，目标主机已有{len(skip)}层")
+        # 去掉层时在本机解压并重新压缩
+        codec = self.resolve_codec(local=True)
+        with self.metrics.stage("connect"):
+            from_stream = self.image.get_stream(codec)
+            target_stream = target.create_image_stream(self.image, codec, self.add_log)
+        # 在解压后、去掉层之前校验，源主机导出的每一层都要校验
+        verifier = integrity.StreamVerifier(expected=diff_ids)
+        ok = False
+        try:
+            with self.metrics.stage("transfer"):
+                result = docker_archive.filter_layers(self.throttle(self.metrics.reader(from_stream, source=True)),
+                                                      self.metrics.writer(target_stream), skip,
+                                                      on_progress=self.set_progress_value,
+                                                      is_running=self.is_running,
+                                                      codec=codec, wrap_reader=verifier.reader)
+            if self.is_running():
+                check_source(from_stream)
+                self.verify(verifier)
+                ok = True
+        finally:
+            verifier.close()
+            with self.metrics.stage("finish"):
+                finish_stream(target_stream, ok)
+        self.metrics.set(layers_skipped=result.layers_skipped, bytes_skipped=result.bytes_skipped)
+        self.add_log(f"导入完成，跳过{result.layers_skipped}层（{utils.size_str(result.bytes_skipped)}），"
+                     f"发送{utils.size_str(result.bytes_sent)}，"
+                     f"实际传输数据大小：{utils.size_str(result.bytes_on_wire)}")
+
+
+class FanoutTarget:
+    # 多目标转移中的一个目标主机，在任务列表中单独显示进度
+    def __init__(self, image: Image, host: HostItem):
+        self.image = image
+        self.host = host
+        self.state = "waiting"
+
+    def name(self) -> str:
+        return f"  {self.image.name()} → {self.host.get_name()}"
+
+    def rate_limit(self) -> Optional[float]:
+        return bandwidth.manager.limit([bandwidth.LOCAL, self.host.get_addr()])
+
+
+class FanoutSyncTask(BackgroundTask):
+    """
+    把一个镜像同时转移到多台主机，源主机只执行一次docker save。源数据落盘到本机缓存，
+    每台目标主机由单独的线程从缓存读取发送，各自的速度互不影响：慢的主机落后的部分留在缓存中，
+    中断的主机从缓存重新发送，不会拖慢其他主机。
+    """
+
+    def __init__(self, reporter, image: Image, hosts: List[HostItem], codec=None):
+        super().__init__(f"sync {image.name()} to {len(hosts)} hosts", reporter)
+        self.image = image
+        self.hosts = hosts
+        self.codec = codec
+        self.targets = [FanoutTarget(image, x) for x in hosts]
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return [("save", self.image.endpoint.addr)] + [("load", x.get_addr()) for x in self.hosts]
+
+    def start(self):
+        try:
+            super().start()
+        finally:
+            for x in self.hosts:
+                x.inventory.invalidate()
+
+    def kill(self):
+        super().kill()
+        for t in self.targets:
+            if t.state in ("waiting", "running"):
+                t.state = "failed"
+                self.reporter.set_state(t, "failed")
+
+    def run(self):
+        self.metrics.set(source=self.image.endpoint.addr, target=",".join(x.get_addr() for x in self.hosts),
+                         image_bytes=self.image.size())
+        # 每台目标主机的发送另外按[本机, 目标主机]限速
+        self.route = [self.image.endpoint.addr, bandwidth.LOCAL]
+        self.set_progress_maximum(self.image.size())
+        source = self.image.endpoint
+        with self.metrics.stage("prepare"):
+            codec = compression.resolve_all(self.codec or source.codec, source, [x.get_endpoint() for x in self.hosts])
+            diff_ids = image_diff_ids(self, self.image) if integrity.enabled else None
+        self.metrics.set(codec=codec.name)
+        self.add_log(f"压缩方式：{codec.name}")
+        self.reporter.add_tasks(self.targets)
+        for t in self.targets:
+            self.reporter.set_maximum(t, self.image.size())
+
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        path = os.path.join(SPOOL_DIR, "fanout_" + self.image.hash().replace(":", "_") + "_" + codec.name + codec.ext)
+        # 在写入缓存时校验，校验不通过时所有目标主机都停止发送
+        verifier = integrity.StreamVerifier(codec, diff_ids)
+        download = ResumableDownload(path, lambda offset: self.throttle(self.metrics.reader(
+                                         self.image.get_stream(codec, offset), "download", source=True)),
+                                     {"image": self.image.hash(), "codec": codec.name},
+                                     self.add_log, self.is_running, self.set_progress_value,
+                                     chunk_size=FANOUT_CHUNK_SIZE,
+                                     wrap_writer=lambda f: self.metrics.writer(f, "download"), verifier=verifier)
+
+        def download_thread_main():
+            with self.metrics.stage("download"):
+                run_download(self, download, False)
+
+        def send_thread_main(t: FanoutTarget):
+            t.state = "running"
+            self.reporter.set_state(t, t.state)
+            try:
+                send_spooled(self, download, t.host, self.image, codec,
+                             lambda n: self.reporter.update(t, n), t.host.get_name() + " ")
+            except Exception as e:
+                t.state = "failed"
+                self.add_log(f"发送到{t.host.get_name()}失败：{e}")
+                self.reporter.set_state(t, t.state)
+                return
+            if self.is_running():
+                t.state = "done"
+                self.add_log(f"{t.host.get_name()}导入完成")
+                self.reporter.set_state(t, t.state)
+
+        self.add_log(f"开始将{self.image.name()}同时导入到{len(self.hosts)}台主机，本机缓存：{path}")
+        self.add_log(f"镜像大小：{self.image.size_str()}")
+        threads = [threading.Thread(target=download_thread_main, daemon=True)]
+        threads += [threading.Thread(target=send_thread_main, args=(t,), daemon=True) for t in self.targets]
+        for x in threads:
+            x.start()
+        for x in threads:
+            x.join()
+        if download.error is not None:
+            raise download.error
+        if not self.is_running():
+            return
+        self.verify(verifier)
+        os.remove(path)
+        failed = [t.host.get_name() for t in self.targets if t.state == "failed"]
+        self.add_log(f"{len(self.targets) - len(failed)}台主机导入完成，"
+                     f"从源主机传输数据大小：{utils.size_str(self.metrics.wire_bytes())}")
+        if failed:
+            raise RuntimeError(f"{len(failed)}台主机导入失败：{', '.join(failed)}")
+
+
+class DistributeImageTask(BackgroundTask):
+    """
+    在一组Docker CLI主机之间接力分发镜像：已经导入镜像的主机再把镜像直接发给下一台主机（见relay_image），
+    每台主机同一时间只向一台主机发送，空闲的主机立即接手下一台，有镜像的主机数每轮翻倍，
+    N台主机大约需要log2(N+1)轮。本机只负责调度和显示进度，不经手数据。
+    """
+
+    def __init__(self, reporter, image: Image, hosts: List[HostItem], codec=None):
+        super().__init__(f"distribute {image.name()} to {len(hosts)} hosts", reporter)
+        self.image = image
+        self.hosts = hosts
+        self.codec = codec
+        self.targets = [FanoutTarget(image, x) for x in hosts]
+        # 分发路径，每项为(发送方, 接收方)，按完成的顺序
+        self.edges: List[Tuple[str, str]] = []
+
+    def resources(self) -> List[Tuple[str, str]]:
+        return [("save", self.image.endpoint.addr)] + [("load", x.get_addr()) for x in self.hosts]
+
+    def start(self):
+        try:
+            super().start()
+        finally:
+            for x in self.hosts:
+                x.inventory.invalidate()
+
+    def kill(self):
+        super().kill()
+        for t in self.targets:
+            if t.state in ("waiting", "running"):
+                t.state = "failed"
+                self.reporter.set_state(t, "failed")
+
+    def resolve_codec(self) -> compression.Codec:
+        # 每台主机都可能作为发送方压缩、作为接收方解压
+        source = self.image.endpoint
+        targets = [x.get_endpoint() for x in self.hosts]
+        codec = compression.resolve_all(self.codec or source.codec, source, targets)
+        if any(codec.name not in x.get_codecs() for x in targets):
+            codec = compression.CODECS[compression.DEFAULT]
+        return codec
+
+    def run(self):
+        size = self.image.size()
+        # 每台主机各收到一份
+        self.metrics.set(source=self.image.endpoint.addr, target=",".join(x.get_addr() for x in self.hosts),
+                         image_bytes=size * len(self.targets))
+        self.set_progress_maximum(size * len(self.targets))
+        peers = [self.image.endpoint] + [x.get_endpoint() for x in self.hosts]
+        if any(x.type != "Docker CLI" or x.addr == "localhost" for x in peers):
+            raise RuntimeError("接力分发只支持通过SSH连接的Docker CLI主机")
+        with self.metrics.stage("prepare"):
+            codec = self.resolve_codec()
+        self.metrics.set(codec=codec.name)
+        self.add_log(f"压缩方式：{codec.name}")
+        self.add_log(f"开始在{len(self.hosts)}台主机之间接力分发{self.image.name()}，"
+                     f"镜像大小：{self.image.size_str()}，预计{math.ceil(math.log2(len(self.hosts) + 1))}轮")
+        if bandwidth.manager.limit([x.addr for x in peers]) is not None:
+            self.add_log("接力分发的数据不经过本机，设置的限速不起作用")
+        if integrity.enabled:
+            self.add_log("接力分发的数据不经过本机，不在本机校验，层的diff id由docker load检查，完成后核对镜像ID")
+        self.reporter.add_tasks(self.targets)
+        for t in self.targets:
+            self.reporter.set_maximum(t, size)
+
+        source_name = self.image.endpoint.addr
+        # 空闲的、已有镜像的主机：(名称, 端点)
+        idle = [(source_name, self.image.endpoint)]
+        pending = list(self.targets)
+        unreachable = {id(t): set() for t in self.targets}
+        attempts = {id(t): 0 for t in self.targets}
+        depth = {source_name: 0}
+        sent = {id(t): 0 for t in self.targets}
+        cond = threading.Condition()
+        running = 0
+
+        def on_progress(t, n):
+            sent[id(t)] = n
+            self.reporter.update(t, n)
+            self.set_progress_value(sum(sent.values()))
+
+        def transfer(sender, t: FanoutTarget):
+            nonlocal running
+            name, endpoint = sender
+            target = t.host.get_endpoint()
+            image = Image(endpoint, self.image.name(), size, self.image.hash())
+            cnt = None
+            error = None
+            try:
+                with self.metrics.stage(f"{name} → {t.host.get_name()}") as stage:
+                    cnt = endpoint.relay_image(image, target, codec, lambda n: on_progress(t, n), self.is_running)
+                    # 数据不经过本机，只能得到发送方发出的字节数
+                    stage.bytes_in = stage.bytes_out = cnt or 0
+                    stage.source = True
+            except Exception as e:
+                error = e
+            with cond:
+                running -= 1
+                idle.append(sender)
+                cond.notify_all()
+                if not self.is_running():
+                    return
+                if error is None and cnt is not None:
+                    t.state = "done"
+                    depth[t.host.get_name()] = depth[name] + 1
+                    self.edges.append((name, t.host.get_name()))
+                    idle.append((t.host.get_name(), target))
+                    self.add_log(f"{name} → {t.host.get_name()} 完成，{utils.size_str(cnt)}")
+                    self.reporter.set_state(t, "done")
+                elif error is None:
+                    # 两台主机之间不通，换一台已有镜像的主机发送
+                    unreachable[id(t)].add(name)
+                    self.add_log(f"{name}无法直接连接{t.host.get_name()}，改由其他主机发送")
+                    pending.insert(0, t)
+                else:
+                    attempts[id(t)] += 1
+                    self.add_log(f"{name} → {t.host.get_name()} 失败：{error}")
+                    if attempts[id(t)] > resumable.MAX_RETRIES:
+                        t.state = "failed"
+                        self.reporter.set_state(t, "failed")
+                    else:
+                        pending.append(t)
+
+        with cond:
+            while self.is_running():
+                started = False
+                for t in list(pending):
+                    sender = next((x for x in idle if x[0] not in unreachable[id(t)]), None)
+                    if sender is None:
+                        continue
+                    idle.remove(sender)
+                    pending.remove(t)
+                    running += 1
+                    started = True
+                    t.state = "running"
+                    self.reporter.set_state(t, "running")
+                    self.add_log(f"{sender[0]} → {t.host.get_name()} 开始")
+                    threading.Thread(target=transfer, args=(sender, t), daemon=True).start()
+                if running == 0 and not started:
+                    # 没有正在进行的传输，也没有能连接剩余主机的发送方
+                    for t in pending:
+                        t.state = "failed"
+                        self.add_log(f"没有能直接连接{t.host.get_name()}的主机")
+                        self.reporter.set_state(t, "failed")
+                    break
+                cond.wait(1)
+            while running:
+                cond.wait(1)
+
+        if not self.is_running():
+            return
+        done = [t for t in self.targets if t.state == "done"]
+        self.metrics.set(topology=self.edges, rounds=max(depth.values()))
+        self.add_log(f"{len(done)}台主机分发完成，最长经过{max(depth.values())}跳，分发路径：")
+        for sender, receiver in self.edges:
+            self.add_log(f"  {sender} → {receiver}")
+        failed = [t.host.get_name() for t in self.targets if t.state != "done"]
+        if failed:
+            raise RuntimeError(f"{len(failed)}台主机分发失败：{', '.join(failed)}")
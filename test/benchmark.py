@@ -0,0 +1,631 @@
+"""
+传输性能基准测试，不需要docker和网络：
+
+    python test/benchmark.py --size 256M --layers 8 --codecs none,gzip --repeat 3
+    python test/benchmark.py --scenarios sync,ssh-sync --compare bench_results/上次的结果.json
+
+FakeEndpoint即时生成指定大小和层数的docker save归档（内容由seed决定，每次相同），导入时只计数丢弃；
+ssh-*场景在本进程内启动paramiko SSH服务器，用DockerCLIEndpoint连接，远程的docker命令由一个shell脚本代替。
+每个场景记录耗时、MB/s（按未压缩的归档大小计算）、CPU时间和峰值RSS，结果保存为JSON，可以用--compare与之前的结果比较。
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import IO, AnyStr, Callable, Dict, Iterator, List, Optional, Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import docker_archive
+import resumable
+from endpoints import compression
+from endpoints.compression import Codec
+from endpoints.endpoint import Endpoint, Image
+
+BLOCK_SIZE = 1 << 20
+# 数据块池的总大小要超过各压缩算法的窗口，避免重复的块被当作重复数据压缩掉
+POOL_BLOCKS = 16
+RSS_SAMPLE_INTERVAL = 0.05
+SCENARIOS = ["save", "save-store", "load", "sync", "sync-skip", "fanout", "ssh-save", "ssh-load", "ssh-sync"]
+# fanout场景的目标主机数
+FANOUT_TARGETS = 4
+
+
+class SyntheticImage:
+    """
+    旧格式的docker save归档：每层是只包含一个文件的tar，compressibility为每个数据块中0的比例。
+    """
+
+    def __init__(self, size: int, layers: int, compressibility: float = 0.5, seed: int = 1):
+        self.size = size
+        self.layers = max(layers, 1)
+        self.compressibility = compressibility
+        self.seed = seed
+        self.layer_size = max(size // self.layers, 1)
+        self.name = f"bench/synthetic:{size >> 20}m-{self.layers}"
+        rng = random.Random(seed)
+        random_size = int(BLOCK_SIZE * (1 - compressibility))
+        self._blocks = [rng.randbytes(random_size) + b"\0" * (BLOCK_SIZE - random_size) for _ in range(POOL_BLOCKS)]
+        self._diff_ids = None
+
+    def _layer(self, i: int) -> Iterator[bytes]:
+        yield docker_archive.tar_header(f"layer{i}/data", self.layer_size)
+        remain = self.layer_size
+        k = i * 7
+        while remain:
+            d = self._blocks[k % POOL_BLOCKS][:remain]
+            k += 1
+            remain -= len(d)
+            yield d
+        yield docker_archive.tar_padding(self.layer_size)
+        yield docker_archive.tar_end()
+
+    def _layer_tar_size(self) -> int:
+        return 512 + self.layer_size + len(docker_archive.tar_padding(self.layer_size)) + 1024
+
+    def diff_ids(self) -> List[str]:
+        if self._diff_ids is None:
+            ans = []
+            for i in range(self.layers):
+                h = hashlib.sha256()
+                for d in self._layer(i):
+                    h.update(d)
+                ans.append("sha256:" + h.hexdigest())
+            self._diff_ids = ans
+        return self._diff_ids
+
+    def config(self) -> bytes:
+        return json.dumps({"architecture": "amd64", "os": "linux",
+                           "rootfs": {"type": "layers", "diff_ids": self.diff_ids()}}).encode()
+
+    def image_id(self) -> str:
+        return hashlib.sha256(self.config()).hexdigest()[:12]
+
+    def total_size(self) -> int:
+        return self.layers * (512 + self._layer_tar_size()) + 4096
+
+    def chunks(self) -> Iterator[bytes]:
+        paths = []
+        for i in range(self.layers):
+            path = hashlib.sha256(f"{self.seed}-{i}".encode()).hexdigest() + "/layer.tar"
+            paths.append(path)
+            yield docker_archive.tar_header(path, self._layer_tar_size())
+            yield from self._layer(i)
+        config = self.config()
+        config_path = hashlib.sha256(config).hexdigest() + ".json"
+        yield docker_archive.tar_file(config_path, config)
+        manifest = [{"Config": config_path, "RepoTags": [self.name], "Layers": paths}]
+        yield docker_archive.tar_file("manifest.json", json.dumps(manifest).encode())
+        yield docker_archive.tar_end()
+
+
+class _SourceStream(IO[AnyStr]):
+    def __init__(self, f, reader: docker_archive.TarStreamReader, prefix_sha256: str = None):
+        self.f = f
+        self.reader = reader
+        self._prefix_sha256 = prefix_sha256
+
+    def read(self, __n: int = -1) -> AnyStr:
+        return self.f.read(__n)
+
+    def readinto(self, b) -> int:
+        return self.f.readinto(b)
+
+    def close(self) -> None:
+        if self.f is not self.reader:
+            self.f.close()
+
+    def wait(self) -> int:
+        return self.reader.wait()
+
+    def prefix_sha256(self) -> Optional[str]:
+        return self._prefix_sha256
+
+
+class _SinkStream(IO[AnyStr]):
+    # 代替docker load，只统计收到的字节数
+    def __init__(self, endpoint: 'FakeEndpoint'):
+        self.endpoint = endpoint
+
+    def write(self, __s: AnyStr) -> int:
+        self.endpoint.received += len(__s)
+        return len(__s)
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        self.endpoint.aborted = True
+
+    def wait(self) -> int:
+        return 0
+
+
+class FakeEndpoint(Endpoint):
+    """
+    本机内的假主机：导出时生成SyntheticImage的归档，导入时丢弃数据。
+    existing_layers为目标主机上假装已有的前几层，用于测试跳过已有层。
+    """
+
+    def __init__(self, synthetic: SyntheticImage, existing_layers: int = 0):
+        super().__init__("Fake", "", "", "")
+        self.addr = f"fake-{id(self):x}"
+        self.codec = "none"
+        self.synthetic = synthetic
+        self.existing_layers = existing_layers
+        self.received = 0
+        self.aborted = False
+
+    def error(self) -> str:
+        return ""
+
+    def image(self) -> Image:
+        return Image(self, self.synthetic.name, self.synthetic.total_size(), self.synthetic.image_id())
+
+    def get_images(self) -> List[Image]:
+        return [self.image()]
+
+    def get_image_layers(self, image: Image) -> List[str]:
+        return self.synthetic.diff_ids()
+
+    def get_layer_chains(self) -> Set[str]:
+        return set(docker_archive.chain_ids(self.synthetic.diff_ids())[:self.existing_layers])
+
+    def get_codecs(self) -> List[str]:
+        return compression.local_codecs()
+
+    def cpu_count(self) -> int:
+        return os.cpu_count() or 1
+
+    def get_image_stream(self, image: Image, codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        return self.get_images_stream([image], codec, offset)
+
+    def get_images_stream(self, images: List[Image], codec: Codec = None, offset: int = 0) -> IO[AnyStr]:
+        codec = codec or compression.get_codec(self.codec)
+        reader = docker_archive.TarStreamReader(self.synthetic.chunks())
+        f = codec.open_compressor(reader)
+        prefix = resumable.skip_prefix(f, offset)
+        return _SourceStream(f, reader, prefix)
+
+    def create_image_stream(self, image: Image, codec: Codec = None, log=None) -> IO[AnyStr]:
+        return _SinkStream(self)
+
+
+class _NoInventory:
+    def invalidate(self, drop_cursor=False):
+        pass
+
+
+class BenchHost:
+    # 代替HostItem，任务只用到这几个方法
+    def __init__(self, endpoint: Endpoint, name: str):
+        self.endpoint = endpoint
+        self.name = name
+        self.inventory = _NoInventory()
+
+    def get_name(self):
+        return self.name
+
+    def get_addr(self):
+        return self.endpoint.addr
+
+    def get_endpoint(self):
+        return self.endpoint
+
+
+DOCKER_SHIM = """#!/bin/sh
+case "$1" in
+save) exec {python} {script} emit {args} ;;
+load) cat > /dev/null; echo "Loaded image: {name}" ;;
+image) echo '{layers}' ;;
+*) echo "benchmark docker: unsupported $*" >&2; exit 1 ;;
+esac
+"""
+
+
+class BenchSSHServer:
+    """
+    本进程内的paramiko SSH服务器，接受任意密码，在本机用sh执行命令；
+    PATH中放了一个代替docker的脚本，docker save输出SyntheticImage的归档，docker load丢弃数据。
+    """
+
+    def __init__(self, synthetic: SyntheticImage, workdir: str):
+        import paramiko
+        self.paramiko = paramiko
+        self.key = paramiko.RSAKey.generate(2048)
+        bin_dir = os.path.join(workdir, "bin")
+        os.makedirs(bin_dir, exist_ok=True)
+        shim = os.path.join(bin_dir, "docker")
+        args = f"--size {synthetic.size} --layers {synthetic.layers} " \
+               f"--compressibility {synthetic.compressibility} --seed {synthetic.seed}"
+        with open(shim, "w") as f:
+            f.write(DOCKER_SHIM.format(python=sys.executable, script=os.path.abspath(__file__), args=args,
+                                       name=synthetic.name, layers=json.dumps(synthetic.diff_ids())))
+        os.chmod(shim, 0o755)
+        self.env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""))
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        paramiko = self.paramiko
+        server = self
+
+        class Interface(paramiko.ServerInterface):
+            def check_auth_password(self, username, password):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def get_allowed_auths(self, username):
+                return "password"
+
+            def check_channel_request(self, kind, chanid):
+                return paramiko.OPEN_SUCCEEDED
+
+            def check_channel_exec_request(self, channel, command):
+                threading.Thread(target=server._exec, args=(channel, command.decode()), daemon=True).start()
+                return True
+
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.key)
+            try:
+                transport.start_server(server=Interface())
+            except (paramiko.SSHException, EOFError):
+                transport.close()
+
+    def _exec(self, channel, command: str):
+        proc = subprocess.Popen(command, shell=True, env=self.env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def pump_stdin():
+            try:
+                for d in iter(lambda: channel.recv(BLOCK_SIZE), b""):
+                    proc.stdin.write(d)
+            except OSError:
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+
+        def pump_stderr():
+            for d in iter(lambda: proc.stderr.read1(BLOCK_SIZE), b""):
+                channel.sendall_stderr(d)
+        threads = [threading.Thread(target=pump_stdin, daemon=True), threading.Thread(target=pump_stderr)]
+        for t in threads:
+            t.start()
+        try:
+            for d in iter(lambda: proc.stdout.read1(BLOCK_SIZE), b""):
+                channel.sendall(d)
+        except OSError:
+            proc.kill()
+        threads[1].join()
+        channel.send_exit_status(proc.wait())
+        channel.close()
+
+    def endpoint(self) -> Endpoint:
+        from endpoints.docker_cli_endpoint import DockerCLIEndpoint
+        return DockerCLIEndpoint("Docker CLI", f"127.0.0.1:{self.port}", "bench", "bench")
+
+    def close(self):
+        self.sock.close()
+
+
+def _rss() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _live_children_cpu() -> float:
+    # 还没有被回收的子进程（例如仍在运行的压缩命令）的CPU时间，RUSAGE_CHILDREN中不包含这部分
+    total = 0
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return 0
+    for tid in tasks:
+        try:
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids = f.read().split()
+        except OSError:
+            continue
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except (OSError, IndexError, ValueError):
+                continue
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+class Measurement:
+    """
+    测量一段代码的耗时、CPU时间（本进程以及已结束的子进程，例如压缩命令）和本进程的峰值RSS。
+    """
+
+    def __enter__(self):
+        self._stop = threading.Event()
+        self.peak_rss = _rss() or 0
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._self = resource.getrusage(resource.RUSAGE_SELF)
+        self._children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._live = _live_children_cpu()
+        self._start = time.perf_counter()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, _rss() or 0)
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._start
+        me = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        live = _live_children_cpu()
+        self._stop.set()
+        self._sampler.join()
+        self.cpu_user = me.ru_utime - self._self.ru_utime
+        self.cpu_system = me.ru_stime - self._self.ru_stime
+        self.cpu_children = (children.ru_utime - self._children.ru_utime) + \
+                            (children.ru_stime - self._children.ru_stime) + max(live - self._live, 0)
+        if not self.peak_rss:
+            # 没有/proc时只能得到整个进程生命周期内的峰值（Linux上单位为KB）
+            self.peak_rss = me.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        return False
+
+
+class Bench:
+    def __init__(self, synthetic: SyntheticImage, workdir: str):
+        self.synthetic = synthetic
+        self.workdir = workdir
+        self.logs: List[str] = []
+        from progress import ProgressAggregator
+        self.reporter = ProgressAggregator(lambda snapshot: self.logs.extend(snapshot.logs))
+        self._ssh = None
+
+    def ssh(self) -> BenchSSHServer:
+        if self._ssh is None:
+            self._ssh = BenchSSHServer(self.synthetic, self.workdir)
+        return self._ssh
+
+    def close(self):
+        from endpoints import ssh_pool
+        ssh_pool.close_all()
+        if self._ssh is not None:
+            self._ssh.close()
+
+    def _archive_file(self, codec: Codec) -> str:
+        # load场景的输入文件，不计入耗时
+        path = os.path.join(self.workdir, f"input_{self.synthetic.size}_{self.synthetic.layers}{codec.ext}")
+        if not os.path.exists(path):
+            stream = FakeEndpoint(self.synthetic).get_image_stream(None, codec)
+            with open(path + ".tmp", "wb") as f:
+                shutil.copyfileobj(stream, f, BLOCK_SIZE)
+            stream.close()
+            os.replace(path + ".tmp", path)
+        return path
+
+    def prepare(self, scenario: str, codec: Codec) -> Callable[[], object]:
+        """
+        返回运行一次场景的任务，准备工作（生成输入文件、建立SSH连接）在这里完成，不计入耗时。
+        """
+        import tasks
+        reporter = self.reporter
+        out_dir = tempfile.mkdtemp(dir=self.workdir)
+        if scenario == "save":
+            source = FakeEndpoint(self.synthetic)
+            source.codec = codec.name
+            return lambda: tasks.SaveImageTask(reporter, source.image())
+        if scenario == "save-store":
+            source = FakeEndpoint(self.synthetic)
+            source.codec = codec.name
+            return lambda: tasks.SaveImageTask(reporter, source.image(), os.path.join(out_dir, "store"))
+        if scenario == "load":
+            path = self._archive_file(codec)
+            return lambda: tasks.LoadImageTask(reporter, BenchHost(FakeEndpoint(self.synthetic), "fake"), path)
+        if scenario in ("sync", "sync-skip"):
+            source = FakeEndpoint(self.synthetic)
+            existing = self.synthetic.layers // 2 if scenario == "sync-skip" else 0
+            target = BenchHost(FakeEndpoint(self.synthetic, existing), "fake")
+            return lambda: tasks.SyncImageTask(reporter, source.image(), target, scenario == "sync-skip",
+                                                     codec.name)
+        if scenario == "fanout":
+            source = FakeEndpoint(self.synthetic)
+            targets = [BenchHost(FakeEndpoint(self.synthetic), f"fake{i}") for i in range(FANOUT_TARGETS)]
+            return lambda: tasks.FanoutSyncTask(reporter, source.image(), targets, codec.name)
+        if scenario == "ssh-save":
+            source = self.ssh().endpoint()
+            source.codec = codec.name
+            source.get_codecs()
+            image = Image(source, self.synthetic.name, self.synthetic.total_size(), self.synthetic.image_id())
+            return lambda: tasks.SaveImageTask(reporter, image)
+        if scenario == "ssh-load":
+            path = self._archive_file(codec)
+            target = self.ssh().endpoint()
+            target.get_codecs()
+            return lambda: tasks.LoadImageTask(reporter, BenchHost(target, "ssh"), path)
+        if scenario == "ssh-sync":
+            source = self.ssh().endpoint()
+            source.get_codecs()
+            image = Image(source, self.synthetic.name, self.synthetic.total_size(), self.synthetic.image_id())
+            target = BenchHost(FakeEndpoint(self.synthetic), "fake")
+            return lambda: tasks.SyncImageTask(reporter, image, target, codec=codec.name)
+        raise ValueError(f"未知的场景：{scenario}")
+
+    def run(self, scenario: str, codec: Codec) -> dict:
+        make_task = self.prepare(scenario, codec)
+        task = make_task()
+        self.logs.clear()
+        cwd = os.getcwd()
+        # SaveImageTask把文件保存到当前目录
+        os.chdir(tempfile.mkdtemp(dir=self.workdir))
+        try:
+            with Measurement() as m:
+                task.start()
+        finally:
+            os.chdir(cwd)
+        self.reporter.flush(force=True)
+        record = {
+            "scenario": scenario,
+            "codec": codec.name,
+            "size": self.synthetic.size,
+            "layers": self.synthetic.layers,
+            "compressibility": self.synthetic.compressibility,
+            "bytes": self.synthetic.total_size(),
+            "seconds": round(m.seconds, 4),
+            "mb_s": round(self.synthetic.total_size() / (1 << 20) / max(m.seconds, 1e-9), 2),
+            "cpu_user": round(m.cpu_user, 3),
+            "cpu_system": round(m.cpu_system, 3),
+            "cpu_children": round(m.cpu_children, 3),
+            "peak_rss": m.peak_rss,
+            "ok": task.is_finished(),
+        }
+        if not record["ok"]:
+            record["error"] = self.logs[-1] if self.logs else "failed"
+        return record
+
+
+def parse_size(text: str) -> int:
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def summarize(results: List[dict]) -> Dict[tuple, dict]:
+    # 同一场景多次运行取中位数
+    groups: Dict[tuple, List[dict]] = {}
+    for r in results:
+        if r.get("ok"):
+            groups.setdefault((r["scenario"], r["codec"], r["size"], r["layers"]), []).append(r)
+    ans = {}
+    for key, runs in groups.items():
+        ans[key] = {
+            "runs": len(runs),
+            "mb_s": statistics.median(x["mb_s"] for x in runs),
+            "cpu": statistics.median(x["cpu_user"] + x["cpu_system"] + x["cpu_children"] for x in runs),
+            "peak_rss": max(x["peak_rss"] for x in runs),
+        }
+    return ans
+
+
+def print_table(results: List[dict], baseline: Optional[List[dict]] = None):
+    current = summarize(results)
+    previous = summarize(baseline) if baseline else {}
+    print(f"{'scenario':<11}{'codec':<7}{'MB/s':>10}{'CPU s':>9}{'peak RSS':>11}{'vs base':>10}")
+    for key, s in current.items():
+        delta = ""
+        if key in previous and previous[key]["mb_s"]:
+            delta = f"{(s['mb_s'] / previous[key]['mb_s'] - 1) * 100:+.1f}%"
+        print(f"{key[0]:<11}{key[1]:<7}{s['mb_s']:>10.1f}{s['cpu']:>9.2f}"
+              f"{s['peak_rss'] / (1 << 20):>9.0f}MB{delta:>10}")
+    for r in results:
+        if not r.get("ok"):
+            print(f"{r['scenario']} {r['codec']} 失败：{r.get('error')}")
+
+
+def emit(argv: List[str]):
+    # 代替docker save：把归档写到标准输出
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int)
+    parser.add_argument("--layers", type=int)
+    parser.add_argument("--compressibility", type=float)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    out = sys.stdout.buffer
+    for d in SyntheticImage(args.size, args.layers, args.compressibility, args.seed).chunks():
+        out.write(d)
+    out.flush()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "emit":
+        emit(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description="镜像传输基准测试")
+    parser.add_argument("--size", default="256M", help="镜像大小，例如512M、2G")
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--compressibility", type=float, default=0.5, help="数据中0的比例，0为完全随机")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--codecs", default="none,gzip", help="逗号分隔，可用：" + ",".join(compression.CODECS))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔，可用：" + ",".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="结果文件，默认为bench_results/bench_<时间>.json")
+    parser.add_argument("--compare", default=None, help="与之前的结果文件比较")
+    args = parser.parse_args()
+
+    synthetic = SyntheticImage(parse_size(args.size), args.layers, args.compressibility, args.seed)
+    codecs = [compression.CODECS[x] for x in args.codecs.split(",") if x]
+    scenarios = [x for x in args.scenarios.split(",") if x]
+    for x in scenarios:
+        if x not in SCENARIOS:
+            parser.error(f"未知的场景：{x}")
+    missing = [c.name for c in codecs if c.name not in compression.local_codecs()]
+    if missing:
+        parser.error(f"本机缺少压缩工具：{','.join(missing)}")
+
+    workdir = tempfile.mkdtemp(prefix="image_portal_bench_")
+    bench = Bench(synthetic, workdir)
+    results = []
+    try:
+        synthetic.diff_ids()
+        for scenario in scenarios:
+            for codec in codecs:
+                for i in range(args.repeat):
+                    r = bench.run(scenario, codec)
+                    r["run"] = i
+                    results.append(r)
+                    print(f"{scenario:<11}{codec.name:<7}#{i}  {r['mb_s']:>8.1f} MB/s  {r['seconds']:.2f}s"
+                          + ("" if r["ok"] else f"  失败：{r.get('error')}"), flush=True)
+    finally:
+        bench.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join("bench_results", f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf8") as f:
+        json.dump({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                        "cpus": os.cpu_count()},
+            "args": vars(args),
+            "results": results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"结果已保存到{output}")
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf8") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
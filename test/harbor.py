@@ -1,72 +1,30 @@
-import datetime
 import os
-from urllib.parse import urljoin, quote, urlencode
+import sys
 
-import requests
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
+from endpoints.harbor_catalog import HarborCatalog
+from endpoints.registry_client import RegistryClient
 
-class Client(requests.Session):
-    def __init__(self, base_url="https://docker.educg.net/api/v2.0/"):
-        super().__init__()
-        self.base_url = base_url
-        user = os.environ['USER']
-        password = os.environ['PASS']
-        self.auth = (user, password)
 
-    def request(self, method, url, *args, **kwargs):
-        joined_url = urljoin(self.base_url, url)
-        return super().request(method, joined_url, *args, **kwargs)
+def get_repos(catalog: HarborCatalog, proj):
+    # 每个仓库最后推送的tag
+    latest = {}
+    for arti in catalog.list_artifacts([proj]):
+        for name, push_time in arti.tags:
+            if arti.repo not in latest or push_time > latest[arti.repo][1]:
+                latest[arti.repo] = (name, push_time)
+    for repo, (tag, _) in sorted(latest.items()):
+        print(repo + ":" + tag)
 
-    def page(self, url: str, **kwargs):
-        page = 1
-        if kwargs.get('params') is None:
-            kwargs['params'] = {}
-        while True:
-            kwargs['params']['page'] = page
-            kwargs['params']['page_cnt'] = 10
-            ans = self.get(url, **kwargs)
-            if not 200 <= ans.status_code < 300:
-                print(ans.json())
-                return
-            ans = ans.json()
-            if not ans:
-                break
-            for i in ans:
-                yield i
-            page += 1
 
-
-def get_artifacts(proj, repo):
-    ans = []
-    repo = repo.replace(proj + "/", "")
-    repo_url = repo.replace('/', '%252F')
-    for arti in Client().page(f"projects/{quote(proj)}/repositories/{repo_url}/artifacts", params={
-        'with_tag': 'true',
-        'with_label': 'false',
-        'with_scan_overview': 'false',
-        'with_signature': 'false',
-        'with_immutable_status': 'false',
-        'with_accessory': 'false'
-    }):
-        for t in arti['tags']:
-            push_time = datetime.datetime.strptime(t['push_time'], "%Y-%m-%dT%H:%M:%S.%f%z")
-            ans.append((t['name'], push_time))
-    ans = sorted(ans, key=lambda x: x[1])
-    return ans[-1][0]
-
-
-def get_repos(proj):
-    for repo in Client().page(f"projects/{proj}/repositories"):
-        tag = get_artifacts(proj, repo['name'])
-        print(repo['name'] + ":" + tag)
-
-def get_projs():
-    for proj in Client().page("projects", params={"with_detail": "false"}):
-        print(proj['name'])
-        get_repos(proj['name'])
+def get_projs(catalog: HarborCatalog):
+    for proj in catalog.projects():
+        print(proj)
+        get_repos(catalog, proj)
 
 
 if __name__ == '__main__':
-    # get_projs()
-    get_repos('ai4s')
-    # get_artifacts('ai4s', 'ai4s/vnc/ubuntu20.04-test')
\ No newline at end of file
+    catalog = HarborCatalog(RegistryClient("https://docker.educg.net", os.environ['USER'], os.environ['PASS']))
+    # get_projs(catalog)
+    get_repos(catalog, 'ai4s')
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+################################################################################
+## Form generated from reading UI file 'fleet_dialog.ui'
+##
+## Created by: Qt User Interface Compiler version 6.5.2
+##
+## WARNING! All changes made in this file will be lost when recompiling UI file!
+################################################################################
+
+from PySide6.QtCore import (QCoreApplication, QDate, QDateTime, QLocale,
+    QMetaObject, QObject, QPoint, QRect,
+    QSize, QTime, QUrl, Qt)
+from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
+    QFont, QFontDatabase, QGradient, QIcon,
+    QImage, QKeySequence, QLinearGradient, QPainter,
+    QPalette, QPixmap, QRadialGradient, QTransform)
+from PySide6.QtWidgets import (QApplication, QCheckBox, QDialog, QHBoxLayout,
+    QHeaderView, QLabel, QLineEdit, QPushButton,
+    QSizePolicy, QTableView, QVBoxLayout, QWidget)
+
+class Ui_FleetDialog(object):
+    def setupUi(self, FleetDialog):
+        if not FleetDialog.objectName():
+            FleetDialog.setObjectName(u"FleetDialog")
+        FleetDialog.resize(800, 500)
+        self.verticalLayout = QVBoxLayout(FleetDialog)
+        self.verticalLayout.setObjectName(u"verticalLayout")
+        self.horizontalLayout = QHBoxLayout()
+        self.horizontalLayout.setObjectName(u"horizontalLayout")
+        self.filter = QLineEdit(FleetDialog)
+        self.filter.setObjectName(u"filter")
+
+        self.horizontalLayout.addWidget(self.filter)
+
+        self.missing_only = QCheckBox(FleetDialog)
+        self.missing_only.setObjectName(u"missing_only")
+
+        self.horizontalLayout.addWidget(self.missing_only)
+
+        self.refresh_btn = QPushButton(FleetDialog)
+        self.refresh_btn.setObjectName(u"refresh_btn")
+
+        self.horizontalLayout.addWidget(self.refresh_btn)
+
+
+        self.verticalLayout.addLayout(self.horizontalLayout)
+
+        self.image_table = QTableView(FleetDialog)
+        self.image_table.setObjectName(u"image_table")
+
+        self.verticalLayout.addWidget(self.image_table)
+
+        self.status = QLabel(FleetDialog)
+        self.status.setObjectName(u"status")
+
+        self.verticalLayout.addWidget(self.status)
+
+
+        self.retranslateUi(FleetDialog)
+
+        QMetaObject.connectSlotsByName(FleetDialog)
+    # setupUi
+
+    def retranslateUi(self, FleetDialog):
+        FleetDialog.setWindowTitle(QCoreApplication.translate("FleetDialog", u"\u6240\u6709\u4e3b\u673a\u7684\u955c\u50cf", None))
+        self.filter.setPlaceholderText(QCoreApplication.translate("FleetDialog", u"\u6309\u955c\u50cf\u540d\u8fc7\u6ee4", None))
+        self.missing_only.setText(QCoreApplication.translate("FleetDialog", u"\u53ea\u663e\u793a\u6709\u4e3b\u673a\u7f3a\u5c11\u7684\u955c\u50cf", None))
+        self.refresh_btn.setText(QCoreApplication.translate("FleetDialog", u"\u5237\u65b0\u5168\u90e8", None))
+    # retranslateUi
+
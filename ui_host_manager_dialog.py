@@ -15,21 +15,21 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QApplication, QComboBox, QDialog, QGridLayout,
-    QHBoxLayout, QLabel, QLineEdit, QListView,
-    QPushButton, QSizePolicy, QWidget)
+from PySide6.QtWidgets import (QApplication, QCheckBox, QComboBox, QDialog,
+    QGridLayout, QHBoxLayout, QLabel, QLineEdit,
+    QListView, QPushButton, QSizePolicy, QWidget)
 
 class Ui_Dialog(object):
     def setupUi(self, Dialog):
         if not Dialog.objectName():
             Dialog.setObjectName(u"Dialog")
-        Dialog.resize(400, 300)
+        Dialog.resize(400, 410)
         self.host_list = QListView(Dialog)
         self.host_list.setObjectName(u"host_list")
-        self.host_list.setGeometry(QRect(10, 20, 101, 261))
+        self.host_list.setGeometry(QRect(10, 20, 101, 371))
         self.gridLayoutWidget = QWidget(Dialog)
         self.gridLayoutWidget.setObjectName(u"gridLayoutWidget")
-        self.gridLayoutWidget.setGeometry(QRect(120, 20, 271, 201))
+        self.gridLayoutWidget.setGeometry(QRect(120, 20, 271, 331))
         self.gridLayout = QGridLayout(self.gridLayoutWidget)
         self.gridLayout.setObjectName(u"gridLayout")
         self.gridLayout.setContentsMargins(0, 0, 0, 0)
@@ -65,6 +65,9 @@ class Ui_Dialog(object):
 
         self.host_type = QComboBox(self.gridLayoutWidget)
         self.host_type.addItem("")
+        self.host_type.addItem("")
+        self.host_type.addItem("")
+        self.host_type.addItem("")
         self.host_type.setObjectName(u"host_type")
 
         self.gridLayout.addWidget(self.host_type, 0, 1, 1, 1)
@@ -84,9 +87,49 @@ class Ui_Dialog(object):
 
         self.gridLayout.addWidget(self.host_name, 1, 1, 1, 1)
 
+        self.label_6 = QLabel(self.gridLayoutWidget)
+        self.label_6.setObjectName(u"label_6")
+
+        self.gridLayout.addWidget(self.label_6, 5, 0, 1, 1)
+
+        self.host_codec = QComboBox(self.gridLayoutWidget)
+        self.host_codec.setObjectName(u"host_codec")
+
+        self.gridLayout.addWidget(self.host_codec, 5, 1, 1, 1)
+
+        self.label_7 = QLabel(self.gridLayoutWidget)
+        self.label_7.setObjectName(u"label_7")
+
+        self.gridLayout.addWidget(self.label_7, 6, 0, 1, 1)
+
+        self.host_rate_limit = QLineEdit(self.gridLayoutWidget)
+        self.host_rate_limit.setObjectName(u"host_rate_limit")
+
+        self.gridLayout.addWidget(self.host_rate_limit, 6, 1, 1, 1)
+
+        self.label_8 = QLabel(self.gridLayoutWidget)
+        self.label_8.setObjectName(u"label_8")
+
+        self.gridLayout.addWidget(self.label_8, 7, 0, 1, 1)
+
+        self.host_link_limits = QLineEdit(self.gridLayoutWidget)
+        self.host_link_limits.setObjectName(u"host_link_limits")
+
+        self.gridLayout.addWidget(self.host_link_limits, 7, 1, 1, 1)
+
+        self.label_9 = QLabel(self.gridLayoutWidget)
+        self.label_9.setObjectName(u"label_9")
+
+        self.gridLayout.addWidget(self.label_9, 8, 0, 1, 1)
+
+        self.host_insecure = QCheckBox(self.gridLayoutWidget)
+        self.host_insecure.setObjectName(u"host_insecure")
+
+        self.gridLayout.addWidget(self.host_insecure, 8, 1, 1, 1)
+
         self.horizontalLayoutWidget = QWidget(Dialog)
         self.horizontalLayoutWidget.setObjectName(u"horizontalLayoutWidget")
-        self.horizontalLayoutWidget.setGeometry(QRect(120, 250, 271, 31))
+        self.horizontalLayoutWidget.setGeometry(QRect(120, 360, 271, 31))
         self.horizontalLayout = QHBoxLayout(self.horizontalLayoutWidget)
         self.horizontalLayout.setObjectName(u"horizontalLayout")
         self.horizontalLayout.setContentsMargins(0, 0, 0, 0)
@@ -110,7 +153,11 @@ class Ui_Dialog(object):
         QWidget.setTabOrder(self.host_name, self.host_addr)
         QWidget.setTabOrder(self.host_addr, self.host_user)
         QWidget.setTabOrder(self.host_user, self.host_pass)
-        QWidget.setTabOrder(self.host_pass, self.host_add_btn)
+        QWidget.setTabOrder(self.host_pass, self.host_codec)
+        QWidget.setTabOrder(self.host_codec, self.host_rate_limit)
+        QWidget.setTabOrder(self.host_rate_limit, self.host_link_limits)
+        QWidget.setTabOrder(self.host_link_limits, self.host_insecure)
+        QWidget.setTabOrder(self.host_insecure, self.host_add_btn)
         QWidget.setTabOrder(self.host_add_btn, self.host_delete_btn)
         QWidget.setTabOrder(self.host_delete_btn, self.host_save_btn)
 
@@ -125,9 +172,22 @@ class Ui_Dialog(object):
         self.label_3.setText(QCoreApplication.translate("Dialog", u"\u5730\u5740", None))
         self.label_2.setText(QCoreApplication.translate("Dialog", u"\u5bc6\u7801", None))
         self.host_type.setItemText(0, QCoreApplication.translate("Dialog", u"Docker CLI", None))
+        self.host_type.setItemText(1, QCoreApplication.translate("Dialog", u"Docker API", None))
+        self.host_type.setItemText(2, QCoreApplication.translate("Dialog", u"Registry", None))
+        self.host_type.setItemText(3, QCoreApplication.translate("Dialog", u"Harbor", None))
 
         self.label.setText(QCoreApplication.translate("Dialog", u"\u7c7b\u578b", None))
         self.label_5.setText(QCoreApplication.translate("Dialog", u"\u540d\u79f0", None))
+        self.label_6.setText(QCoreApplication.translate("Dialog", u"\u538b\u7f29", None))
+        self.label_7.setText(QCoreApplication.translate("Dialog", u"\u9650\u901fMB/s", None))
+        self.host_rate_limit.setPlaceholderText(QCoreApplication.translate("Dialog", u"\u4e0d\u9650\u901f", None))
+        self.label_8.setText(QCoreApplication.translate("Dialog", u"\u94fe\u8def\u9650\u901f", None))
+        self.host_link_limits.setPlaceholderText(QCoreApplication.translate("Dialog", u"\u5bf9\u7aef\u5730\u5740=MB/s\uff0c\u5982 localhost=10, 10.0.0.2=5", None))
+        self.label_9.setText(QCoreApplication.translate("Dialog", u"\u8bc1\u4e66", None))
+#if QT_CONFIG(tooltip)
+        self.host_insecure.setToolTip(QCoreApplication.translate("Dialog", u"\u53ea\u5bf9Registry\u3001Harbor\u6709\u6548", None))
+#endif // QT_CONFIG(tooltip)
+        self.host_insecure.setText(QCoreApplication.translate("Dialog", u"\u4e0d\u6821\u9a8cTLS\u8bc1\u4e66\uff08\u81ea\u7b7e\u540d\u8bc1\u4e66\uff09", None))
         self.host_add_btn.setText(QCoreApplication.translate("Dialog", u"\u6dfb\u52a0", None))
         self.host_delete_btn.setText(QCoreApplication.translate("Dialog", u"\u5220\u9664", None))
         self.host_save_btn.setText(QCoreApplication.translate("Dialog", u"\u4fdd\u5b58", None))
@@ -65,11 +65,26 @@ class Ui_MainWindow(object):
 
         self.horizontalLayout.addWidget(self.refresh_btn)
 
+        self.fleet_btn = QPushButton(self.centralwidget)
+        self.fleet_btn.setObjectName(u"fleet_btn")
+
+        self.horizontalLayout.addWidget(self.fleet_btn)
+
         self.save_to_file_btn = QPushButton(self.centralwidget)
         self.save_to_file_btn.setObjectName(u"save_to_file_btn")
 
         self.horizontalLayout.addWidget(self.save_to_file_btn)
 
+        self.batch_save_btn = QPushButton(self.centralwidget)
+        self.batch_save_btn.setObjectName(u"batch_save_btn")
+
+        self.horizontalLayout.addWidget(self.batch_save_btn)
+
+        self.store_save_btn = QPushButton(self.centralwidget)
+        self.store_save_btn.setObjectName(u"store_save_btn")
+
+        self.horizontalLayout.addWidget(self.store_save_btn)
+
         self.load_from_file_btn = QPushButton(self.centralwidget)
         self.load_from_file_btn.setObjectName(u"load_from_file_btn")
 
@@ -100,7 +115,10 @@ class Ui_MainWindow(object):
         self.actionExit.setText(QCoreApplication.translate("MainWindow", u"\u9000\u51fa", None))
         self.host_manager_btn.setText(QCoreApplication.translate("MainWindow", u"\u4e3b\u673a\u7ba1\u7406", None))
         self.refresh_btn.setText(QCoreApplication.translate("MainWindow", u"\u5237\u65b0\u955c\u50cf\u5217\u8868", None))
+        self.fleet_btn.setText(QCoreApplication.translate("MainWindow", u"\u6240\u6709\u4e3b\u673a", None))
         self.save_to_file_btn.setText(QCoreApplication.translate("MainWindow", u"\u4fdd\u5b58\u4e3a\u6587\u4ef6", None))
+        self.batch_save_btn.setText(QCoreApplication.translate("MainWindow", u"\u5408\u5e76\u4fdd\u5b58", None))
+        self.store_save_btn.setText(QCoreApplication.translate("MainWindow", u"\u4fdd\u5b58\u5230\u955c\u50cf\u5e93", None))
         self.load_from_file_btn.setText(QCoreApplication.translate("MainWindow", u"\u4ece\u6587\u4ef6\u5bfc\u5165", None))
         self.sync_to_host_htn.setText(QCoreApplication.translate("MainWindow", u"\u540c\u6b65\u5230\u4e3b\u673a", None))
     # retranslateUi
@@ -15,15 +15,16 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QAbstractButton, QApplication, QComboBox, QDialog,
-    QDialogButtonBox, QLabel, QSizePolicy, QVBoxLayout,
-    QWidget)
+from PySide6.QtWidgets import (QAbstractButton, QAbstractItemView, QApplication, QCheckBox,
+    QComboBox, QDialog, QDialogButtonBox, QHBoxLayout,
+    QLabel, QListWidget, QListWidgetItem, QSizePolicy,
+    QVBoxLayout, QWidget)
 
 class Ui_SelectHost(object):
     def setupUi(self, SelectHost):
         if not SelectHost.objectName():
             SelectHost.setObjectName(u"SelectHost")
-        SelectHost.resize(184, 110)
+        SelectHost.resize(184, 218)
         self.verticalLayout = QVBoxLayout(SelectHost)
         self.verticalLayout.setObjectName(u"verticalLayout")
         self.label = QLabel(SelectHost)
@@ -31,11 +32,48 @@ class Ui_SelectHost(object):
 
         self.verticalLayout.addWidget(self.label)
 
-        self.host_list = QComboBox(SelectHost)
+        self.host_list = QListWidget(SelectHost)
         self.host_list.setObjectName(u"host_list")
+        self.host_list.setSelectionMode(QAbstractItemView.MultiSelection)
 
         self.verticalLayout.addWidget(self.host_list)
 
+        self.codec_layout = QHBoxLayout()
+        self.codec_layout.setObjectName(u"codec_layout")
+        self.codec_label = QLabel(SelectHost)
+        self.codec_label.setObjectName(u"codec_label")
+
+        self.codec_layout.addWidget(self.codec_label)
+
+        self.codec = QComboBox(SelectHost)
+        self.codec.setObjectName(u"codec")
+
+        self.codec_layout.addWidget(self.codec)
+
+
+        self.verticalLayout.addLayout(self.codec_layout)
+
+        self.skip_existing_layers = QCheckBox(SelectHost)
+        self.skip_existing_layers.setObjectName(u"skip_existing_layers")
+
+        self.verticalLayout.addWidget(self.skip_existing_layers)
+
+        self.relay = QCheckBox(SelectHost)
+        self.relay.setObjectName(u"relay")
+        self.relay.setChecked(True)
+
+        self.verticalLayout.addWidget(self.relay)
+
+        self.resumable = QCheckBox(SelectHost)
+        self.resumable.setObjectName(u"resumable")
+
+        self.verticalLayout.addWidget(self.resumable)
+
+        self.p2p = QCheckBox(SelectHost)
+        self.p2p.setObjectName(u"p2p")
+
+        self.verticalLayout.addWidget(self.p2p)
+
         self.buttonBox = QDialogButtonBox(SelectHost)
         self.buttonBox.setObjectName(u"buttonBox")
         self.buttonBox.setOrientation(Qt.Horizontal)
@@ -53,6 +91,11 @@ class Ui_SelectHost(object):
 
     def retranslateUi(self, SelectHost):
         SelectHost.setWindowTitle(QCoreApplication.translate("SelectHost", u"Dialog", None))
-        self.label.setText(QCoreApplication.translate("SelectHost", u"\u9009\u62e9\u76ee\u6807\u4e3b\u673a", None))
+        self.label.setText(QCoreApplication.translate("SelectHost", u"\u9009\u62e9\u76ee\u6807\u4e3b\u673a\uff08\u53ef\u591a\u9009\uff09", None))
+        self.codec_label.setText(QCoreApplication.translate("SelectHost", u"\u538b\u7f29", None))
+        self.skip_existing_layers.setText(QCoreApplication.translate("SelectHost", u"\u8df3\u8fc7\u76ee\u6807\u4e3b\u673a\u5df2\u6709\u7684\u5c42", None))
+        self.relay.setText(QCoreApplication.translate("SelectHost", u"\u8fdc\u7a0b\u4e3b\u673a\u4e4b\u95f4\u76f4\u63a5\u4f20\u8f93", None))
+        self.resumable.setText(QCoreApplication.translate("SelectHost", u"\u65ad\u70b9\u7eed\u4f20\uff08\u5728\u672c\u673a\u7f13\u5b58\u6570\u636e\uff09", None))
+        self.p2p.setText(QCoreApplication.translate("SelectHost", u"\u591a\u53f0\u76ee\u6807\u4e3b\u673a\u4e4b\u95f4\u63a5\u529b\u5206\u53d1", None))
     # retranslateUi
 
@@ -15,8 +15,9 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QApplication, QDialog, QPlainTextEdit, QProgressBar,
-    QSizePolicy, QVBoxLayout, QWidget)
+from PySide6.QtWidgets import (QApplication, QDialog, QDoubleSpinBox, QHBoxLayout,
+    QLabel, QPlainTextEdit, QProgressBar, QSizePolicy,
+    QVBoxLayout, QWidget)
 
 class Ui_Dialog(object):
     def setupUi(self, Dialog):
@@ -35,6 +36,23 @@ class Ui_Dialog(object):
 
         self.verticalLayout.addWidget(self.log_text)
 
+        self.limit_layout = QHBoxLayout()
+        self.limit_layout.setObjectName(u"limit_layout")
+        self.limit_label = QLabel(Dialog)
+        self.limit_label.setObjectName(u"limit_label")
+
+        self.limit_layout.addWidget(self.limit_label)
+
+        self.global_limit = QDoubleSpinBox(Dialog)
+        self.global_limit.setObjectName(u"global_limit")
+        self.global_limit.setDecimals(1)
+        self.global_limit.setMaximum(100000.000000000000000)
+
+        self.limit_layout.addWidget(self.global_limit)
+
+
+        self.verticalLayout.addLayout(self.limit_layout)
+
         self.progress_bar = QProgressBar(Dialog)
         self.progress_bar.setObjectName(u"progress_bar")
         self.progress_bar.setMaximum(1000)
@@ -50,5 +68,6 @@ class Ui_Dialog(object):
 
     def retranslateUi(self, Dialog):
         Dialog.setWindowTitle(QCoreApplication.translate("Dialog", u"Dialog", None))
+        self.limit_label.setText(QCoreApplication.translate("Dialog", u"\u603b\u9650\u901fMB/s\uff080\u4e3a\u4e0d\u9650\u901f\uff09", None))
     # retranslateUi
 